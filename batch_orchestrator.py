@@ -0,0 +1,491 @@
+"""
+オーケストレーターのバッチ実行（大量の入力を1プロセスでまとめて処理）。
+
+  python batch_orchestrator.py -f prompts.jsonl -o results.jsonl -r idea_ai,writer_ai,proof_ai --workers 8
+  type prompts.txt | python batch_orchestrator.py -f - -o results.jsonl
+  python batch_orchestrator.py -f prompts.csv -o results.jsonl --batch-api   # OpenAI Batch API（最大24時間・低料金）
+
+入力:
+  JSONL  1行1件 {"id": "...", "input": "..."}（input の代わりに prompt / text でも可, 文字列だけの行も可）
+  CSV    ヘッダーに input / prompt / text 列（任意で id 列）
+  テキスト  1行1件（-f - の標準入力は "{" で始まる行を JSON、それ以外をテキストとして読む）
+id が無い件は行番号を id にする（入力ファイルを書き換えずに再実行すれば同じ id になる）。
+
+結果は -o の JSONL に1件終わるごとに追記する（id, status, input, final, run_id, steps）。
+同じ -o で再実行すると status=ok の id は飛ばすので、途中で落ちても終わった分はやり直さない。
+失敗した件（status=error）は次の実行でもう一度処理する。
+
+--batch-api では段ごとに全件の要求を1つのバッチとして投げ、完了を待って次の段へ進む。
+投げたバッチの id は <出力>.batch.json に保存し、再実行時は投げ直さずに同じバッチを待つ。
+バッチで使えるのは OpenAI 向けの役割カードだけ（recommended_api が openai 以外ならエラー）。
+
+件数が多いときは LLM_RPM_<MODEL>（llm_providers.py）を API の上限に合わせて上げること。
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import metrics
+from conversation_builder import role_messages
+from llm_cache import get_cache, request_key
+from multi_agent_orchestrator import (DEFAULT_MAX_CONCURRENCY, OrchestratorEngine, PipelineResult,
+                                      RoleResult, log_step, merge_outputs, new_run_id)
+
+TEXT_FIELDS = ("input", "prompt", "text")
+TEMPERATURE = 0.4  # complete_role と同じ（キャッシュのキーを揃える）
+FSYNC_INTERVAL = 5.0
+
+Item = Tuple[str, str]  # (id, 入力テキスト)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# ---------------------------------------------------------------- 入力
+
+def _pick(obj: dict) -> str:
+    for k in TEXT_FIELDS:
+        if obj.get(k):
+            return str(obj[k])
+    return ""
+
+
+def _format_of(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".txt": "text"}.get(ext, "auto")
+
+
+def read_items(path: str, fmt: Optional[str] = None) -> Iterator[Item]:
+    """入力を1件ずつ読む（ファイル全体は読み込まない）。"""
+    fmt = _format_of(path, fmt)
+    if path == "-":
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    else:
+        f = open(path, "r", encoding="utf-8-sig", newline="")
+    with f:
+        if fmt == "csv":
+            for n, row in enumerate(csv.DictReader(f), 1):
+                text = _pick(row)
+                if text.strip():
+                    yield (row.get("id") or str(n)).strip(), text
+            return
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if fmt == "jsonl" or (fmt == "auto" and line.startswith("{")):
+                try:
+                    obj = json.loads(line)
+                except ValueError as e:
+                    raise SystemExit(f"{path}:{n}: JSON として読めません: {e}")
+                if isinstance(obj, str):
+                    obj = {"input": obj}
+                text = _pick(obj)
+                if text.strip():
+                    yield str(obj.get("id") or n), text
+            else:
+                yield str(n), line
+
+
+# ---------------------------------------------------------------- 結果（チェックポイント）
+
+def load_done(path: str) -> set:
+    """出力ファイルから status=ok の id を集める。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # 落ちたときの書きかけの行
+            if rec.get("status") == "ok":
+                done.add(str(rec.get("id")))
+    return done
+
+
+class ResultWriter:
+    """1件ごとに追記して flush する（プロセスが落ちても書いた分は残る）。"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.f = open(path, "a+b")
+        self.f.seek(0, os.SEEK_END)
+        if self.f.tell():
+            self.f.seek(-1, os.SEEK_END)
+            if self.f.read(1) != b"\n":  # 書きかけの行の後ろに続けない
+                self.f.write(b"\n")
+        self._synced = time.monotonic()
+
+    def write(self, rec: dict) -> None:
+        self.f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.f.flush()
+        if time.monotonic() - self._synced >= FSYNC_INTERVAL:
+            os.fsync(self.f.fileno())
+            self._synced = time.monotonic()
+
+    def close(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+
+def _step_dict(s: RoleResult) -> dict:
+    return {"role": s.role, "stage": s.stage, "reducer": s.reducer, "model": s.model,
+            "latency": round(s.latency, 3), "tokens": s.usage or None, "cached": s.cached,
+            "output": s.output}
+
+
+def record_of(item_id: str, result: PipelineResult, elapsed: float) -> dict:
+    return {"id": item_id, "status": "ok", "input": result.input, "final": result.final,
+            "run_id": result.run_id, "elapsed": round(elapsed, 3),
+            "ts": datetime.datetime.now().isoformat(),
+            "steps": [_step_dict(s) for s in result.steps]}
+
+
+def error_record(item_id: str, text: str, error: str) -> dict:
+    return {"id": item_id, "status": "error", "input": text, "error": error,
+            "ts": datetime.datetime.now().isoformat()}
+
+
+# ---------------------------------------------------------------- 通常実行（ワーカープール）
+
+def run_pool(engine: OrchestratorEngine, items: Iterable[Item], writer: ResultWriter,
+             roles: List[str], mode: str = "chain", reducer: Optional[str] = None,
+             workers: int = 4, done: Optional[set] = None) -> Dict[str, int]:
+    """
+    items を workers 本のスレッドで並列に処理する。
+    投入は workers の2倍までに抑え、入力を先読みしすぎない（標準入力・巨大ファイル対策）。
+    """
+    done = done or set()
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+    started = time.perf_counter()
+
+    def work(item_id: str, text: str) -> dict:
+        t0 = time.perf_counter()
+        try:
+            result = engine.run(text, roles, mode=mode, reducer=reducer)
+        except Exception as e:
+            return error_record(item_id, text, f"{type(e).__name__}: {e}")
+        return record_of(item_id, result, time.perf_counter() - t0)
+
+    def collect(futures) -> None:
+        for fut in futures:
+            rec = fut.result()
+            writer.write(rec)
+            counts[rec["status"]] += 1
+            metrics.inc("batch_items_total", status=rec["status"])
+            n = counts["ok"] + counts["error"]
+            note = f"{rec.get('elapsed', 0):.1f}s" if rec["status"] == "ok" else rec["error"][:120]
+            print(f"[{n}] {rec['id']} {rec['status']} {note}  "
+                  f"({n / max(time.perf_counter() - started, 1e-9):.2f} 件/秒)", flush=True)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as ex:
+        pending = set()
+        for item_id, text in items:
+            if item_id in done:
+                counts["skipped"] += 1
+                continue
+            done.add(item_id)  # 入力内の重複 id も1回だけ処理する
+            pending.add(ex.submit(work, item_id, text))
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    return counts
+
+
+# ---------------------------------------------------------------- OpenAI Batch API
+
+class BatchAPIRunner:
+    """
+    段（ステージ）ごとに全件の要求を OpenAI Batch API に投げて処理する。
+    同じ要求が応答キャッシュにあれば投げずに使い、受け取った応答はキャッシュに入れる。
+    """
+
+    def __init__(self, engine: OrchestratorEngine, state_path: str, poll_interval: float = 30.0):
+        self.engine = engine
+        self.client = engine.router.provider("openai").client
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.state: dict = {}
+
+    # -- 状態（投げたバッチの id）
+    def _load_state(self, digest: str) -> None:
+        self.state = {"digest": digest, "rounds": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("digest") == digest:  # 入力・役割が同じときだけ続きから
+                self.state = saved
+
+    def _save_state(self) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.state_path)
+
+    # -- 1ラウンド（同じ段の要求をまとめて1バッチ）
+    def _request(self, role: str, prompt: str) -> Tuple[str, list]:
+        card = self.engine.cards[role]
+        model = self.engine.router.resolve(card=card, model=self.engine.model_for(card))[1]
+        # complete_role と同じ並び（共有の前置き → 役割の指示 → 入力）でキャッシュのキーを揃える
+        messages = role_messages(card.get("system_prompt", ""), prompt, self.engine.shared)
+        return model, messages
+
+    def run_round(self, name: str, requests: List[Tuple[str, str, str]]) -> Dict[Tuple[str, str], dict]:
+        """
+        requests: (item_id, role, prompt) の一覧。
+        戻り値: (item_id, role) -> {"text", "model", "usage", "cached"} または {"error"}
+        """
+        cache = get_cache()
+        results: Dict[Tuple[str, str], dict] = {}
+        lines: List[bytes] = []
+        keys: Dict[str, Tuple[str, str, str, str]] = {}
+        for item_id, role, prompt in requests:
+            model, messages = self._request(role, prompt)
+            key = request_key(model, messages, TEMPERATURE)
+            hit = cache.get(key)
+            if hit is not None:
+                metrics.inc("llm_cache_hits_total", model=model)
+                results[(item_id, role)] = {"text": hit, "model": model, "usage": {}, "cached": True}
+                continue
+            custom_id = f"{item_id}:{role}"  # 再実行時も同じ値になるよう連番は使わない
+            keys[custom_id] = (item_id, role, model, key)
+            body = {"model": model, "messages": messages, "temperature": TEMPERATURE}
+            lines.append(json.dumps({"custom_id": custom_id, "method": "POST",
+                                     "url": "/v1/chat/completions", "body": body},
+                                    ensure_ascii=False).encode("utf-8"))
+        if not lines:
+            return results
+
+        batch_id = self.state["rounds"].get(name)
+        if batch_id is None:
+            upload = self.client.files.create(file=(f"{name}.jsonl", b"\n".join(lines) + b"\n"),
+                                              purpose="batch")
+            batch = self.client.batches.create(input_file_id=upload.id,
+                                               endpoint="/v1/chat/completions",
+                                               completion_window="24h",
+                                               metadata={"source": "batch_orchestrator", "round": name})
+            batch_id = batch.id
+            self.state["rounds"][name] = batch_id
+            self._save_state()
+            print(f"[batch] {name}: {batch_id} に {len(lines)} 件を投入", flush=True)
+        else:
+            print(f"[batch] {name}: 投入済みの {batch_id} を待機", flush=True)
+
+        batch = self._wait(name, batch_id)
+        if batch.output_file_id:
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                if line.strip():
+                    self._take(json.loads(line), keys, results, cache)
+        if batch.error_file_id:
+            for line in self.client.files.content(batch.error_file_id).text.splitlines():
+                if line.strip():
+                    self._take(json.loads(line), keys, results, cache)
+        for custom_id, (item_id, role, _, _) in keys.items():
+            results.setdefault((item_id, role), {"error": f"batch {batch_id} ({batch.status}) に応答なし"})
+        return results
+
+    def _wait(self, name: str, batch_id: str):
+        last = None
+        while True:
+            try:
+                batch = self.client.batches.retrieve(batch_id)
+            except Exception as e:  # 一時的な失敗は次の確認で取り直す
+                print(f"[batch] {name}: 状態の取得に失敗 ({e})", flush=True)
+                time.sleep(self.poll_interval)
+                continue
+            counts = batch.request_counts
+            status = (batch.status, counts.completed if counts else None, counts.failed if counts else None)
+            if status != last:
+                done_n = f" {counts.completed}/{counts.total} (失敗 {counts.failed})" if counts else ""
+                print(f"[batch] {name}: {batch.status}{done_n}", flush=True)
+                last = status
+            if batch.status in ("completed", "failed", "expired", "cancelled"):
+                return batch
+            time.sleep(self.poll_interval)
+
+    @staticmethod
+    def _take(rec: dict, keys: dict, results: dict, cache) -> None:
+        meta = keys.get(rec.get("custom_id"))
+        if meta is None:
+            return
+        item_id, role, model, key = meta
+        resp = rec.get("response") or {}
+        body = resp.get("body") or {}
+        if rec.get("error") or resp.get("status_code") != 200:
+            err = rec.get("error") or body.get("error") or resp.get("status_code")
+            results[(item_id, role)] = {"error": json.dumps(err, ensure_ascii=False)}
+            metrics.inc("llm_errors_total", provider="openai", model=model)
+            return
+        text = ((body.get("choices") or [{}])[0].get("message") or {}).get("content") or ""
+        usage = {}
+        if body.get("usage"):
+            u = body["usage"]
+            usage = {"prompt_tokens": u.get("prompt_tokens"), "completion_tokens": u.get("completion_tokens")}
+            cached = (u.get("prompt_tokens_details") or {}).get("cached_tokens")
+            if cached is not None:
+                usage["cached_tokens"] = cached
+            metrics.record_usage("openai", model, usage)
+        cache.put(key, model, text)
+        results[(item_id, role)] = {"text": text, "model": body.get("model") or model,
+                                    "usage": usage, "cached": False}
+
+    # -- パイプライン
+    def run(self, items: List[Item], roles: List[str], mode: str = "chain",
+            reducer: Optional[str] = None) -> Iterator[dict]:
+        engine = self.engine
+        stages = engine.stages_for(roles, mode, reducer)
+        used = [r for g in stages for r in g] + ([reducer] if reducer else [])
+        others = [r for r in used if engine.router.provider_for(engine.cards[r]) != "openai"]
+        if others:
+            raise ValueError(f"--batch-api は OpenAI 向けの役割のみ対応: {', '.join(sorted(set(others)))}")
+        digest = hashlib.sha1(json.dumps([[i for i, _ in items], roles, mode, reducer],
+                                         ensure_ascii=False).encode("utf-8")).hexdigest()
+        self._load_state(digest)
+
+        texts = dict(items)
+        current = dict(items)
+        steps: Dict[str, List[RoleResult]] = {i: [] for i, _ in items}
+        failed: Dict[str, str] = {}
+
+        def step_of(item_id: str, role: str, prompt: str, res: dict, stage: int,
+                    is_reducer: bool = False) -> str:
+            card = engine.cards[role]
+            s = RoleResult(role, card.get("title", role), prompt, res["text"].strip(), stage,
+                           reducer=is_reducer, model=res["model"], usage=dict(res["usage"]),
+                           cached=res["cached"])
+            steps[item_id].append(s)
+            return s.output
+
+        for i, stage in enumerate(stages):
+            live = [item_id for item_id in current if item_id not in failed]
+            prompts = {item_id: engine.fit_input(texts[item_id], current[item_id], stage) if i
+                       else current[item_id] for item_id in live}
+            out = self.run_round(f"stage{i}", [(item_id, r, prompts[item_id])
+                                               for item_id in live for r in stage])
+            merged_in: Dict[str, str] = {}
+            for item_id in live:
+                errs = [out[(item_id, r)]["error"] for r in stage if "error" in out[(item_id, r)]]
+                if errs:
+                    failed[item_id] = f"stage {i}: {errs[0]}"
+                    continue
+                outs = [(r, step_of(item_id, r, prompts[item_id], out[(item_id, r)], i)) for r in stage]
+                if len(stage) == 1:
+                    current[item_id] = outs[0][1]
+                else:
+                    current[item_id] = merge_outputs(engine.cards, outs)
+                    if reducer:
+                        merged_in[item_id] = engine.fit_input(texts[item_id], current[item_id], [reducer])
+            if merged_in:
+                out = self.run_round(f"stage{i}-reduce", [(item_id, reducer, p)
+                                                          for item_id, p in merged_in.items()])
+                for item_id, prompt in merged_in.items():
+                    res = out[(item_id, reducer)]
+                    if "error" in res:
+                        failed[item_id] = f"stage {i} reducer: {res['error']}"
+                    else:
+                        current[item_id] = step_of(item_id, reducer, prompt, res, i, is_reducer=True)
+
+        for item_id, text in items:
+            if item_id in failed:
+                yield error_record(item_id, text, failed[item_id])
+                continue
+            result = PipelineResult(input=text, final=current[item_id], steps=steps[item_id],
+                                    run_id=new_run_id())
+            if engine.log:
+                for s in result.steps:
+                    log_step(result.run_id, s)
+            yield record_of(item_id, result, 0.0)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+
+# ---------------------------------------------------------------- CLI
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="オーケストレーターのバッチ実行")
+    ap.add_argument("-f", "--file", required=True, help="入力（JSONL / CSV / テキスト, - で標準入力）")
+    ap.add_argument("-o", "--output", required=True, help="結果の JSONL（再実行時のチェックポイントを兼ねる）")
+    ap.add_argument("--format", choices=["jsonl", "csv", "text", "auto"], default=None,
+                    help="入力形式（省略時は拡張子から判定）")
+    ap.add_argument("-r", "--roles", default="idea_ai,writer_ai,proof_ai",
+                    help="comma-separated role ids ('|' で束ねた役割は並列実行)")
+    ap.add_argument("-m", "--mode", choices=["chain", "fanout"], default="chain")
+    ap.add_argument("--reducer", default=None, help="並列ステージの出力をまとめる役割 id")
+    ap.add_argument("-w", "--workers", type=int, default=_env_int("BATCH_WORKERS", 4),
+                    help="同時に処理する件数（既定 BATCH_WORKERS または 4）")
+    ap.add_argument("--max-concurrency", type=int,
+                    default=_env_int("ORCH_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY),
+                    help="1件の並列ステージ内で同時に投げるリクエスト数の上限")
+    ap.add_argument("--batch-api", action="store_true",
+                    help="OpenAI Batch API で処理する（急がない大量処理向け, 完了まで最大24時間）")
+    ap.add_argument("--poll", type=float, default=30.0, help="--batch-api の状態確認の間隔（秒）")
+    ap.add_argument("--no-cache", action="store_true", help="応答キャッシュを参照せずに取り直す")
+    args = ap.parse_args(argv)
+
+    if args.no_cache:
+        get_cache().bypass = True
+    roles = [s.strip() for s in args.roles.split(",") if s.strip()]
+    engine = OrchestratorEngine(max_concurrency=args.max_concurrency)
+    try:
+        engine.stages_for(roles, args.mode, args.reducer)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    done = load_done(args.output)
+    if done:
+        print(f"[resume] {args.output} の完了済み {len(done)} 件を飛ばします", flush=True)
+
+    started = time.perf_counter()
+    writer = ResultWriter(args.output)
+    try:
+        if args.batch_api:
+            seen = set(done)
+            items = []
+            counts = {"ok": 0, "error": 0, "skipped": 0}
+            for item_id, text in read_items(args.file, args.format):
+                if item_id in seen:
+                    counts["skipped"] += 1
+                    continue
+                seen.add(item_id)  # 入力内の重複 id も1回だけ処理する
+                items.append((item_id, text))
+            runner = BatchAPIRunner(engine, args.output + ".batch.json", poll_interval=args.poll)
+            try:
+                for rec in runner.run(items, roles, args.mode, args.reducer):
+                    writer.write(rec)
+                    counts[rec["status"]] += 1
+                    metrics.inc("batch_items_total", status=rec["status"])
+            except ValueError as e:
+                raise SystemExit(str(e))
+        else:
+            counts = run_pool(engine, read_items(args.file, args.format), writer, roles,
+                              args.mode, args.reducer, max(1, args.workers), done)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - started
+    stats = get_cache().stats()
+    print(f"\n[batch] ok={counts['ok']} error={counts['error']} skipped={counts['skipped']} "
+          f"{elapsed:.1f}s  [cache] hits={stats['hits']} misses={stats['misses']}")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
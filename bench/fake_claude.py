@@ -0,0 +1,78 @@
+"""
+Claude CLI（`claude -p --input-format stream-json --output-format stream-json`）の代わりに動く偽物。
+
+claude_pool.py の動作確認・ベンチマーク用。標準入力から1行1件の user メッセージ（stream-json）を読み、
+system(init) → assistant → result の各イベントを1行ずつ JSON で返す。会話はプロセス内で続くので、
+応答には何ターン目かと直前の入力が含まれる（セッションが使い回されているかの確認用）。
+
+  set CLAUDE_POOL_CMD=python bench/fake_claude.py --startup 1.5 --delay 0.2
+  python claude_pool.py -r writer "こんにちは"
+
+  --startup     起動にかかる秒数（WSL・シェル・CLI の起動を模擬）
+  --delay       1ターンの応答にかかる秒数
+  --crash-after N ターン目の応答前に異常終了する（再起動の確認用）
+  --hang-after  N ターン目で応答を返さなくなる（タイムアウトの確認用）
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+
+def emit(event: dict) -> None:
+    sys.stdout.write(json.dumps(event, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def text_of(message: dict) -> str:
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="stream-json で応答する Claude CLI の偽物")
+    ap.add_argument("--startup", type=float, default=0.0)
+    ap.add_argument("--delay", type=float, default=0.0)
+    ap.add_argument("--crash-after", type=int, default=0)
+    ap.add_argument("--hang-after", type=int, default=0)
+    args, _ = ap.parse_known_args()  # 本物の CLI 向けオプションは無視
+
+    time.sleep(args.startup)
+    session = str(uuid.uuid4())
+    emit({"type": "system", "subtype": "init", "session_id": session, "cwd": os.getcwd(), "pid": os.getpid()})
+    turn = 0
+    history = []
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            emit({"type": "result", "subtype": "error", "is_error": True, "result": "invalid json",
+                  "session_id": session})
+            continue
+        turn += 1
+        if args.crash_after and turn >= args.crash_after:
+            sys.exit(3)
+        if args.hang_after and turn >= args.hang_after:
+            time.sleep(3600)
+        text = text_of(msg.get("message", {}))
+        started = time.time()
+        time.sleep(args.delay)
+        reply = f"[turn {turn} pid {os.getpid()}] {text}"
+        if history:
+            reply += f" (前回: {history[-1]})"
+        history.append(text)
+        emit({"type": "assistant", "session_id": session,
+              "message": {"role": "assistant", "content": [{"type": "text", "text": reply}]}})
+        emit({"type": "result", "subtype": "success", "is_error": False, "result": reply,
+              "num_turns": turn, "duration_ms": int((time.time() - started) * 1000), "session_id": session})
+
+
+if __name__ == "__main__":
+    main()
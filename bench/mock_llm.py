@@ -0,0 +1,306 @@
+"""
+OpenAI 互換のローカルスタブ（ベンチマーク・オフライン確認用）。
+
+POST /v1/chat/completions に応答する（stream=true なら SSE でトークンを順に返す）。
+最初のトークンまでの遅延・トークン速度・エラー率を指定でき、OPENAI_BASE_URL を
+このサーバーに向ければオーケストレーター・監視・プレイグラウンドをネットワーク無しで動かせる。
+
+  python bench/mock_llm.py --port 8765 --latency 0.3 --tokens-per-sec 80 --error-rate 0.05
+  set OPENAI_BASE_URL=http://127.0.0.1:8765/v1  &  set OPENAI_API_KEY=dummy
+
+GET /stats で受け付けた件数・エラー件数を返す。
+usage にはプロンプトキャッシュを模した cached_tokens（prompt_tokens_details）が付く: 以前のリクエストと
+先頭が同じ部分を 128 トークン単位で数え、1024 トークン以上一致したときだけ計上する。
+Batch API（POST /v1/files, POST /v1/batches, GET /v1/batches/<id>, GET /v1/files/<id>/content）にも
+応答する（投入されたバッチは裏で順に処理し、終わると completed になる）。
+"""
+import argparse
+import email.parser
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.2          # 最初のトークンまでの秒数
+    jitter: float = 0.0           # latency に足す一様乱数の幅（秒）
+    tokens_per_sec: float = 0.0   # 0 なら全トークンを一度に返す
+    reply_tokens: int = 64        # 1応答のトークン数
+    error_rate: float = 0.0       # この割合で 429 / 500 を返す
+    seed: Optional[int] = None
+
+
+class MockLLMServer:
+    """別スレッドで動かせる OpenAI 互換スタブ。"""
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.files: dict = {}    # file id -> bytes
+        self.batches: dict = {}  # batch id -> Batch オブジェクト（dict）
+        self.prefixes: set = set()  # プロンプトキャッシュの模擬（先頭ブロックのハッシュ）
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # -- 応答の組み立て
+    def _draw(self):
+        with self._lock:
+            self.requests += 1
+            fail = self.rng.random() < self.config.error_rate
+            if fail:
+                self.errors += 1
+            delay = self.config.latency + self.rng.uniform(0, self.config.jitter)
+            status = self.rng.choice((429, 500)) if fail else 200
+        return status, delay
+
+    def _cached_tokens(self, messages) -> int:
+        text = "".join(f"{m.get('role')}\x00{m.get('content', '')}\x01" for m in messages)
+        block = 128 * 4  # prompt_tokens と同じく 4 文字 ≒ 1 トークン
+        h = hashlib.sha1()
+        hit = 0
+        with self._lock:
+            if len(self.prefixes) > 200_000:
+                self.prefixes.clear()
+            for i in range(len(text) // block):
+                h.update(text[i * block:(i + 1) * block].encode("utf-8"))
+                digest = h.digest()
+                if digest in self.prefixes and hit == i:
+                    hit = i + 1
+                self.prefixes.add(digest)
+        return hit * 128 if hit * 128 >= 1024 else 0
+
+    def _usage(self, messages, tokens) -> dict:
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 1 for m in messages)
+        cached = min(prompt_tokens, self._cached_tokens(messages))
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+                "prompt_tokens_details": {"cached_tokens": cached}}
+
+    # -- Batch API
+    def _put_file(self, data: bytes) -> str:
+        fid = "file-" + uuid.uuid4().hex[:12]
+        with self._lock:
+            self.files[fid] = data
+        return fid
+
+    def _run_batch(self, bid: str) -> None:
+        batch = self.batches[bid]
+        batch["status"] = "in_progress"
+        out, err = [], []
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            req = json.loads(line)
+            status, delay = self._draw()
+            time.sleep(delay)
+            body = req.get("body") or {}
+            res = {"id": "batch_req_" + uuid.uuid4().hex[:12], "custom_id": req.get("custom_id")}
+            if status != 200:
+                res.update(response={"status_code": status, "body": {"error": {"message": "injected error"}}},
+                           error=None)
+                err.append(res)
+                batch["request_counts"]["failed"] += 1
+            else:
+                tokens = self._tokens(body.get("messages") or [])
+                res.update(error=None, response={"status_code": 200, "body": {
+                    "id": "chatcmpl-" + uuid.uuid4().hex[:12], "object": "chat.completion",
+                    "created": int(time.time()), "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": self._usage(body.get("messages") or [], tokens)}})
+                out.append(res)
+                batch["request_counts"]["completed"] += 1
+        def dump(rows) -> bytes:
+            return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+        batch["output_file_id"] = self._put_file(dump(out)) if out else None
+        batch["error_file_id"] = self._put_file(dump(err)) if err else None
+        batch["completed_at"] = int(time.time())
+        batch["status"] = "completed"
+
+    def _create_batch(self, req: dict) -> dict:
+        data = self.files.get(req.get("input_file_id"), b"")
+        total = sum(1 for ln in data.splitlines() if ln.strip())
+        bid = "batch_" + uuid.uuid4().hex[:12]
+        batch = {"id": bid, "object": "batch", "endpoint": req.get("endpoint"),
+                 "input_file_id": req.get("input_file_id"), "completion_window": "24h",
+                 "status": "validating", "created_at": int(time.time()),
+                 "output_file_id": None, "error_file_id": None, "metadata": req.get("metadata"),
+                 "request_counts": {"total": total, "completed": 0, "failed": 0}}
+        self.batches[bid] = batch
+        threading.Thread(target=self._run_batch, args=(bid,), name="mock-batch", daemon=True).start()
+        return batch
+
+    def _tokens(self, messages) -> list:
+        last = (messages[-1].get("content") if messages else "") or ""
+        head = str(last)[:20].replace("\n", " ")
+        return [f"[mock:{head}]"] + [f" t{i}" for i in range(1, self.config.reply_tokens)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status: int, obj: dict) -> None:
+                body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = self.path.rstrip("/").split("/")
+                if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in server.batches:
+                    self._json(200, server.batches[parts[-1]])
+                elif parts[-1] == "content" and parts[-2] in server.files:
+                    body = server.files[parts[-2]]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif self.path.rstrip("/").endswith("/stats"):
+                    self._json(200, {"requests": server.requests, "errors": server.errors})
+                elif self.path.rstrip("/").endswith("/models"):
+                    self._json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                else:
+                    self._json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                path = self.path.rstrip("/")
+                if path.endswith("/files"):
+                    # multipart/form-data の file 部分だけ取り出す
+                    msg = email.parser.BytesParser().parsebytes(
+                        b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + raw)
+                    data = next((p.get_payload(decode=True) for p in msg.get_payload()
+                                 if p.get_param("name", header="content-disposition") == "file"), b"")
+                    fid = server._put_file(data)
+                    self._json(200, {"id": fid, "object": "file", "bytes": len(data),
+                                     "created_at": int(time.time()), "filename": "batch.jsonl",
+                                     "purpose": "batch", "status": "processed"})
+                    return
+                req = json.loads(raw or b"{}")
+                if path.endswith("/batches"):
+                    self._json(200, server._create_batch(req))
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": "not found"}})
+                    return
+                status, delay = server._draw()
+                time.sleep(delay)
+                if status != 200:
+                    self._json(status, {"error": {"message": "injected error", "type": "server_error",
+                                                  "code": status}})
+                    return
+                model = req.get("model", "mock")
+                tokens = server._tokens(req.get("messages") or [])
+                usage = server._usage(req.get("messages") or [], tokens)
+                cid = "chatcmpl-" + uuid.uuid4().hex[:12]
+                created = int(time.time())
+                if req.get("stream"):
+                    self._stream(cid, created, model, tokens, usage,
+                                 (req.get("stream_options") or {}).get("include_usage"))
+                    return
+                if server.config.tokens_per_sec > 0:
+                    time.sleep(len(tokens) / server.config.tokens_per_sec)
+                self._json(200, {
+                    "id": cid, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": usage,
+                })
+
+            def _stream(self, cid, created, model, tokens, usage, include_usage) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                gap = 1.0 / server.config.tokens_per_sec if server.config.tokens_per_sec > 0 else 0
+
+                def send(obj) -> None:
+                    self.wfile.write(b"data: " + json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                    self.wfile.flush()
+
+                base = {"id": cid, "object": "chat.completion.chunk", "created": created, "model": model}
+                try:
+                    for i, tok in enumerate(tokens):
+                        if gap and i:
+                            time.sleep(gap)
+                        delta = {"content": tok} if i else {"role": "assistant", "content": tok}
+                        send(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+                    send(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                    if include_usage:
+                        send(dict(base, choices=[], usage=usage))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # クライアントが途中で切った
+
+        return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenAI 互換のローカルスタブ")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.2, help="最初のトークンまでの秒数")
+    ap.add_argument("--jitter", type=float, default=0.0, help="遅延に足す乱数の幅（秒）")
+    ap.add_argument("--tokens-per-sec", type=float, default=0.0, help="トークン速度（0 で一括）")
+    ap.add_argument("--reply-tokens", type=int, default=64)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="429/500 を返す割合")
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args()
+    cfg = MockConfig(args.latency, args.jitter, args.tokens_per_sec, args.reply_tokens,
+                     args.error_rate, args.seed)
+    srv = MockLLMServer(cfg, args.host, args.port)
+    print(f"mock LLM: {srv.base_url}  (Ctrl+C で停止)")
+    try:
+        srv.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
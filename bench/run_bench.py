@@ -0,0 +1,392 @@
+"""
+オフラインのベンチマーク（ローカルの OpenAI 互換スタブ bench/mock_llm.py を使う）。
+
+  python bench/run_bench.py                         全シナリオを実行し bench/results/ に JSON を保存
+  python bench/run_bench.py --only pipeline,lanes   一部だけ
+  python bench/run_bench.py --quick                 反復回数を減らして短時間で
+  python bench/run_bench.py --compare bench/results/<前回>.json   前回比で悪化（既定 20%）があれば終了コード 1
+
+シナリオ:
+  pipeline  run_pipeline 相当（chain / fanout）のスループットと p50/p95/p99
+  lanes     プレイグラウンドの相談レーン 1〜8 本を並列実行したときの所要時間
+  message   /api/message（プレイグラウンドのアプリが読み込める場合のみ）
+  watcher   output_claude_writer.txt を書いてから input_claude_writer.txt が書かれるまで
+  feed      新着イベントの検出遅延: ポーリング（1.2 秒間隔）と SSE プッシュ
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+for p in (str(ROOT), str(BENCH_DIR)):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+from mock_llm import MockConfig, MockLLMServer  # noqa: E402
+
+SCENARIOS = ("pipeline", "lanes", "message", "watcher", "feed")
+# 比較で「小さいほど良い」値と「大きいほど良い」値
+LOWER_IS_BETTER = ("p50", "p95", "p99", "mean")
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    k = min(len(s) - 1, max(0, int(round(q / 100 * len(s) + 0.5)) - 1))  # nearest-rank
+    return s[k]
+
+
+def summarize(latencies: List[float], wall: Optional[float] = None, **extra) -> Dict:
+    out = {
+        "n": len(latencies),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+    if wall:
+        out["throughput"] = len(latencies) / wall
+        out["wall"] = wall
+    out.update(extra)
+    return {k: (round(v, 4) if isinstance(v, float) else v) for k, v in out.items()}
+
+
+def _make_router():
+    from llm_cache import ResponseCache
+    from llm_providers import LLMRouter
+    # キャッシュは参照しない（毎回スタブへ送る）
+    return LLMRouter(cache=ResponseCache(bypass=True))
+
+
+# ---------------------------------------------------------------- scenarios
+
+def bench_pipeline(args) -> Dict:
+    from multi_agent_orchestrator import OrchestratorEngine
+    engine = OrchestratorEngine(router=_make_router(), log=False)
+    engine.run("warmup", ["idea_ai"])  # SDK の読み込み・接続確立を計測から外す
+    out = {}
+    cases = {
+        "chain": (["idea_ai", "writer_ai", "proof_ai"], "chain"),
+        "fanout": (["idea_ai", "writer_ai", "proof_ai"], "fanout"),
+    }
+    for name, (roles, mode) in cases.items():
+        lat: List[float] = []
+        lock = threading.Lock()
+
+        def one(i: int) -> None:
+            t = time.perf_counter()
+            engine.run(f"bench {name} {i}", roles, mode=mode)
+            with lock:
+                lat.append(time.perf_counter() - t)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            list(ex.map(one, range(args.iterations)))
+        out[name] = summarize(lat, time.perf_counter() - started, concurrency=args.concurrency)
+    return out
+
+
+def bench_lanes(args) -> Dict:
+    from openai import AsyncOpenAI
+    sys.path.insert(0, str(ROOT / "playground"))
+    from backend.lanes import Lane, run_lanes
+
+    turns = int(os.getenv("FOLLOWUP_TURNS", "2"))
+
+    async def one_message(client, k: int, i: int) -> float:
+        def body_for(role: str):
+            async def body(emit):
+                for t in range(turns):
+                    res = await client.chat.completions.create(
+                        model="mock", messages=[{"role": "user", "content": f"{role} {i} {t}"}])
+                    emit(role, res.choices[0].message.content)
+            return body
+
+        lanes = [Lane(f"role{j}", body_for(f"role{j}")) for j in range(k)]
+        started = time.perf_counter()
+        results = await run_lanes(lanes, lambda lane, role, text: {"lane": lane, "role": role})
+        errors = [r.error for r in results if r.error]
+        if errors:
+            raise errors[0]
+        return time.perf_counter() - started
+
+    async def run() -> Dict:
+        client = AsyncOpenAI(max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")))
+        await one_message(client, 1, -1)  # ウォームアップ
+        out = {}
+        for k in range(1, 9):
+            lat = [await one_message(client, k, i) for i in range(max(1, args.iterations // 4))]
+            per_call = args.latency + (args.reply_tokens / args.tokens_per_sec
+                                       if args.tokens_per_sec > 0 else 0.0)
+            out[f"lanes_{k}"] = summarize(lat, lanes=k, turns=turns,
+                                          sequential_estimate=k * turns * per_call)
+        await client.close()
+        return out
+
+    return asyncio.run(run())
+
+
+def bench_message(args) -> Dict:
+    sys.path.insert(0, str(ROOT / "playground"))
+    try:
+        from fastapi.testclient import TestClient
+        from backend.app import app
+    except Exception as e:  # core/routers が無い構成ではスキップ
+        return {"skipped": f"playground app unavailable: {type(e).__name__}: {e}"}
+    client = TestClient(app)
+    out = {}
+    text = "全員で、それぞれ1つずつ具体的な案をください。テーマは「オンライン体験イベントの事業案」です。"
+    for limit in (1, 2, 4, 8):
+        os.environ["SELECT_LIMIT"] = str(limit)
+        lat, lanes = [], []
+        for _ in range(max(1, args.iterations // 4)):
+            cid = client.post("/api/init").json()["conversation_id"]
+            t = time.perf_counter()
+            r = client.post("/api/message", json={"conversation_id": cid, "text": text})
+            r.raise_for_status()
+            lat.append(time.perf_counter() - t)
+            lanes.append(len({e.get("lane") for e in r.json().get("events", [])
+                              if str(e.get("lane") or "").startswith("consult:")}))
+        out[f"select_{limit}"] = summarize(lat, consult_lanes=max(lanes) if lanes else 0)
+    return out
+
+
+def bench_watcher(args) -> Dict:
+    from watchdog.observers import Observer
+    import relay_queue
+    import watch_claude_output as w
+    import watch_service
+
+    with tempfile.TemporaryDirectory() as d:
+        # 監視対象を一時フォルダへ向ける（リポジトリのファイルは触らない）
+        w.OUTPUT_PATH = Path(d) / "output_claude_writer.txt"
+        w.INPUT_PATH = Path(d) / "input_claude_writer.txt"
+        w.OUTPUT_PATH.write_text("", encoding="utf-8")
+        queue = relay_queue.RelayQueue(str(Path(d) / "relay_queue.sqlite3"))
+        handler = w.Handler(_make_router(), stream=False, queue=queue)
+        pool = relay_queue.WorkerPool(queue, {"writer": handler.reply}).start()
+        routing = watch_service.RoutingHandler()
+        routing.add(w.OUTPUT_PATH, handler.process)
+        observer = Observer()
+        observer.schedule(routing, d, recursive=False)
+        observer.start()
+        lat = []
+        try:
+            for i in range(args.iterations):
+                marker = f"w{i:04d}-{random.randrange(1 << 30)}"
+                t = time.perf_counter()
+                w.OUTPUT_PATH.write_text(marker, encoding="utf-8")
+                deadline = t + 30
+                while time.perf_counter() < deadline:
+                    try:
+                        if marker in w.INPUT_PATH.read_text(encoding="utf-8"):
+                            lat.append(time.perf_counter() - t)
+                            break
+                    except OSError:
+                        pass
+                    time.sleep(0.002)
+        finally:
+            observer.stop()
+            observer.join()
+            routing.debouncer.cancel_all()
+            pool.stop()
+            queue.close()
+    return {"trigger_to_write": summarize(lat, debounce=watch_service.DEBOUNCE_SECONDS,
+                                          timeouts=args.iterations - len(lat))}
+
+
+def bench_feed(args) -> Dict:
+    sys.path.insert(0, str(ROOT / "playground"))
+    from backend.event_store import EventStore
+    from backend.feed_stream import FeedBroker
+
+    poll_interval = 1.2  # frontend/main.js の startPolling と同じ間隔
+    count = max(10, args.iterations * 2)
+
+    async def run() -> Dict:
+        store = EventStore(db_path=None)
+        broker = FeedBroker(source=store.since)
+        store.on_append(broker.publish)
+        conv = store.new_conversation()
+        sent: Dict[int, float] = {}
+        push_lat: List[float] = []
+        poll_lat: List[float] = []
+        polls = 0
+        done = asyncio.Event()
+
+        async def producer() -> None:
+            for i in range(count):
+                await asyncio.sleep(random.uniform(0.02, 0.15))
+                t = time.perf_counter()
+                ev = store.append(conv, "bench", f"event {i}")
+                sent[ev["id"]] = t
+            await asyncio.sleep(poll_interval * 1.5)
+            done.set()
+
+        async def pusher() -> None:
+            sub = broker.subscribe(conv)
+            try:
+                while len(push_lat) < count:
+                    kind, payload = await sub[1].get()
+                    push_lat.append(time.perf_counter() - sent[payload["id"]])
+            finally:
+                broker.unsubscribe(conv, sub)
+
+        async def poller() -> None:
+            nonlocal polls
+            last = 0
+            while not done.is_set():
+                await asyncio.sleep(poll_interval)
+                polls += 1
+                now = time.perf_counter()
+                for ev in store.since(last, conv):
+                    last = ev["id"]
+                    poll_lat.append(now - sent[ev["id"]])
+
+        await asyncio.gather(producer(), asyncio.wait_for(pusher(), 60), poller())
+        return {
+            "push": summarize(push_lat),
+            "poll": summarize(poll_lat, interval=poll_interval, requests=polls),
+        }
+
+    return asyncio.run(run())
+
+
+RUNNERS: Dict[str, Callable] = {
+    "pipeline": bench_pipeline,
+    "lanes": bench_lanes,
+    "message": bench_message,
+    "watcher": bench_watcher,
+    "feed": bench_feed,
+}
+
+
+# ---------------------------------------------------------------- compare
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """悪化した値を 'scenario.case.metric: 旧 -> 新 (+x%)' の形で返す。"""
+    regressions = []
+    for scen, cases in current.get("scenarios", {}).items():
+        base_cases = baseline.get("scenarios", {}).get(scen, {})
+        for case, stats in cases.items():
+            base = base_cases.get(case)
+            if not isinstance(stats, dict) or not isinstance(base, dict):
+                continue
+            for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+                new, old = stats.get(metric), base.get(metric)
+                if not new or not old:
+                    continue
+                change = (new - old) / old
+                worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+                if worse:
+                    regressions.append(f"{scen}.{case}.{metric}: {old:g} -> {new:g} ({change:+.0%})")
+    return regressions
+
+
+def _git_sha() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="モック LLM を使ったオフラインベンチマーク")
+    ap.add_argument("--only", default=",".join(SCENARIOS),
+                    help=f"実行するシナリオ（カンマ区切り: {','.join(SCENARIOS)}）")
+    ap.add_argument("--iterations", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=4, help="pipeline を同時に流す数")
+    ap.add_argument("--quick", action="store_true", help="反復回数を 4 にする")
+    ap.add_argument("--latency", type=float, default=0.1, help="スタブの最初のトークンまでの秒数")
+    ap.add_argument("--jitter", type=float, default=0.02)
+    ap.add_argument("--tokens-per-sec", type=float, default=400.0)
+    ap.add_argument("--reply-tokens", type=int, default=32)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="結果 JSON の保存先（既定: bench/results/<日時>_<commit>.json）")
+    ap.add_argument("--compare", help="比較する過去の結果 JSON")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="悪化とみなす変化率（既定 0.2 = 20%%）")
+    args = ap.parse_args(argv)
+    if args.quick:
+        args.iterations = 4
+    only = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(only) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    cfg = MockConfig(args.latency, args.jitter, args.tokens_per_sec, args.reply_tokens,
+                     args.error_rate, args.seed)
+    with tempfile.TemporaryDirectory() as tmp, MockLLMServer(cfg) as server:
+        # 実行中のプロセスだけをスタブへ向ける（キャッシュ・ログも一時フォルダへ）
+        os.environ.update({
+            "OPENAI_BASE_URL": server.base_url,
+            "OPENAI_API_KEY": "bench",
+            "LLM_CACHE_PATH": str(Path(tmp) / "cache.sqlite3"),
+            "LLM_RPM": os.getenv("BENCH_LLM_RPM", "0"),
+            "LLM_FALLBACK": "",
+            "LLM_HEDGE_AFTER": "0",
+        })
+        result = {
+            "version": 1,
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_sha(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "only")},
+            "scenarios": {},
+        }
+        for name in only:
+            print(f"[bench] {name} ...", flush=True)
+            t = time.perf_counter()
+            try:
+                result["scenarios"][name] = RUNNERS[name](args)
+            except Exception as e:
+                result["scenarios"][name] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"[bench] {name} done in {time.perf_counter() - t:.1f}s", flush=True)
+        result["mock"] = {"requests": server.requests, "errors": server.errors}
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out = Path(args.out) if args.out else \
+        RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}_{result['commit']}.json"
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    for scen, cases in result["scenarios"].items():
+        for case, stats in cases.items():
+            if isinstance(stats, dict):
+                keys = ("p50", "p95", "p99", "throughput")
+                shown = "  ".join(f"{k}={stats[k]}" for k in keys if stats.get(k) is not None)
+                print(f"{scen:<9}{case:<18}{shown}")
+            else:
+                print(f"{scen:<9}{case:<18}{stats}")
+    print(f"saved: {out}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.tolerance)
+        for r in regressions:
+            print(f"[regression] {r}")
+        if regressions:
+            return 1
+        print("[compare] no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
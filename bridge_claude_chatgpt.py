@@ -1,11 +1,11 @@
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
 from datetime import datetime
+from llm_providers import get_router
+from log_writer import get_writer
 
 # .envからAPIキー取得
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+router = get_router()  # プロバイダ共通ルーター（クライアント共有・リトライ・レート制限）
 
 # Claudeの出力ファイルパス
 CLAUDE_FILE = "claude_output.txt"
@@ -20,25 +20,32 @@ def read_claude_output():
         return None
 
 # ChatGPTへ送信して応答を取得
-def ask_chatgpt(prompt):
+def ask_chatgpt(prompt, on_token=None):
+    # on_token を渡すとストリーミングで受信し、差分ごとに呼び出す
+    model = "gpt-4"  # 必要に応じて "gpt-3.5-turbo"
+    messages = [
+        {"role": "system", "content": "あなたはClaudeの出力をレビューして補足・改善するアシスタントです。"},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4",  # 必要に応じて "gpt-3.5-turbo"
-            messages=[
-                {"role": "system", "content": "あなたはClaudeの出力をレビューして補足・改善するアシスタントです。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return completion.choices[0].message.content
+        if on_token is None:
+            return router.complete(messages, model=model).text
+        parts = []
+        for delta in router.stream(messages, model=model):
+            parts.append(delta)
+            on_token(delta)
+        return "".join(parts)
     except Exception as e:
         return f"[エラー]: {e}"
 
 # 応答をログに保存
 def save_log(prompt, reply):
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"\n==== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ====\n")
-        f.write("[Claudeの出力]\n" + prompt + "\n")
-        f.write("[ChatGPTの返答]\n" + reply + "\n")
+    # 書き込みはバックグラウンドのライターに任せる（1件分をまとめて1回で追記）
+    get_writer(LOG_FILE).write_text(
+        f"\n==== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ====\n"
+        + "[Claudeの出力]\n" + prompt + "\n"
+        + "[ChatGPTの返答]\n" + reply + "\n"
+    )
 
 # メイン処理
 def main():
@@ -50,9 +57,17 @@ def main():
         return
 
     print("📥 Claudeの出力を読み込みました。ChatGPTに送信中...\n")
-    response = ask_chatgpt(claude_text)
     print("✅ ChatGPTの応答：\n")
-    print(response)
+    shown = []
+
+    def show(token):
+        shown.append(token)
+        print(token, end="", flush=True)
+
+    response = ask_chatgpt(claude_text, on_token=show)
+    if response != "".join(shown):  # エラー時はメッセージを表示
+        print(response, end="")
+    print()
 
     save_log(claude_text, response)
     print("\n📝 応答は response_log.txt に保存されました。")
@@ -0,0 +1,178 @@
+"""
+常駐チャットデーモン（chat_daemon.py）の薄いクライアント。
+
+openai・dotenv を読み込まないので数十ミリ秒で起動する。デーモンが動いていなければ裏で起動してから送る。
+
+  python chat_client.py "質問"                    # default セッションで1ターン（履歴付き）
+  python chat_client.py -s plan -p planner "…"   # 掲示板付きの planner プロファイル・セッション plan
+  python chat_client.py -s plan                   # 対話モード（/reset /history /exit）
+  echo 質問 | python chat_client.py -s batch      # 標準入力から
+  python chat_client.py --sessions | --history -s plan | --reset -s plan | --stop
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Iterator, Optional
+
+import chat_daemon as d
+
+AUTOSTART_IDLE = os.getenv("CHAT_DAEMON_IDLE", "1800")  # 自動起動したデーモンはこの秒数使わなければ終了
+
+
+def _connect(timeout: Optional[float] = None) -> socket.socket:
+    if d.USE_UNIX:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        s.connect(d.SOCKET_PATH)
+        return s
+    s = socket.create_connection(("127.0.0.1", d.PORT), timeout=timeout)
+    s.settimeout(None)
+    return s
+
+
+def start_daemon(wait: float = 15.0) -> None:
+    """デーモンを切り離して起動し、接続できるまで待つ。"""
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = 0x00000008 | 0x00000200  # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    os.makedirs(d.CACHE_DIR, exist_ok=True)
+    log = open(os.path.join(d.CACHE_DIR, "chat_daemon.log"), "ab")
+    subprocess.Popen([sys.executable, os.path.join(d.BASE_DIR, "chat_daemon.py"), "--idle", AUTOSTART_IDLE],
+                     stdin=subprocess.DEVNULL, stdout=log, stderr=log, cwd=d.BASE_DIR, **kwargs)
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        try:
+            _connect(timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise SystemExit("chat_daemon を起動できませんでした（.cache/chat_daemon.log を確認）")
+
+
+def request(req: dict, autostart: bool = True) -> Iterator[dict]:
+    """1リクエストを送り、応答の JSON を1行ずつ返す。"""
+    try:
+        sock = _connect()
+    except OSError:
+        if not autostart:
+            raise
+        start_daemon()
+        sock = _connect()
+    token = d.read_token() if not d.USE_UNIX else ""
+    if token:
+        req = dict(req, token=token)
+    with sock, sock.makefile("rwb") as f:
+        f.write((json.dumps(req, ensure_ascii=False) + "\n").encode("utf-8"))
+        f.flush()
+        for line in f:
+            msg = json.loads(line)
+            yield msg
+            if msg.get("done") or msg.get("error"):
+                return
+
+
+def ask(prompt: str, session: str = "default", profile: Optional[str] = None, on_token=None) -> str:
+    """1ターン送って返答を返す（他のスクリプトから使う場合）。"""
+    reply = ""
+    for msg in request({"op": "ask", "session": session, "profile": profile, "prompt": prompt,
+                        "stream": on_token is not None}):
+        if "delta" in msg and on_token is not None:
+            on_token(msg["delta"])
+        elif msg.get("error"):
+            return f"エラー: {msg['error']}"
+        elif msg.get("done"):
+            reply = msg.get("reply", "")
+    return reply
+
+
+def _print_turn(prompt: str, session: str, profile: Optional[str]) -> None:
+    shown = []
+
+    def show(token):
+        shown.append(token)
+        print(token, end="", flush=True)
+
+    reply = ask(prompt, session, profile, on_token=show)
+    if reply != "".join(shown):  # エラー時はメッセージを表示
+        print(reply, end="")
+    print()
+
+
+def _print_history(session: str) -> None:
+    for msg in request({"op": "history", "session": session}):
+        if msg.get("summary"):
+            print(f"[要約]\n{msg['summary']}\n")
+        for m in msg.get("messages", []):
+            who = "あなた" if m["role"] == "user" else "AI"
+            print(f"[{who}] {m['content']}\n")
+        cache = msg.get("cache") or {}
+        if cache.get("requests"):
+            print(f"[cache] {cache['cached_tokens']}/{cache['prompt_tokens']} tokens ({cache['cached_ratio']:.0%})")
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="常駐チャットデーモンのクライアント")
+    ap.add_argument("prompt", nargs="?", help="送る内容（省略時は標準入力、端末なら対話モード）")
+    ap.add_argument("-s", "--session", default="default", help="セッション名（同じ名前で続きから話す）")
+    ap.add_argument("-p", "--profile", choices=["chatgpt", "planner"], help="新しいセッションのプロファイル")
+    ap.add_argument("--history", action="store_true", help="セッションの履歴を表示")
+    ap.add_argument("--reset", action="store_true", help="セッションの履歴を消す")
+    ap.add_argument("--sessions", action="store_true", help="セッション一覧")
+    ap.add_argument("--stop", action="store_true", help="デーモンを止める")
+    args = ap.parse_args(argv)
+
+    if args.stop:
+        try:
+            list(request({"op": "shutdown"}, autostart=False))
+        except OSError:
+            print("chat_daemon は動いていません")
+        return
+    if args.sessions:
+        for msg in request({"op": "sessions"}):
+            for s in msg.get("sessions", []):
+                when = time.strftime("%Y-%m-%d %H:%M", time.localtime(s["updated"] or 0))
+                print(f"{s['name']:<20} {s['profile'] or '':<8} {s['turns']:>4} turns  {when}")
+        return
+    if args.history:
+        _print_history(args.session)
+        return
+    if args.reset:
+        list(request({"op": "reset", "session": args.session}))
+        return
+    if args.prompt is not None:
+        _print_turn(args.prompt, args.session, args.profile)
+        return
+    if not sys.stdin.isatty():
+        _print_turn(sys.stdin.read(), args.session, args.profile)
+        return
+
+    print(f"=== chat ({args.session}) ===  /history /reset /exit")
+    while True:
+        try:
+            line = input("\nあなた > ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
+        if not line:
+            continue
+        if line.lower() in ("/exit", "exit", "quit"):
+            break
+        if line == "/history":
+            _print_history(args.session)
+            continue
+        if line == "/reset":
+            list(request({"op": "reset", "session": args.session}))
+            print("履歴を消しました。")
+            continue
+        print("AI > ", end="", flush=True)
+        _print_turn(line, args.session, args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+常駐チャットデーモン（chat_client.py から使う）。
+
+chatgpt_cli.py / claude_style_chatgpt.py は起動のたびに openai・dotenv を読み込んでクライアントを作り、
+1行ずつ履歴無しで送っていた。このデーモンは1回だけ起動してルーター（クライアント）を温めたまま持ち、
+セッションごとの会話履歴を保ってローカルソケットで応答する。
+
+  - 接続: Unix ソケット .cache/chat_daemon.sock（CHAT_DAEMON_SOCKET）。AF_UNIX の無い Windows では
+    127.0.0.1:CHAT_DAEMON_PORT（既定 8769）で待ち受け、.cache/chat_daemon.token のトークンで認証
+  - 1リクエスト = 1行の JSON、応答も1行ずつの JSON（{"delta": …} を順に返し、最後に {"done": true, …}）
+      {"op": "ask", "session": "default", "profile": "chatgpt", "prompt": "…", "stream": true}
+      {"op": "history" | "reset", "session": "…"} / {"op": "sessions"} / {"op": "ping"} / {"op": "shutdown"}
+  - セッションは .cache/chat_sessions/<名前>.json に保存し、デーモンを再起動しても続きから話せる
+    （メッセージの並びと古いターンの要約は conversation_builder.Conversation）
+  - profile: chatgpt（chatgpt_cli.py と同じ指示）/ planner（claude_style_chatgpt.py と同じ指示 + bulletin-board.md）
+    指示とモデルは chat_profiles.py から読む。掲示板は先頭の共有部分として1回だけ読み、更新時刻が変わったときだけ読み直す
+  - メモリに置くセッションは最近使った CHAT_DAEMON_MAX_SESSIONS 個（既定 64）まで。外れたものも保存済みなので次に使うとき読み直す
+
+起動: python chat_daemon.py [--idle 秒]（chat_client.py は未起動なら自動で起動する）
+同時に2つ起動されても .cache/chat_daemon.lock を取れた1つだけが待ち受け、残りはすぐ終了する。
+"""
+import argparse
+import json
+import os
+import re
+import secrets
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from chat_profiles import (BOARD_FILE, CHATGPT_MODEL, CHATGPT_SYSTEM_PROMPT, PLANNER_MODEL,
+                           PLANNER_SYSTEM_PROMPT)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, ".cache")
+SOCKET_PATH = os.getenv("CHAT_DAEMON_SOCKET") or os.path.join(CACHE_DIR, "chat_daemon.sock")
+PORT = int(os.getenv("CHAT_DAEMON_PORT", "8769"))
+TOKEN_PATH = os.path.join(CACHE_DIR, "chat_daemon.token")
+LOCK_PATH = os.path.join(CACHE_DIR, "chat_daemon.lock")
+SESSIONS_DIR = os.path.join(CACHE_DIR, "chat_sessions")
+BOARD_PATH = os.path.join(BASE_DIR, BOARD_FILE)
+MAX_SESSIONS = max(1, int(os.getenv("CHAT_DAEMON_MAX_SESSIONS", "64")))
+USE_UNIX = hasattr(socket, "AF_UNIX")
+
+
+def read_token() -> str:
+    try:
+        with open(TOKEN_PATH, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+class Session:
+    def __init__(self, name: str, profile: str):
+        self.name = name
+        self.profile = profile
+        self.conv = None  # ChatService が profile に合わせて Conversation を付ける
+        self.data: dict = {}
+        self.turns = 0
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        safe = re.sub(r"[^\w.-]", "_", self.name)[:100] or "default"
+        return os.path.join(SESSIONS_DIR, f"{safe}.json")
+
+    def load(self) -> "Session":
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return self
+        self.profile = data.get("profile", self.profile)
+        self.turns = data.get("turns", len(data.get("messages", [])) // 2)
+        self.updated = data.get("updated", self.updated)
+        self.data = data
+        return self
+
+    def save(self) -> None:
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(self.conv.to_dict(), name=self.name, profile=self.profile,
+                           updated=self.updated, turns=self.turns), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+class ChatService:
+    """ルーター・掲示板・セッションを持つ本体（ソケットとは独立）。"""
+
+    def __init__(self):
+        from dotenv import load_dotenv
+        from llm_providers import get_router
+        from conversation_builder import SharedContext, llm_summarizer
+
+        load_dotenv()
+        self.router = get_router()
+        self.summarizer = llm_summarizer(self.router)
+        self.board = SharedContext([BOARD_PATH])  # 全 planner セッションで共有（内容が同じ間は同じ文字列）
+        self.profiles = {
+            "chatgpt": {"system": CHATGPT_SYSTEM_PROMPT, "model": CHATGPT_MODEL, "shared": None},
+            "planner": {"system": PLANNER_SYSTEM_PROMPT, "model": PLANNER_MODEL, "shared": self.board},
+        }
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()  # 最近使った順
+        self._lock = threading.Lock()
+
+    def _attach(self, s: Session) -> None:
+        from conversation_builder import Conversation
+        prof = self.profiles.get(s.profile) or self.profiles["chatgpt"]
+        s.conv = Conversation(prof["system"], shared=prof["shared"], summarizer=self.summarizer,
+                              model=prof["model"]).load(s.data)
+
+    def session(self, name: str, profile: Optional[str] = None) -> Session:
+        with self._lock:
+            s = self.sessions.get(name)
+            if s is None:
+                s = self.sessions[name] = Session(name, profile or "chatgpt").load()
+                self._attach(s)
+                self._evict()
+            else:
+                self.sessions.move_to_end(name)
+            if profile and profile != s.profile and not s.turns:
+                s.profile = profile
+                self._attach(s)
+            return s
+
+    def _evict(self) -> None:
+        # 呼び出し側が self._lock を持つ。応答中のセッションは残す（保存は各ターンの後に済んでいる）
+        for key in list(self.sessions):
+            if len(self.sessions) <= MAX_SESSIONS:
+                break
+            if not self.sessions[key].lock.locked():
+                del self.sessions[key]
+
+    def ask(self, name: str, prompt: str, profile: Optional[str] = None, on_token=None) -> str:
+        s = self.session(name, profile)
+        with s.lock:  # 同じセッションのターンは順番に
+            messages = s.conv.build(prompt)
+            model = (self.profiles.get(s.profile) or self.profiles["chatgpt"])["model"]
+            if on_token is None:
+                res = self.router.complete(messages, model=model)
+                reply, usage = res.text, res.usage
+            else:
+                parts, usage = [], {}
+                for delta in self.router.stream(messages, model=model, usage=usage):
+                    parts.append(delta)
+                    on_token(delta)
+                reply = "".join(parts)
+            s.conv.record(usage)
+            s.conv.add_turn(prompt, reply)
+            s.turns += 1
+            s.updated = time.time()
+            s.save()
+            return reply
+
+    def reset(self, name: str) -> None:
+        s = self.session(name)
+        with s.lock:
+            s.conv.reset()
+            s.turns = 0
+            s.updated = time.time()
+            s.save()
+
+    def list_sessions(self) -> List[dict]:
+        out = {}
+        if os.path.isdir(SESSIONS_DIR):
+            for fn in os.listdir(SESSIONS_DIR):
+                if fn.endswith(".json"):
+                    try:
+                        with open(os.path.join(SESSIONS_DIR, fn), encoding="utf-8") as f:
+                            data = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    out[data.get("name", fn[:-5])] = {"profile": data.get("profile"), "updated": data.get("updated"),
+                                                      "turns": data.get("turns", 0)}
+        with self._lock:
+            for s in self.sessions.values():
+                out[s.name] = {"profile": s.profile, "updated": s.updated, "turns": s.turns}
+        return [dict(name=k, **v) for k, v in sorted(out.items(), key=lambda kv: -(kv[1]["updated"] or 0))]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, obj: dict) -> None:
+        self.wfile.write((json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        server.touch()
+        line = self.rfile.readline()
+        try:
+            req = json.loads(line)
+        except ValueError:
+            self.send({"error": "invalid request"})
+            return
+        if server.token and req.get("token") != server.token:
+            self.send({"error": "unauthorized"})
+            return
+        svc: ChatService = server.service
+        op = req.get("op", "ask")
+        name = str(req.get("session") or "default")
+        try:
+            if op == "ping":
+                self.send({"done": True, "pid": os.getpid()})
+            elif op == "ask":
+                stream = req.get("stream", True)
+                reply = svc.ask(name, str(req.get("prompt", "")), req.get("profile"),
+                                on_token=(lambda d: self.send({"delta": d})) if stream else None)
+                s = svc.session(name)
+                self.send({"done": True, "reply": reply, "session": name, "profile": s.profile,
+                           "turns": s.turns, "cache": s.conv.cache.snapshot()})
+            elif op == "history":
+                s = svc.session(name)
+                self.send({"done": True, "session": name, "profile": s.profile, "summary": s.conv.summary,
+                           "messages": s.conv.turns, "cache": s.conv.cache.snapshot()})
+            elif op == "reset":
+                svc.reset(name)
+                self.send({"done": True, "session": name})
+            elif op == "sessions":
+                self.send({"done": True, "sessions": svc.list_sessions()})
+            elif op == "shutdown":
+                self.send({"done": True})
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            else:
+                self.send({"error": f"unknown op: {op}"})
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # クライアントが先に切断（Ctrl+C など）
+        except Exception as e:  # API エラーなどは本文として返し、デーモンは動かし続ける
+            try:
+                self.send({"error": str(e)})
+            except OSError:
+                pass
+        finally:
+            server.touch()
+
+
+class _ServerMixin:
+    daemon_threads = True
+    service: ChatService
+    token = ""
+    last_active = 0.0
+
+    def touch(self) -> None:
+        self.last_active = time.time()
+
+
+if USE_UNIX:
+    class UnixServer(_ServerMixin, socketserver.ThreadingUnixStreamServer):
+        pass
+
+
+class TCPServer(_ServerMixin, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def already_running() -> bool:
+    try:
+        if USE_UNIX:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(1)
+                s.connect(SOCKET_PATH)
+        else:
+            socket.create_connection(("127.0.0.1", PORT), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def acquire_lock():
+    """デーモン1つだけが持てるロック（プロセスが終われば OS が外す）。取れなければ None。"""
+    f = open(LOCK_PATH, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def serve(idle: float = 0.0) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # ChatService の初期化（openai・dotenv の読み込み）は遅いので、先にロックで起動を1つに絞る
+    lock = acquire_lock()
+    if lock is None or already_running():
+        print("chat_daemon is already running")
+        return
+    service = ChatService()
+    sock_id = None
+    if USE_UNIX:
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)  # 前回の残り（ロックを持つデーモンはいないので使われていない）
+        server = UnixServer(SOCKET_PATH, RequestHandler)
+        os.chmod(SOCKET_PATH, 0o600)
+        st = os.stat(SOCKET_PATH)
+        sock_id = (st.st_dev, st.st_ino)
+        where = SOCKET_PATH
+    else:
+        server = TCPServer(("127.0.0.1", PORT), RequestHandler)
+        server.token = secrets.token_hex(16)
+        with open(TOKEN_PATH, "w", encoding="utf-8") as f:
+            f.write(server.token)
+        where = f"127.0.0.1:{PORT}"
+    server.service = service
+    server.touch()
+    if idle > 0:
+        def watch_idle():
+            while True:
+                time.sleep(min(idle, 30))
+                if time.time() - server.last_active > idle:
+                    server.shutdown()
+                    return
+        threading.Thread(target=watch_idle, daemon=True).start()
+    print(f"chat_daemon listening on {where} (pid {os.getpid()})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            st = os.stat(SOCKET_PATH) if sock_id else None
+            if st is not None and (st.st_dev, st.st_ino) == sock_id:
+                os.unlink(SOCKET_PATH)  # 自分が作ったソケットだけ消す
+        except FileNotFoundError:
+            pass
+        lock.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="常駐チャットデーモン")
+    ap.add_argument("--idle", type=float, default=float(os.getenv("CHAT_DAEMON_IDLE", "0")),
+                    help="この秒数リクエストが無ければ終了（0 = 終了しない）")
+    args = ap.parse_args(argv)
+    serve(args.idle)
+
+
+if __name__ == "__main__":
+    main()
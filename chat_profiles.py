@@ -0,0 +1,13 @@
+"""
+チャットの指示と既定モデル（chatgpt_cli.py / claude_style_chatgpt.py / chat_daemon.py で共有）。
+
+スクリプト本体を import するとルーターの作成などの副作用があるため、デーモンはこちらを読む。
+"""
+# chatgpt_cli.py と chat_daemon の profile "chatgpt"
+CHATGPT_SYSTEM_PROMPT = "あなたは有能なAIアシスタントです。"
+CHATGPT_MODEL = "gpt-4"
+
+# claude_style_chatgpt.py と chat_daemon の profile "planner"（掲示板を先頭に付けて送る）
+PLANNER_SYSTEM_PROMPT = "あなたは優秀な企画支援AIアシスタントです。Markdownスタイルで返答してください。"
+PLANNER_MODEL = "gpt-4"
+BOARD_FILE = "bulletin-board.md"
@@ -1,8 +1,33 @@
-import tkinter as tk
-from tkinter import ttk, scrolledtext
+"""
+Claude 出力（writer / idea / proof）・ChatGPT の最新応答・オーケストレーターの実行ログを表示するビューア。
+
+- ファイルの変更通知（watchdog）を受けたパスをキューに積み、Tk のループ側で after() から取り出して反映する
+  （ウィジェットは Tk のスレッドからしか触らない）。通知が取れない環境でも VIEWER_RESCAN 秒ごとに stat で確認する
+- 追記分だけを末尾に insert し、全体の再描画はファイルが上書きされたときだけ
+- 表示は末尾 VIEWER_MAX_CHARS 文字（既定 200000）まで。超えた分は先頭から捨てる
+- 「ORCH 実行」タブ: logs/orch_*.jsonl を run_id ごとにまとめて一覧表示し、選んだ実行の各役割の出力を表示
+"""
+import fnmatch
+import glob
+import json
 import os
+import queue
 import time
-from threading import Thread
+import tkinter as tk
+from tkinter import ttk, scrolledtext
+from typing import Dict, List, Optional
+
+from tail_reader import LastBlockReader, TailReader
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # 通知が無くても定期確認だけで動く
+    FileSystemEventHandler = object
+    Observer = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGS_DIR = os.path.join(BASE_DIR, "logs")
 
 # Claude出力ファイルとChatGPTログのマッピング
 FILES = {
@@ -11,77 +36,345 @@ FILES = {
     "proof": "output_claude_proof.txt"
 }
 LOG_FILE = "response_log.txt"
+ORCH_GLOB = "orch_*.jsonl"
+
+MAX_VIEW_CHARS = int(os.getenv("VIEWER_MAX_CHARS", "200000"))
+MAX_RUNS = int(os.getenv("VIEWER_MAX_RUNS", "300"))
+ORCH_INITIAL_BYTES = 4_000_000  # 起動時に読むログの末尾
+RESCAN_SECONDS = float(os.getenv("VIEWER_RESCAN", "5"))
+DRAIN_MS = 100
+
+_log_reader = LastBlockReader(os.path.join(BASE_DIR, LOG_FILE))
 
-def read_file(file_path):
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except:
-        return f"❌ {file_path} が見つかりません。"
 
 def read_latest_chatgpt():
-    try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.read().split("====")
-            if len(lines) < 2:
-                return "❌ response_log.txt に応答が見つかりません。"
-            latest_block = lines[-1]
-            if "[ChatGPTの返答]" in latest_block:
-                return latest_block.split("[ChatGPTの返答]")[-1].strip()
-            else:
-                return "⚠️ ChatGPTの応答が正しく記録されていません。"
-    except:
+    # ログ全体は読まず、末尾から最後の "====" を探して最新ブロックだけ取り出す
+    if not os.path.exists(_log_reader.path):
         return "❌ response_log.txt が見つかりません。"
+    latest_block = _log_reader.read()
+    if latest_block is None:
+        return "❌ response_log.txt に応答が見つかりません。"
+    if "[ChatGPTの返答]" in latest_block:
+        return latest_block.split("[ChatGPTの返答]")[-1].strip()
+    else:
+        return "⚠️ ChatGPTの応答が正しく記録されていません。"
+
+
+def _size_label(n: int) -> str:
+    return f"{n / 1_000_000:.1f}MB" if n >= 1_000_000 else f"{n / 1000:.0f}KB" if n >= 1000 else f"{n}B"
+
 
-def update_loop(textboxes):
-    last_contents = {k: "" for k in FILES}
-    last_gpt = ""
-    while True:
-        for name, file_path in FILES.items():
-            content = read_file(file_path)
-            if content != last_contents[name]:
-                textbox = textboxes[name]
-                textbox.config(state="normal")
-                textbox.delete("1.0", tk.END)
-                textbox.insert(tk.END, content)
-                textbox.config(state="disabled")
-                last_contents[name] = content
+class TextPane:
+    """末尾 max_chars 文字だけを持つ読み取り専用のテキスト表示。"""
+
+    def __init__(self, parent, max_chars: int = MAX_VIEW_CHARS):
+        self.max_chars = max_chars
+        self.chars = 0
+        self.status = ttk.Label(parent, anchor="w")
+        self.status.pack(fill="x", padx=10, pady=(6, 0))
+        self.box = scrolledtext.ScrolledText(parent, wrap=tk.WORD, width=80, height=30, state="disabled")
+        self.box.pack(padx=10, pady=(2, 10), expand=True, fill="both")
+
+    def _at_bottom(self) -> bool:
+        return self.box.yview()[1] >= 0.999
+
+    def replace(self, text: str) -> None:
+        if len(text) > self.max_chars:
+            text = text[-self.max_chars:]
+        self.box.config(state="normal")
+        self.box.delete("1.0", tk.END)
+        self.box.insert(tk.END, text)
+        self.box.config(state="disabled")
+        self.chars = len(text)
+        self.box.see(tk.END)
+
+    def append(self, text: str) -> None:
+        if not text:
+            return
+        follow = self._at_bottom()
+        if len(text) >= self.max_chars:
+            self.replace(text)
+            return
+        self.box.config(state="normal")
+        self.box.insert(tk.END, text)
+        self.chars += len(text)
+        # 少し余裕を持って超えたら先頭をまとめて捨てる（追記のたびに削らない）
+        if self.chars > self.max_chars * 1.2:
+            excess = self.chars - self.max_chars
+            self.box.delete("1.0", f"1.0 + {excess} chars")
+            self.chars = self.max_chars
+        self.box.config(state="disabled")
+        if follow:
+            self.box.see(tk.END)
+
+
+class FilePane:
+    """1ファイルを TailReader で追い、追記分だけを TextPane に足す。"""
+
+    def __init__(self, parent, path: str):
+        self.path = path
+        self.pane = TextPane(parent)
+        self.reader = TailReader(path, keep_text=False)
+        self.reader.seek_tail(MAX_VIEW_CHARS * 4)  # 上限を超える先頭部分は読まない
+        self.missing = False
+
+    def refresh(self) -> None:
+        if not os.path.exists(self.path):
+            if not self.missing:
+                self.missing = True
+                self.pane.replace(f"❌ {os.path.basename(self.path)} が見つかりません。")
+                self.pane.status.config(text="")
+            return
+        if not self.reader.changed():
+            return
+        text, reset = self.reader.poll()
+        if reset or self.missing:
+            self.missing = False
+            self.pane.replace(text)
+        else:
+            self.pane.append(text)
+        size = self.reader.offset
+        shown = "" if self.pane.chars < MAX_VIEW_CHARS else f"（末尾 {MAX_VIEW_CHARS:,} 文字を表示）"
+        self.pane.status.config(text=f"{os.path.basename(self.path)}  {_size_label(size)}  "
+                                     f"{time.strftime('%H:%M:%S')}{shown}")
+
+
+class ChatGPTPane:
+    def __init__(self, parent):
+        self.pane = TextPane(parent)
+        self.last = None
+
+    def refresh(self) -> None:
         gpt = read_latest_chatgpt()
-        if gpt != last_gpt:
-            textbox = textboxes["gpt"]
-            textbox.config(state="normal")
-            textbox.delete("1.0", tk.END)
-            textbox.insert(tk.END, gpt)
-            textbox.config(state="disabled")
-            last_gpt = gpt
-        time.sleep(2)
+        if gpt != self.last:
+            self.pane.replace(gpt)
+            self.last = gpt
+            self.pane.status.config(text=f"{LOG_FILE}  {time.strftime('%H:%M:%S')}")
 
-def launch_gui():
-    root = tk.Tk()
-    root.title("Claude & ChatGPT Viewer")
 
-    notebook = ttk.Notebook(root)
-    notebook.pack(expand=True, fill='both')
+class OrchRunsTab:
+    """logs/orch_*.jsonl を run_id ごとにまとめた一覧と、選んだ実行の詳細。"""
 
-    textboxes = {}
+    COLUMNS = (("time", "開始", 140), ("roles", "役割", 260), ("latency", "秒", 60),
+               ("tokens", "tokens", 70), ("chars", "出力文字", 80))
 
-    for name, file in FILES.items():
-        frame = ttk.Frame(notebook)
-        notebook.add(frame, text=f"Claude：{name}")
-        textbox = scrolledtext.ScrolledText(frame, wrap=tk.WORD, width=80, height=30, state="disabled")
-        textbox.pack(padx=10, pady=10, expand=True, fill='both')
-        textboxes[name] = textbox
+    def __init__(self, parent):
+        paned = ttk.PanedWindow(parent, orient=tk.HORIZONTAL)
+        paned.pack(expand=True, fill="both", padx=10, pady=10)
+        left = ttk.Frame(paned)
+        self.tree = ttk.Treeview(left, columns=[c[0] for c in self.COLUMNS], show="headings", height=30)
+        for key, title, width in self.COLUMNS:
+            self.tree.heading(key, text=title)
+            self.tree.column(key, width=width, stretch=key == "roles")
+        sb = ttk.Scrollbar(left, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=sb.set)
+        self.tree.pack(side="left", expand=True, fill="both")
+        sb.pack(side="right", fill="y")
+        right = ttk.Frame(paned)
+        self.detail = TextPane(right)
+        paned.add(left, weight=1)
+        paned.add(right, weight=2)
+        self.tree.bind("<<TreeviewSelect>>", lambda e: self._show_selected())
 
-    gpt_frame = ttk.Frame(notebook)
-    notebook.add(gpt_frame, text="ChatGPT応答")
-    gpt_box = scrolledtext.ScrolledText(gpt_frame, wrap=tk.WORD, width=80, height=30, state="disabled")
-    gpt_box.pack(padx=10, pady=10, expand=True, fill='both')
-    textboxes["gpt"] = gpt_box
+        self.runs: Dict[str, List[dict]] = {}
+        self.readers: Dict[str, TailReader] = {}
+        self.partial: Dict[str, str] = {}
+        self.shown: Optional[str] = None
+        self._anon = 0
+        self._started = False
+        self.scan()
+        self._started = True
 
-    thread = Thread(target=update_loop, args=(textboxes,), daemon=True)
-    thread.start()
+    def scan(self) -> None:
+        """新しいログファイル（日付の切り替わり・ローテーション）を拾う。"""
+        paths = sorted(glob.glob(os.path.join(LOGS_DIR, ORCH_GLOB)), key=os.path.getmtime)
+        for i, path in enumerate(paths):
+            if path in self.readers:
+                continue
+            reader = self.readers[path] = TailReader(path, keep_text=False)
+            if i < len(paths) - 2 and not self._started:
+                # 起動時は新しい2ファイルだけ読む（古いログは orch_logs.py で検索）
+                reader.seek_tail(0)
+            else:
+                reader.seek_tail(ORCH_INITIAL_BYTES)
+            self.refresh(path)
+
+    def watches(self, path: str) -> bool:
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(LOGS_DIR) \
+            and fnmatch.fnmatch(os.path.basename(path), ORCH_GLOB)
+
+    def refresh(self, path: Optional[str] = None) -> None:
+        if path is not None and path not in self.readers:
+            self.scan()
+            return
+        touched: Dict[str, None] = {}  # 出現順（新しい実行ほど一覧の上に来る）
+        for p in ([path] if path else list(self.readers)):
+            reader = self.readers[p]
+            if not reader.changed():
+                continue
+            text, reset = reader.poll()
+            buf = ("" if reset else self.partial.get(p, "")) + text
+            lines = buf.split("\n")
+            self.partial[p] = lines.pop()  # 書きかけの行は次回に回す
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                run_id = rec.get("run_id")
+                if not run_id:  # run_id の無い古い記録は1行1実行として扱う
+                    self._anon += 1
+                    run_id = f"{rec.get('ts', '')}#{self._anon}"
+                self.runs.setdefault(run_id, []).append(rec)
+                touched[run_id] = None
+        for run_id in touched:
+            self._upsert(run_id)
+        self._evict()
+        if self.shown in touched:
+            self._show(self.shown)
+
+    def _upsert(self, run_id: str) -> None:
+        steps = self.runs[run_id]
+        roles = " → ".join(dict.fromkeys(s.get("role", "?") for s in steps))
+        latency = sum(float(s.get("latency") or 0) for s in steps)
+        tokens = sum(int((s.get("tokens") or {}).get("total_tokens") or 0) for s in steps)
+        chars = sum(len(s.get("output") or "") for s in steps)
+        values = (str(steps[0].get("ts", ""))[:19].replace("T", " "), roles,
+                  f"{latency:.1f}" if latency else "", tokens or "", chars)
+        if self.tree.exists(run_id):
+            self.tree.item(run_id, values=values)
+        else:
+            self.tree.insert("", 0, iid=run_id, values=values)
+
+    def _evict(self) -> None:
+        while len(self.runs) > MAX_RUNS:
+            oldest = next(iter(self.runs))
+            del self.runs[oldest]
+            if self.tree.exists(oldest):
+                self.tree.delete(oldest)
+
+    def _show_selected(self) -> None:
+        sel = self.tree.selection()
+        if sel:
+            self._show(sel[0])
+
+    def _show(self, run_id: str) -> None:
+        self.shown = run_id
+        parts = [f"run_id: {run_id}\n"]
+        for s in self.runs.get(run_id, []):
+            head = f"[{s.get('stage', '')}] {s.get('role', '?')}"
+            if s.get("model"):
+                head += f"  {s['model']}"
+            if s.get("latency") is not None:
+                head += f"  {s['latency']}s"
+            if s.get("cached"):
+                head += "  (cache)"
+            parts.append(f"\n==== {head}\n{(s.get('output') or '').strip()}\n")
+        self.detail.replace("".join(parts))
+        self.detail.box.see("1.0")
+        self.detail.status.config(text=f"{len(self.runs.get(run_id, []))} steps")
+
+
+class _Notify(FileSystemEventHandler):
+    """watchdog のスレッドではパスをキューに積むだけ。"""
+
+    def __init__(self, events: "queue.Queue[str]"):
+        super().__init__()
+        self.events = events
+
+    def dispatch(self, event):
+        if getattr(event, "is_directory", False):
+            return
+        for p in (getattr(event, "src_path", None), getattr(event, "dest_path", None)):
+            if p:
+                self.events.put(os.path.abspath(p))
+
+
+class Viewer:
+    def __init__(self, root: tk.Tk):
+        self.root = root
+        self.events: "queue.Queue[str]" = queue.Queue()
+        notebook = ttk.Notebook(root)
+        notebook.pack(expand=True, fill="both")
+
+        self.files: Dict[str, FilePane] = {}
+        for name, file in FILES.items():
+            frame = ttk.Frame(notebook)
+            notebook.add(frame, text=f"Claude：{name}")
+            path = os.path.join(BASE_DIR, file)
+            self.files[os.path.abspath(path)] = FilePane(frame, path)
 
+        gpt_frame = ttk.Frame(notebook)
+        notebook.add(gpt_frame, text="ChatGPT応答")
+        self.gpt = ChatGPTPane(gpt_frame)
+
+        orch_frame = ttk.Frame(notebook)
+        notebook.add(orch_frame, text="ORCH 実行")
+        self.orch = OrchRunsTab(orch_frame)
+
+        self.observer = None
+        if Observer is not None:
+            self.observer = Observer()
+            handler = _Notify(self.events)
+            self.observer.schedule(handler, BASE_DIR, recursive=False)
+            if os.path.isdir(LOGS_DIR):
+                self.observer.schedule(handler, LOGS_DIR, recursive=False)
+            self.observer.daemon = True
+            self.observer.start()
+
+        self.rescan()
+        root.after(DRAIN_MS, self.drain)
+        root.protocol("WM_DELETE_WINDOW", self.close)
+
+    def route(self, path: str) -> None:
+        pane = self.files.get(path)
+        if pane is not None:
+            pane.refresh()
+        elif os.path.basename(path) == LOG_FILE:
+            self.gpt.refresh()
+        elif self.orch.watches(path):
+            self.orch.refresh(path)
+
+    def drain(self) -> None:
+        # 同じファイルへの連続した通知は1回にまとめる
+        paths = []
+        try:
+            while len(paths) < 1000:
+                p = self.events.get_nowait()
+                if p not in paths:
+                    paths.append(p)
+        except queue.Empty:
+            pass
+        for p in paths:
+            try:
+                self.route(p)
+            except OSError as e:
+                print(f"[viewer] {os.path.basename(p)}: {e}")
+        self.root.after(DRAIN_MS, self.drain)
+
+    def rescan(self) -> None:
+        # 通知の取りこぼし・watchdog 無しの環境向け（変化が無ければ stat だけ）
+        for pane in self.files.values():
+            pane.refresh()
+        self.gpt.refresh()
+        self.orch.scan()
+        self.orch.refresh()
+        self.root.after(int(RESCAN_SECONDS * 1000), self.rescan)
+
+    def close(self) -> None:
+        if self.observer is not None:
+            self.observer.stop()
+        self.root.destroy()
+
+
+def launch_gui():
+    root = tk.Tk()
+    root.title("Claude & ChatGPT Viewer")
+    Viewer(root)
     root.mainloop()
 
+
 if __name__ == "__main__":
     launch_gui()
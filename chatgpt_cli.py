@@ -1,21 +1,25 @@
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
+from llm_providers import get_router
+from chat_profiles import CHATGPT_MODEL as MODEL, CHATGPT_SYSTEM_PROMPT as SYSTEM_PROMPT
 
 # .envからAPIキー読み込み
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+router = get_router()  # プロバイダ共通ルーター（クライアント共有・リトライ・レート制限）
 
-def ask_chatgpt(prompt):
+def ask_chatgpt(prompt, on_token=None):
+    # on_token を渡すとストリーミングで受信し、差分ごとに呼び出す
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        chat_completion = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "あなたは有能なAIアシスタントです。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return chat_completion.choices[0].message.content
+        if on_token is None:
+            return router.complete(messages, model=MODEL).text
+        parts = []
+        for delta in router.stream(messages, model=MODEL):
+            parts.append(delta)
+            on_token(delta)
+        return "".join(parts)
     except Exception as e:
         return f"エラー: {e}"
 
@@ -0,0 +1,361 @@
+"""
+Claude CLI の常駐セッションプール。
+
+入力のたびに `wsl -e bash -c "cd … && cat … | claude"` を起動する代わりに、役割フォルダ
+（writer-ai / idea-ai / proof-ai）ごとに CLI を stream-json モードで N 本起動したままにし、
+標準入出力のパイプで1ターンずつやり取りする。WSL・シェル・CLI の起動は最初の1回だけで、
+会話の文脈もセッション内に残る。
+
+  - ask(): 空いているセッションに user メッセージを1行書き、result イベントが来るまで読む
+  - ヘルスチェック: CLAUDE_POOL_HEALTH_INTERVAL 秒ごとに空きセッションの生存を確認し、
+    落ちていれば起動し直す。応答が CLAUDE_POOL_TIMEOUT 秒を超えたセッションは強制終了して入れ替える
+  - 失敗（異常終了・タイムアウト）したターンは新しいセッションで1回だけやり直す
+
+環境変数:
+  CLAUDE_POOL_CMD       起動コマンド（{cwd} に役割フォルダが入る。無ければ作業フォルダとして渡す）
+                        例: python bench/fake_claude.py --startup 1.5（テスト用の偽物）
+  CLAUDE_ROLE_DIRS      役割 → フォルダ（既定 writer=~/my-ai-team/writer-ai,idea=…/idea-ai,proof=…/proof-ai）
+  CLAUDE_POOL_SIZE      役割ごとのセッション数（既定 1）
+  CLAUDE_POOL_TIMEOUT   1ターンの上限秒数（既定 600）
+  CLAUDE_POOL_MAX_TURNS この回数答えたセッションは入れ替える（既定 0 = 入れ替えない）
+  CLAUDE_POOL_HEALTH_INTERVAL  ヘルスチェックの間隔秒（既定 30）
+
+使い方: python claude_pool.py -r writer "こんにちは"（-f で入力ファイル, 省略時は標準入力）
+"""
+import argparse
+import atexit
+import collections
+import json
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+import metrics
+
+STREAM_ARGS = "-p --input-format stream-json --output-format stream-json --verbose"
+if os.name == "nt":
+    DEFAULT_CMD = f'wsl -e bash -lc "cd {{cwd}} && exec claude {STREAM_ARGS}"'
+else:
+    DEFAULT_CMD = f"claude {STREAM_ARGS}"
+DEFAULT_ROLE_DIRS = "writer=~/my-ai-team/writer-ai,idea=~/my-ai-team/idea-ai,proof=~/my-ai-team/proof-ai"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def role_dirs() -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for item in (os.getenv("CLAUDE_ROLE_DIRS") or DEFAULT_ROLE_DIRS).split(","):
+        if "=" in item:
+            role, path = item.split("=", 1)
+            out[role.strip()] = path.strip()
+    return out
+
+
+def build_argv(cmd: str, cwd: str):
+    """コマンドと作業フォルダ。{cwd} を含むコマンド（WSL 経由など）はフォルダをコマンド側で扱う。"""
+    if "{cwd}" in cmd:
+        return shlex.split(cmd.replace("{cwd}", cwd)), None
+    local = os.path.expanduser(cwd)
+    return shlex.split(cmd), (local if os.path.isdir(local) else None)
+
+
+class ClaudeSessionError(RuntimeError):
+    pass
+
+
+@dataclass
+class Reply:
+    text: str
+    is_error: bool = False
+    session_id: str = ""
+    elapsed: float = 0.0
+    result: dict = field(default_factory=dict)
+
+
+class ClaudeSession:
+    """stream-json で会話を続ける CLI プロセス1本。"""
+
+    def __init__(self, role: str, argv: List[str], cwd: Optional[str] = None):
+        self.role = role
+        self.argv = argv
+        self.cwd = cwd
+        self.turns = 0
+        self.session_id = ""
+        self.proc: Optional[subprocess.Popen] = None
+        self._events: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._stderr: Deque[str] = collections.deque(maxlen=20)
+
+    def start(self) -> "ClaudeSession":
+        self.proc = subprocess.Popen(
+            self.argv, cwd=self.cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding="utf-8", errors="replace", bufsize=1)
+        threading.Thread(target=self._read_stdout, args=(self.proc,), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.proc,), daemon=True).start()
+        return self
+
+    def _read_stdout(self, proc: subprocess.Popen) -> None:
+        for line in proc.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self._events.put(json.loads(line))
+            except ValueError:
+                self._stderr.append(line)  # JSON 以外の出力は診断用に残す
+        self._events.put(None)  # EOF = プロセス終了
+
+    def _read_stderr(self, proc: subprocess.Popen) -> None:
+        for line in proc.stderr:
+            self._stderr.append(line.rstrip())
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def diagnostics(self) -> str:
+        code = self.proc.poll() if self.proc else None
+        tail = " | ".join(list(self._stderr)[-3:])
+        return f"exit={code}" + (f" stderr: {tail}" if tail else "")
+
+    def ask(self, text: str, timeout: float) -> Reply:
+        if not self.alive():
+            raise ClaudeSessionError(f"{self.role} session is not running ({self.diagnostics()})")
+        while True:  # 前のターンの残り（init など）を捨てる
+            try:
+                ev = self._events.get_nowait()
+            except queue.Empty:
+                break
+            self._absorb(ev)
+            if ev is None:
+                break
+        msg = {"type": "user", "message": {"role": "user", "content": [{"type": "text", "text": text}]}}
+        started = time.monotonic()
+        try:
+            self.proc.stdin.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise ClaudeSessionError(f"{self.role} session stdin closed: {e}") from e
+
+        parts: List[str] = []
+        deadline = started + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{self.role} session did not answer within {timeout:g}s")
+            try:
+                ev = self._events.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if ev is None:
+                self._events.put(None)
+                raise ClaudeSessionError(f"{self.role} session exited ({self.diagnostics()})")
+            self._absorb(ev)
+            if ev.get("type") == "assistant":
+                for block in (ev.get("message") or {}).get("content") or []:
+                    if isinstance(block, dict) and block.get("type") == "text":
+                        parts.append(block.get("text", ""))
+            elif ev.get("type") == "result":
+                self.turns += 1
+                result = ev.get("result")
+                return Reply(text=result if isinstance(result, str) else "".join(parts),
+                             is_error=bool(ev.get("is_error")), session_id=self.session_id,
+                             elapsed=time.monotonic() - started, result=ev)
+
+    def _absorb(self, ev: Optional[dict]) -> None:
+        if ev is None:
+            self._events.put(None)
+        elif ev.get("session_id"):
+            self.session_id = ev["session_id"]
+
+    def close(self, wait: float = 2.0) -> None:
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(wait)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ClaudePool:
+    """役割フォルダ1つ分のセッションプール。"""
+
+    def __init__(self, role: str, cwd: Optional[str] = None, size: Optional[int] = None,
+                 cmd: Optional[str] = None, timeout: Optional[float] = None,
+                 max_turns: Optional[int] = None, health_interval: Optional[float] = None):
+        self.role = role
+        self.cwd = cwd or role_dirs().get(role) or "."
+        self.size = max(1, size or int(_env_float("CLAUDE_POOL_SIZE", 1)))
+        self.cmd = cmd or os.getenv("CLAUDE_POOL_CMD") or DEFAULT_CMD
+        self.timeout = timeout or _env_float("CLAUDE_POOL_TIMEOUT", 600)
+        self.max_turns = max_turns if max_turns is not None else int(_env_float("CLAUDE_POOL_MAX_TURNS", 0))
+        self.health_interval = health_interval or _env_float("CLAUDE_POOL_HEALTH_INTERVAL", 30)
+        self._idle: List[ClaudeSession] = []
+        self._all: List[ClaudeSession] = []
+        self._cond = threading.Condition()
+        self._closed = threading.Event()
+        self._started = False
+
+    def _spawn(self) -> ClaudeSession:
+        try:
+            argv, cwd = build_argv(self.cmd, self.cwd)
+            return ClaudeSession(self.role, argv, cwd).start()
+        except (OSError, ValueError) as e:
+            raise ClaudeSessionError(f"{self.role} session could not start ({self.cmd!r}): {e}") from e
+
+    def start(self) -> "ClaudePool":
+        """
+        全セッションを起動する（起動待ちを最初の入力から外す）。失敗したら起動済みの分も閉じて
+        ClaudeSessionError を投げ、次の start()（ask() の最初で呼ばれる）でやり直す。
+        """
+        with self._cond:
+            if self._started:
+                return self
+            sessions: List[ClaudeSession] = []
+            try:
+                for _ in range(self.size):
+                    sessions.append(self._spawn())
+            except ClaudeSessionError:
+                for s in sessions:
+                    s.close(wait=0.5)
+                raise
+            self._all.extend(sessions)
+            self._idle.extend(sessions)
+            self._started = True
+        threading.Thread(target=self._health_loop, name=f"claude-pool-{self.role}", daemon=True).start()
+        return self
+
+    def _replace(self, old: ClaudeSession, reason: str) -> ClaudeSession:
+        old.close(wait=0.5)
+        metrics.inc("claude_pool_restarts_total", role=self.role, reason=reason)
+        new = self._spawn()
+        with self._cond:
+            self._all = [new if s is old else s for s in self._all]
+        return new
+
+    def _acquire(self) -> ClaudeSession:
+        self.start()
+        with self._cond:
+            while not self._idle:
+                if self._closed.is_set():
+                    raise ClaudeSessionError("pool is closed")
+                self._cond.wait()
+            return self._idle.pop()
+
+    def _release(self, session: ClaudeSession) -> None:
+        if self.max_turns and session.turns >= self.max_turns:
+            try:
+                session = self._replace(session, "max_turns")
+            except ClaudeSessionError as e:
+                # 閉じたセッションのまま戻し、次の ask() で起動し直す
+                print(f"[claude-pool] {e}")
+        with self._cond:
+            self._idle.append(session)
+            self._cond.notify()
+
+    def ask(self, text: str, timeout: Optional[float] = None, retries: int = 1) -> Reply:
+        session = self._acquire()
+        try:
+            for attempt in range(retries + 1):
+                if not session.alive():
+                    session = self._replace(session, "dead")
+                try:
+                    with metrics.span("claude_turn", role=self.role):
+                        return session.ask(text, timeout or self.timeout)
+                except (ClaudeSessionError, TimeoutError) as e:
+                    reason = "timeout" if isinstance(e, TimeoutError) else "error"
+                    print(f"[claude-pool] {self.role}: {e}")
+                    session = self._replace(session, reason)
+                    if attempt >= retries:
+                        raise
+        finally:
+            self._release(session)
+        raise ClaudeSessionError("unreachable")
+
+    def _health_loop(self) -> None:
+        while not self._closed.wait(self.health_interval):
+            with self._cond:
+                dead = [s for s in self._idle if not s.alive()]
+                self._idle = [s for s in self._idle if s.alive()]
+            for s in dead:
+                print(f"[claude-pool] {self.role}: restarting ({s.diagnostics()})")
+                try:
+                    new = self._replace(s, "health")
+                except ClaudeSessionError as e:
+                    print(f"[claude-pool] {e}")
+                    new = s  # 次の確認か ask() で起動し直す
+                with self._cond:
+                    self._idle.append(new)
+                    self._cond.notify()
+            metrics.set_gauge("claude_pool_idle", len(self._idle), role=self.role)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"role": self.role, "size": self.size, "idle": len(self._idle),
+                    "alive": sum(1 for s in self._all if s.alive()),
+                    "turns": [s.turns for s in self._all]}
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._cond:
+            sessions = list(self._all)
+            self._cond.notify_all()
+        for s in sessions:
+            s.close()
+
+
+_pools: Dict[str, ClaudePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(role: str = "writer") -> ClaudePool:
+    with _pools_lock:
+        pool = _pools.get(role)
+        if pool is None:
+            pool = _pools[role] = ClaudePool(role)
+        return pool
+
+
+@atexit.register
+def close_all() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="常駐 Claude セッションに1ターン送る")
+    ap.add_argument("text", nargs="?", help="送る内容（省略時は -f か標準入力）")
+    ap.add_argument("-r", "--role", default="writer", help=f"役割（{', '.join(role_dirs())}）")
+    ap.add_argument("-f", "--file", help="入力ファイル")
+    args = ap.parse_args(argv)
+    if args.text is not None:
+        text = args.text
+    elif args.file:
+        with open(args.file, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = sys.stdin.read()
+    reply = get_pool(args.role).ask(text)
+    print(reply.text)
+    print(f"[claude-pool] {args.role}: {reply.elapsed:.2f}s session={reply.session_id}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,45 @@
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 import time
+from conversation_builder import Conversation, SharedContext, llm_summarizer
+from llm_providers import get_router
+from chat_profiles import BOARD_FILE, PLANNER_MODEL as MODEL, PLANNER_SYSTEM_PROMPT as SYSTEM_PROMPT
 
 # .env ファイルから OpenAI APIキー読み込み
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+router = get_router()  # プロバイダ共通ルーター（クライアント共有・リトライ・レート制限）
+
+# 掲示板を先頭に置いた会話（毎回同じ前置きなのでプロンプトキャッシュが効く・古いターンは要約）
+conversation = Conversation(SYSTEM_PROMPT, shared=SharedContext([os.path.abspath(BOARD_FILE)]),
+                            summarizer=llm_summarizer(router), model=MODEL)
 
 # 初期掲示板の読み込み
 def load_bulletin_board():
     try:
-        with open("bulletin-board.md", "r", encoding="utf-8") as f:
+        with open(BOARD_FILE, "r", encoding="utf-8") as f:
             return f.read()
     except FileNotFoundError:
         return "📌 掲示板ファイルが見つかりませんでした。bulletin-board.md を作成してください。"
 
-# ChatGPTへ質問を送信
-def ask_chatgpt(prompt):
+# ChatGPTへ質問を送信（掲示板とこれまでの会話を付けて送る）
+def ask_chatgpt(prompt, on_token=None):
+    # on_token を渡すとストリーミングで受信し、差分ごとに呼び出す
+    messages = conversation.build(prompt)
     try:
-        chat_completion = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "あなたは優秀な企画支援AIアシスタントです。Markdownスタイルで返答してください。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return chat_completion.choices[0].message.content
+        if on_token is None:
+            res = router.complete(messages, model=MODEL)
+            reply, usage = res.text, res.usage
+        else:
+            parts, usage = [], {}
+            for delta in router.stream(messages, model=MODEL, usage=usage):
+                parts.append(delta)
+                on_token(delta)
+            reply = "".join(parts)
     except Exception as e:
         return f"⚠️ エラー: {e}"
+    conversation.record(usage)
+    conversation.add_turn(prompt, reply)
+    return reply
 
 # メイン処理
 def main():
@@ -45,15 +57,30 @@ def main():
     # 入力ループ
     while True:
         user_input = input("> あなた > ")
-        if user_input.lower() in ["exit", "quit"]:
+        if user_input.lower() in ["exit", "quit", "/exit"]:
             print("✔️ セッションを終了します。")
             break
         elif user_input.lower() in ["help", "/help"]:
-            print("🟡 使い方：質問を入力してください。/exit で終了します。\n")
+            print("🟡 使い方：質問を入力してください。/reset で会話をやり直し、/cache でキャッシュ状況、/exit で終了します。\n")
+            continue
+        elif user_input.lower() == "/reset":
+            conversation.reset()
+            print("🧹 会話をリセットしました（掲示板は引き続き送ります）。\n")
+            continue
+        elif user_input.lower() == "/cache":
+            print(f"📊 {conversation.cache}  要約 {conversation.compactions} 回\n")
             continue
-        print("ChatGPT > ", end="", flush=True)
-        reply = ask_chatgpt(user_input)
-        print(f"\n{reply}\n")
+        print("ChatGPT > ", flush=True)
+        shown = []
+
+        def show(token):
+            shown.append(token)
+            print(token, end="", flush=True)
+
+        reply = ask_chatgpt(user_input, on_token=show)
+        if reply != "".join(shown):  # エラー時はメッセージを表示
+            print(f"\n{reply}", end="")
+        print("\n")
 
 if __name__ == "__main__":
     main()
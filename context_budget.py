@@ -0,0 +1,147 @@
+"""
+役割間で受け渡す文脈のトークン予算。
+
+チェーン実行では前段の出力がそのまま次段の入力になるため、段を重ねるほどプロンプトが
+長くなる。ContextBudget.fit() は次段の入力が予算（トークン数）を超えるときだけ、
+  - 元の依頼（最初の入力）を先頭に残し
+  - 前段の出力は先頭から入るだけそのまま残し、
+  - 入りきらない残りは見出し・箇条書き・結論などの要点行だけを抜き出して付ける
+形に縮める（LLM を呼ばない抽出なので速い）。予算内なら入力は今まで通り変えない。
+
+トークン数は tiktoken があればそれで数え、無ければ文字種から概算する
+（日本語などの全角文字は1文字≒1トークン、それ以外は4文字≒1トークン）。
+
+環境変数:
+  ORCH_STAGE_BUDGET  次段に渡す入力の上限トークン数（既定 6000, 0 で無効）
+役割カードに "max_input_tokens" があればその役割ではそちらを優先する。
+"""
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # 任意依存
+    tiktoken = None
+
+DEFAULT_STAGE_BUDGET = 6000
+REQUEST_SHARE = 0.25   # 元の依頼に使ってよい割合
+KEEP_SHARE = 0.6       # 前段の出力のうち原文のまま残す割合（残りは要点）
+
+_WIDE = re.compile(r"[　-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+_SENTENCE = re.compile(r"(?<=[。！？!?])|(?<=\.)\s+|\n+")
+_KEY_LINE = re.compile(r"^\s*(#{1,6}\s|[-*+・●■◆]\s?|\d+[.)．、]\s?|【|\[[^\]]+\]|>)")
+_KEY_WORD = re.compile(r"結論|要点|重要|必須|注意|まとめ|提案|課題|リスク|次のアクション|"
+                       r"conclusion|summary|key|must|todo", re.I)
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: Optional[str]):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model or "gpt-4o-mini")
+    except Exception:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    wide = len(_WIDE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """先頭から max_tokens に収まる分だけを返す。"""
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding(model)
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        out = enc.decode(ids[:max_tokens])
+        while out and not text.startswith(out):  # 多バイト文字の途中で切れた分を落とす
+            out = out[:-1]
+        return out
+    if count_tokens(text) <= max_tokens:
+        return text
+    # 概算は文字数に単調なので二分探索で切る位置を決める（1文字は最低 1/4 トークン）
+    lo, hi = 0, min(len(text), max_tokens * 4 + 3)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def key_points(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """見出し・箇条書き・結論などの行を元の順で抜き出す（無ければ各段落の最初の文）。"""
+    lines = [ln.rstrip() for ln in text.splitlines() if ln.strip()]
+    picked = [ln for ln in lines if _KEY_LINE.match(ln) or _KEY_WORD.search(ln)]
+    if not picked:
+        for para in re.split(r"\n\s*\n", text):
+            first = next((s.strip() for s in _SENTENCE.split(para) if s and s.strip()), "")
+            if first:
+                picked.append(first)
+    out: List[str] = []
+    used = 0
+    for ln in picked:
+        n = count_tokens(ln, model) + 1
+        if used + n > max_tokens:
+            break
+        out.append(ln)
+        used += n
+    return "\n".join(out)
+
+
+class ContextBudget:
+    """次段の入力をトークン予算に収める。"""
+
+    def __init__(self, max_tokens: Optional[int] = None, model: Optional[str] = None,
+                 summarizer: Optional[Callable[[str, int], str]] = None):
+        if max_tokens is None:
+            try:
+                max_tokens = int(os.getenv("ORCH_STAGE_BUDGET", DEFAULT_STAGE_BUDGET))
+            except ValueError:
+                max_tokens = DEFAULT_STAGE_BUDGET
+        self.max_tokens = max_tokens
+        self.model = model
+        # 抽出の代わりに使う要約関数 summarizer(text, max_tokens) -> str（LLM 要約など）
+        self.summarizer = summarizer
+        self.trimmed = 0  # 縮めた回数（並列ステージのスレッドから数えるのでロックで守る）
+        self._lock = threading.Lock()
+
+    def limit_for(self, cards: List[dict]) -> int:
+        limits = [int(c["max_input_tokens"]) for c in cards if c.get("max_input_tokens")]
+        return min(limits + [self.max_tokens]) if self.max_tokens > 0 else min(limits, default=0)
+
+    def fit(self, request: str, previous: str, limit: Optional[int] = None) -> str:
+        """予算内なら previous をそのまま返し、超える場合は元の依頼＋前段の要約に縮める。"""
+        limit = self.max_tokens if limit is None else limit
+        if limit <= 0 or count_tokens(previous, self.model) <= limit:
+            return previous
+        with self._lock:
+            self.trimmed += 1
+        req = request.strip()
+        if req and req != previous.strip():
+            req = truncate_tokens(req, int(limit * REQUEST_SHARE), self.model)
+            head = f"【元の依頼】\n{req}\n\n【前段の出力（長いため一部を要約）】\n"
+        else:
+            head = ""
+        room = limit - count_tokens(head, self.model)
+        keep = truncate_tokens(previous, int(room * KEEP_SHARE), self.model)
+        rest = previous[len(keep):]
+        room_rest = room - count_tokens(keep, self.model) - 16
+        if self.summarizer is not None:
+            summary = self.summarizer(rest, room_rest)
+        else:
+            summary = key_points(rest, room_rest, self.model)
+        tail = f"\n\n（以下、後半の要点）\n{summary}" if summary else "\n\n（以下省略）"
+        return head + keep.rstrip() + tail
@@ -0,0 +1,250 @@
+"""
+プロンプトキャッシュが効く並びでメッセージを組み立てる。
+
+OpenAI（1024 トークン以上の共通の先頭部分を自動でキャッシュ）や Anthropic（cache_control を付けた
+system ブロックまでをキャッシュ）は、リクエストの先頭がバイト単位で同じときだけキャッシュが効く。
+毎回変わらない内容を先頭に固め、変わる内容ほど後ろに置く。
+
+  [system] 共有の前置き（プロジェクト文脈・bulletin-board.md）   全役割・全ターンで同じ
+  [system] 役割の system_prompt                                  役割ごとに同じ
+  [system] これまでの会話の要約                                  圧縮したときだけ変わる
+  [user / assistant] 直近のターン（そのまま）
+  [user] 今回の入力
+
+会話が長くなったら（要約されていない履歴が CONV_COMPACT_AFTER トークン, 既定 3000 を超えたら）、
+直近 CONV_KEEP_RECENT 件（既定 6 メッセージ）を残して古いターンを要約にまとめる。
+毎ターン少しずつ削るのではなく一度にまとめるので、次に圧縮するまでは先頭部分が変わらない。
+
+応答の usage（prompt_tokens / cached_tokens）を record() で渡すと、キャッシュされた割合を集計する。
+
+  shared = SharedContext(["bulletin-board.md"])
+  conv = Conversation(SYSTEM_PROMPT, shared=shared, summarizer=llm_summarizer(router))
+  messages = conv.build("質問")
+  res = router.complete(messages, model=MODEL)
+  conv.add_turn("質問", res.text)
+  conv.record(res.usage)             # conv.cache.ratio / cache_stats.snapshot()
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import metrics
+from context_budget import count_tokens, key_points
+
+Messages = List[Dict[str, str]]
+Summarizer = Callable[[str, Messages], str]
+
+SUMMARY_HEADER = "# これまでの会話の要約"
+SUMMARY_PROMPT = ("以下はユーザーとアシスタントの会話です。今後の回答に必要な事実・決定事項・未解決の論点・"
+                  "ユーザーの希望を、箇条書きで簡潔にまとめてください。前回までの要約があれば統合してください。")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _normalize(text: str) -> str:
+    # 改行コード・末尾の空白の違いで先頭部分のバイト列が変わらないようにする
+    return "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").split("\n")).strip()
+
+
+class SharedContext:
+    """
+    全役割・全ターンで共有する前置き。ファイルは更新時刻が変わったときだけ読み直し、
+    内容が同じ限り text() は毎回同じ文字列を返す。
+    """
+
+    def __init__(self, paths: Sequence[str] = (), texts: Sequence[str] = (), base_dir: Optional[str] = None):
+        self.base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+        self.paths = [p if os.path.isabs(p) else os.path.join(self.base_dir, p) for p in paths]
+        self.texts = [_normalize(t) for t in texts if t and t.strip()]
+        self._files: Dict[str, tuple] = {}  # path -> ((mtime_ns, size), text)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str = "CONV_SHARED_CONTEXT", default: Sequence[str] = ()) -> "SharedContext":
+        """環境変数（カンマ区切りのファイル名）から作る。"""
+        raw = os.getenv(name)
+        paths = [p.strip() for p in raw.split(",") if p.strip()] if raw is not None else list(default)
+        return cls(paths)
+
+    def _read(self, path: str) -> str:
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._files.pop(path, None)
+            return ""
+        key = (st.st_mtime_ns, st.st_size)
+        hit = self._files.get(path)
+        if hit is None or hit[0] != key:
+            with open(path, encoding="utf-8-sig") as f:
+                hit = self._files[path] = (key, _normalize(f.read()))
+        return hit[1]
+
+    def text(self) -> str:
+        blocks = list(self.texts)
+        with self._lock:
+            for path in self.paths:
+                body = self._read(path)
+                if body:
+                    blocks.append(f"# {os.path.basename(path)}\n{body}")
+        return "\n\n".join(blocks)
+
+
+def prefix_messages(system_prompt: str, shared: Optional[SharedContext] = None) -> Messages:
+    """共有の前置き → 役割の system_prompt の順の system メッセージ。"""
+    out: Messages = []
+    common = shared.text() if shared is not None else ""
+    if common:
+        out.append({"role": "system", "content": common})
+    if system_prompt and system_prompt.strip():
+        out.append({"role": "system", "content": _normalize(system_prompt)})
+    return out
+
+
+def role_messages(system_prompt: str, text: str, shared: Optional[SharedContext] = None) -> Messages:
+    """1回きりの呼び出し（オーケストレーターの各役割など）用。"""
+    return prefix_messages(system_prompt, shared) + [{"role": "user", "content": text}]
+
+
+@dataclass
+class CacheStats:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    def record(self, usage: Optional[Dict[str, int]]) -> None:
+        if not usage or not usage.get("prompt_tokens"):
+            return
+        self.requests += 1
+        self.prompt_tokens += int(usage.get("prompt_tokens") or 0)
+        self.cached_tokens += int(usage.get("cached_tokens") or 0)
+
+    @property
+    def ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def snapshot(self) -> dict:
+        return {"requests": self.requests, "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens, "cached_ratio": round(self.ratio, 3)}
+
+    def __str__(self) -> str:
+        return (f"prompt_tokens={self.prompt_tokens} cached={self.cached_tokens} "
+                f"({self.ratio:.0%}, {self.requests} requests)")
+
+
+cache_stats = CacheStats()  # プロセス全体の集計
+_stats_lock = threading.Lock()
+
+
+def record_usage(usage: Optional[Dict[str, int]], *extra: CacheStats) -> None:
+    """usage をプロセス全体（と渡された CacheStats）に加算する。"""
+    with _stats_lock:
+        cache_stats.record(usage)
+        for s in extra:
+            s.record(usage)
+        ratio = cache_stats.ratio
+    if usage and usage.get("prompt_tokens"):
+        metrics.set_gauge("llm_cached_prompt_ratio", round(ratio, 4))
+
+
+def render_turns(messages: Messages) -> str:
+    who = {"user": "ユーザー", "assistant": "アシスタント"}
+    return "\n\n".join(f"[{who.get(m['role'], m['role'])}]\n{m['content']}" for m in messages)
+
+
+def heuristic_summarizer(previous: str, messages: Messages) -> str:
+    """LLM を使わない要約（要点らしい行を残す）。"""
+    body = (previous + "\n\n" if previous else "") + render_turns(messages)
+    return key_points(body, 2000)
+
+
+def llm_summarizer(router, model: Optional[str] = None) -> Summarizer:
+    """ルーターで要約する。失敗したら heuristic_summarizer に切り替える。"""
+    model = model or os.getenv("CONV_SUMMARY_MODEL") or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+    def summarize(previous: str, messages: Messages) -> str:
+        parts = [f"## 前回までの要約\n{previous}"] if previous else []
+        parts.append("## 会話\n" + render_turns(messages))
+        try:
+            with metrics.span("conv_summarize"):
+                res = router.complete([{"role": "system", "content": SUMMARY_PROMPT},
+                                       {"role": "user", "content": "\n\n".join(parts)}],
+                                      model=model, temperature=0.0)
+            return res.text.strip()
+        except Exception as e:  # 要約の失敗で会話を止めない
+            print(f"[conversation] summarize failed: {e}")
+            return heuristic_summarizer(previous, messages)
+
+    return summarize
+
+
+class Conversation:
+    """1つの会話（セッション）。履歴・要約・キャッシュの集計を持つ。"""
+
+    def __init__(self, system_prompt: str = "", shared: Optional[SharedContext] = None,
+                 summarizer: Optional[Summarizer] = None, compact_after: Optional[int] = None,
+                 keep_recent: Optional[int] = None, model: Optional[str] = None):
+        self.system_prompt = system_prompt
+        self.shared = shared
+        self.summarizer = summarizer or heuristic_summarizer
+        self.compact_after = compact_after if compact_after is not None else _env_int("CONV_COMPACT_AFTER", 3000)
+        self.keep_recent = max(0, keep_recent if keep_recent is not None else _env_int("CONV_KEEP_RECENT", 6))
+        self.model = model
+        self.summary = ""
+        self.turns: Messages = []  # 要約されていない履歴
+        self.compactions = 0
+        self.cache = CacheStats()
+
+    def build(self, prompt: str) -> Messages:
+        out = prefix_messages(self.system_prompt, self.shared)
+        if self.summary:
+            out.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{self.summary}"})
+        return out + list(self.turns) + [{"role": "user", "content": prompt}]
+
+    def add_turn(self, prompt: str, reply: str) -> None:
+        self.turns += [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+        self.maybe_compact()
+
+    def history_tokens(self) -> int:
+        return sum(count_tokens(m["content"], self.model) for m in self.turns)
+
+    def maybe_compact(self) -> bool:
+        if self.compact_after <= 0 or len(self.turns) <= self.keep_recent:
+            return False
+        if self.history_tokens() <= self.compact_after:
+            return False
+        # ユーザーの発言から始まるよう、残す側の先頭をターンの区切りに合わせる
+        cut = len(self.turns) - self.keep_recent
+        cut -= cut % 2
+        if cut <= 0:
+            return False
+        old, self.turns = self.turns[:cut], self.turns[cut:]
+        self.summary = self.summarizer(self.summary, old).strip()
+        self.compactions += 1
+        metrics.inc("conv_compactions_total")
+        return True
+
+    def record(self, usage: Optional[Dict[str, int]]) -> None:
+        record_usage(usage, self.cache)
+
+    def reset(self) -> None:
+        self.summary = ""
+        self.turns = []
+
+    # -- 保存用
+    def to_dict(self) -> dict:
+        return {"summary": self.summary, "messages": self.turns, "compactions": self.compactions,
+                "cache": self.cache.snapshot()}
+
+    def load(self, data: dict) -> "Conversation":
+        self.summary = data.get("summary", "")
+        self.turns = list(data.get("messages", []))
+        self.compactions = data.get("compactions", 0)
+        c = data.get("cache") or {}
+        self.cache = CacheStats(c.get("requests", 0), c.get("prompt_tokens", 0), c.get("cached_tokens", 0))
+        return self
@@ -0,0 +1,179 @@
+"""
+LLM 応答キャッシュ（SQLite）。
+
+(model, messages, temperature) をまとめてハッシュ化したキーで応答本文を保存し、
+監視スクリプトの再発火やパイプラインの再実行で同じリクエストを送らないようにする。
+
+環境変数:
+  LLM_CACHE_PATH         保存先（既定: .cache/llm_cache.sqlite3）
+  LLM_CACHE_TTL          有効期限（秒, 既定 7日, 0 で無期限）
+  LLM_CACHE_MAX_ENTRIES  保持件数の上限（超過分は最終参照が古い順に削除, 既定 5000）
+  LLM_CACHE_BYPASS       1 で参照をスキップ（応答は取り直して上書き保存）
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_PATH = BASE_DIR / ".cache" / "llm_cache.sqlite3"
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 5000
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def request_key(model: str, messages: List[Dict[str, str]],
+                temperature: Optional[float] = None, **params) -> str:
+    # キー順と区切りを固定して、同じリクエストが必ず同じハッシュになるようにする
+    payload = {"model": model, "messages": messages, "temperature": temperature}
+    payload.update(params)
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None, bypass: Optional[bool] = None):
+        self.path = Path(path or os.getenv("LLM_CACHE_PATH") or DEFAULT_PATH)
+        self.ttl = float(ttl if ttl is not None else os.getenv("LLM_CACHE_TTL", DEFAULT_TTL))
+        self.max_entries = int(max_entries if max_entries is not None
+                               else os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        self.bypass = _env_flag("LLM_CACHE_BYPASS") if bypass is None else bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, key: str) -> Optional[str]:
+        if self.bypass:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl > 0 and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_entries > 0:
+            # 最終参照が古いものから上限を超えた分を落とす（LRU）
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            n = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": n}
+
+
+_default: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """プロセス内で共有する既定キャッシュ。"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ResponseCache()
+        return _default
+
+
+def cached_completion(client, model: str, messages: List[Dict[str, str]],
+                      temperature: Optional[float] = None,
+                      cache: Optional[ResponseCache] = None) -> str:
+    """
+    chat.completions.create のキャッシュ付き版。応答本文（content）を返す。
+    例外はキャッシュせずそのまま送出する。
+    """
+    cache = cache or get_cache()
+    key = request_key(model, messages, temperature)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    kwargs = {} if temperature is None else {"temperature": temperature}
+    res = client.chat.completions.create(model=model, messages=messages, **kwargs)
+    text = res.choices[0].message.content or ""
+    cache.put(key, model, text)
+    return text
+
+
+def cached_stream(client, model: str, messages: List[Dict[str, str]],
+                  temperature: Optional[float] = None,
+                  cache: Optional[ResponseCache] = None) -> Iterator[str]:
+    """
+    stream=True 版。トークン差分を順に yield する。
+    キャッシュヒット時は保存済み本文を一度に返し、最後まで受信できた応答だけを保存する。
+    """
+    cache = cache or get_cache()
+    key = request_key(model, messages, temperature)
+    hit = cache.get(key)
+    if hit is not None:
+        yield hit
+        return
+    kwargs = {} if temperature is None else {"temperature": temperature}
+    stream = client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+    parts: List[str] = []
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+    cache.put(key, model, "".join(parts))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="LLM 応答キャッシュの確認/削除")
+    ap.add_argument("--clear", action="store_true", help="全件削除")
+    args = ap.parse_args()
+    c = get_cache()
+    if args.clear:
+        c.clear()
+    print(json.dumps({"path": str(c.path), **c.stats()}, ensure_ascii=False))
@@ -0,0 +1,494 @@
+"""
+LLM プロバイダ共通レイヤー。
+
+OpenAI / Anthropic / Gemini のクライアントをプロバイダごとに1つだけ作って使い回し
+（SDK 内部の HTTP コネクションプールを共有）、役割カードの recommended_api で振り分ける。
+全リクエストに共通して以下をかける。
+  - モデル単位のトークンバケットによるレート制限
+  - 一時的なエラー（429 / 5xx / タイムアウト / 接続断）の指数バックオフ + ジッター付きリトライ
+  - 応答キャッシュ（llm_cache）
+  - 同じリクエストが実行中なら新しく送らずに相乗り（singleflight）
+  - 遅いときは別モデルへヘッジ（並走）し、先に返った方を採用 / 失敗時はフォールバック
+
+環境変数:
+  OPENAI_MODEL / ANTHROPIC_MODEL / GEMINI_MODEL  プロバイダごとの既定モデル
+  LLM_RPM                 モデルごとの毎分リクエスト上限（既定 60, 0 で無制限）
+  LLM_RPM_<MODEL>         モデル個別の上限（英数字以外は _ に置換, 例: LLM_RPM_GPT_4O_MINI=300）
+  LLM_BURST               バケット容量（既定 5）
+  LLM_MAX_RETRIES         リトライ回数（既定 3）
+  LLM_FALLBACK            ヘッジ/フォールバック先 "provider:model"（例: openai:gpt-4o-mini）
+  LLM_HEDGE_AFTER         主リクエストがこの秒数で返らなければフォールバック先を並走（既定 0 = 失敗時のみ）
+  LLM_SINGLEFLIGHT        0 で同じリクエストの相乗りをしない（既定 1）
+  ANTHROPIC_PROMPT_CACHE  0 で Anthropic の system ブロックに cache_control を付けない（既定 1）
+
+usage の prompt_tokens はキャッシュから読んだ分（cached_tokens）を含む入力トークン数に揃える。
+"""
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import metrics
+import singleflight
+from llm_cache import ResponseCache, get_cache, request_key
+
+Messages = List[Dict[str, str]]
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-haiku-latest",
+    "gemini": "gemini-1.5-flash",
+}
+# カードの recommended_api の表記ゆれを吸収
+PROVIDER_ALIASES = {
+    "openai": "openai", "chatgpt": "openai", "gpt": "openai",
+    "anthropic": "anthropic", "claude": "anthropic",
+    "gemini": "gemini", "google": "gemini",
+}
+
+
+class ProviderError(Exception):
+    """リトライ・フォールバックを尽くしても応答が得られなかった。"""
+
+
+@dataclass
+class Completion:
+    text: str
+    provider: str
+    model: str
+    usage: Dict[str, int] = field(default_factory=dict)
+    latency: float = 0.0
+    cached: bool = False
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def is_retryable(e: BaseException) -> bool:
+    """SDK を問わず一時的なエラーかどうかを判定する。"""
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    name = type(e).__name__
+    return any(k in name for k in ("RateLimit", "Timeout", "Connection", "Overloaded",
+                                   "ServiceUnavailable", "InternalServer", "ResourceExhausted"))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """1 トークン取得するまで待ち、待った秒数を返す。"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# ---------------------------------------------------------------- providers
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self):
+        from openai import OpenAI
+        # リトライはこのレイヤーで行うので SDK 側は無効化
+        self.client = OpenAI(max_retries=0)
+
+    @staticmethod
+    def _usage(u) -> Dict[str, int]:
+        if not u:
+            return {}
+        usage = {"prompt_tokens": u.prompt_tokens, "completion_tokens": u.completion_tokens}
+        details = getattr(u, "prompt_tokens_details", None)
+        if details is not None and getattr(details, "cached_tokens", None) is not None:
+            usage["cached_tokens"] = details.cached_tokens
+        return usage
+
+    def complete(self, model: str, messages: Messages, temperature: Optional[float]) -> Completion:
+        kwargs = {} if temperature is None else {"temperature": temperature}
+        res = self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        usage = self._usage(getattr(res, "usage", None))
+        return Completion(res.choices[0].message.content or "", self.name, model, usage)
+
+    def stream(self, model: str, messages: Messages, temperature: Optional[float],
+               usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        kwargs = {} if temperature is None else {"temperature": temperature}
+        if usage is not None:
+            kwargs["stream_options"] = {"include_usage": True}  # 最後のチャンクに usage が付く
+        for chunk in self.client.chat.completions.create(model=model, messages=messages,
+                                                         stream=True, **kwargs):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if usage is not None and getattr(chunk, "usage", None):
+                usage.update(self._usage(chunk.usage))
+
+
+def _split_system(messages: Messages) -> Tuple[str, Messages]:
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    return system, [m for m in messages if m["role"] != "system"]
+
+
+class AnthropicProvider:
+    name = "anthropic"
+    max_tokens = 2048
+
+    def __init__(self):
+        import anthropic
+        self.client = anthropic.Anthropic(max_retries=0)
+
+    @staticmethod
+    def _system(messages: Messages):
+        """
+        system メッセージをブロックのまま渡し、先頭（共有の前置き）と最後（役割の指示・要約まで）に
+        cache_control を付ける。短すぎるブロックは API 側で無視される。
+        """
+        blocks = [{"type": "text", "text": m["content"]} for m in messages if m["role"] == "system"]
+        if not blocks or os.getenv("ANTHROPIC_PROMPT_CACHE", "1").strip().lower() in ("0", "false", "no", "off"):
+            return "\n\n".join(b["text"] for b in blocks)
+        for b in {id(blocks[0]): blocks[0], id(blocks[-1]): blocks[-1]}.values():
+            b["cache_control"] = {"type": "ephemeral"}
+        return blocks
+
+    @staticmethod
+    def _usage(u) -> Dict[str, int]:
+        read = getattr(u, "cache_read_input_tokens", None) or 0
+        written = getattr(u, "cache_creation_input_tokens", None) or 0
+        usage = {"prompt_tokens": u.input_tokens + read + written, "completion_tokens": u.output_tokens}
+        if getattr(u, "cache_read_input_tokens", None) is not None:
+            usage["cached_tokens"] = read
+        return usage
+
+    def _kwargs(self, model: str, messages: Messages, temperature: Optional[float]) -> dict:
+        system = self._system(messages)
+        rest = [m for m in messages if m["role"] != "system"]
+        kwargs = {"model": model, "max_tokens": self.max_tokens, "messages": rest}
+        if system:
+            kwargs["system"] = system
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        return kwargs
+
+    def complete(self, model: str, messages: Messages, temperature: Optional[float]) -> Completion:
+        res = self.client.messages.create(**self._kwargs(model, messages, temperature))
+        text = "".join(getattr(b, "text", "") for b in res.content)
+        return Completion(text, self.name, model, self._usage(res.usage))
+
+    def stream(self, model: str, messages: Messages, temperature: Optional[float],
+               usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        with self.client.messages.stream(**self._kwargs(model, messages, temperature)) as s:
+            for text in s.text_stream:
+                yield text
+            if usage is not None:
+                usage.update(self._usage(s.get_final_message().usage))
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    def __init__(self):
+        import google.generativeai as genai
+        key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+        if key:
+            genai.configure(api_key=key)
+        self.genai = genai
+        self._models: Dict[Tuple[str, str], object] = {}
+
+    def _model(self, model: str, system: str):
+        key = (model, system)
+        if key not in self._models:
+            self._models[key] = self.genai.GenerativeModel(model, system_instruction=system or None)
+        return self._models[key]
+
+    @staticmethod
+    def _contents(messages: Messages) -> list:
+        return [{"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]}
+                for m in messages]
+
+    def complete(self, model: str, messages: Messages, temperature: Optional[float]) -> Completion:
+        system, rest = _split_system(messages)
+        config = {} if temperature is None else {"temperature": temperature}
+        res = self._model(model, system).generate_content(self._contents(rest), generation_config=config)
+        meta = getattr(res, "usage_metadata", None)
+        usage = {}
+        if meta is not None:
+            usage = {"prompt_tokens": meta.prompt_token_count,
+                     "completion_tokens": meta.candidates_token_count}
+        return Completion(res.text or "", self.name, model, usage)
+
+    def stream(self, model: str, messages: Messages, temperature: Optional[float],
+               usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        system, rest = _split_system(messages)
+        config = {} if temperature is None else {"temperature": temperature}
+        for chunk in self._model(model, system).generate_content(
+                self._contents(rest), generation_config=config, stream=True):
+            if chunk.text:
+                yield chunk.text
+            meta = getattr(chunk, "usage_metadata", None)
+            if usage is not None and meta is not None and meta.prompt_token_count:
+                usage.update(prompt_tokens=meta.prompt_token_count,
+                             completion_tokens=meta.candidates_token_count)
+
+
+PROVIDERS = {"openai": OpenAIProvider, "anthropic": AnthropicProvider, "gemini": GeminiProvider}
+
+
+# ---------------------------------------------------------------- router
+
+def parse_target(spec: str) -> Tuple[str, str]:
+    """'provider:model' または 'model'（openai）を (provider, model) に。"""
+    if ":" in spec:
+        p, m = spec.split(":", 1)
+        return PROVIDER_ALIASES.get(p.strip().lower(), p.strip().lower()), m.strip()
+    return "openai", spec.strip()
+
+
+class LLMRouter:
+    def __init__(self, cache: Optional[ResponseCache] = None, max_retries: Optional[int] = None,
+                 fallback: Optional[str] = None, hedge_after: Optional[float] = None):
+        self.cache = cache
+        self.max_retries = int(max_retries if max_retries is not None
+                               else os.getenv("LLM_MAX_RETRIES", 3))
+        fb = fallback if fallback is not None else os.getenv("LLM_FALLBACK", "")
+        self.fallback: Optional[Tuple[str, str]] = parse_target(fb) if fb else None
+        self.hedge_after = hedge_after if hedge_after is not None else _env_float("LLM_HEDGE_AFTER", 0)
+        self.singleflight = os.getenv("LLM_SINGLEFLIGHT", "1").strip().lower() not in ("0", "false", "no", "off")
+        self.flights = singleflight.Group("llm")
+        self._providers: Dict[str, object] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+    # -- 振り分け
+    def provider_for(self, card: Optional[dict]) -> str:
+        api = ((card or {}).get("recommended_api") or "openai").strip().lower()
+        return PROVIDER_ALIASES.get(api, "openai")
+
+    def default_model(self, provider: str) -> str:
+        return os.getenv(f"{provider.upper()}_MODEL", DEFAULT_MODELS.get(provider, ""))
+
+    def resolve(self, card: Optional[dict] = None, provider: Optional[str] = None,
+                model: Optional[str] = None) -> Tuple[str, str]:
+        provider = provider or self.provider_for(card)
+        model = model or (card or {}).get("model") or self.default_model(provider)
+        return provider, model
+
+    def provider(self, name: str):
+        with self._lock:
+            p = self._providers.get(name)
+            if p is None:
+                if name not in PROVIDERS:
+                    raise ProviderError(f"unknown provider: {name}")
+                p = self._providers[name] = PROVIDERS[name]()
+            return p
+
+    def bucket(self, model: str) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get(model)
+            if b is None:
+                env = "LLM_RPM_" + re.sub(r"[^0-9A-Za-z]", "_", model).upper()
+                rpm = _env_float(env, _env_float("LLM_RPM", 60))
+                b = self._buckets[model] = TokenBucket(rpm / 60.0, _env_float("LLM_BURST", 5))
+            return b
+
+    # -- 呼び出し
+    def _attempt(self, provider: str, model: str, messages: Messages,
+                 temperature: Optional[float]) -> Completion:
+        p = self.provider(provider)
+        last: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            metrics.observe("llm_queue_wait_seconds", self.bucket(model).acquire(), model=model)
+            started = time.monotonic()
+            try:
+                with metrics.span("llm_request", provider=provider, model=model):
+                    c = p.complete(model, messages, temperature)
+                c.latency = time.monotonic() - started
+                metrics.record_usage(provider, model, c.usage)
+                return c
+            except Exception as e:
+                metrics.inc("llm_errors_total", provider=provider, model=model)
+                last = e
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    break
+                # 指数バックオフ（上限 20 秒）にフルジッター
+                time.sleep(random.uniform(0, min(20.0, 0.5 * 2 ** attempt)))
+        raise ProviderError(f"{provider}:{model}: {last}") from last
+
+    def _hedged(self, primary: Tuple[str, str], messages: Messages,
+                temperature: Optional[float]) -> Completion:
+        fallback = self.fallback if self.fallback and self.fallback != primary else None
+        if fallback is None:
+            return self._attempt(*primary, messages, temperature)
+        if self.hedge_after <= 0:
+            try:
+                return self._attempt(*primary, messages, temperature)
+            except ProviderError:
+                return self._attempt(*fallback, messages, temperature)
+        first = self._pool.submit(self._attempt, *primary, messages, temperature)
+        done, _ = wait([first], timeout=self.hedge_after)
+        futures = [first]
+        if not done or first.exception() is not None:
+            futures.append(self._pool.submit(self._attempt, *fallback, messages, temperature))
+        errors = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    return f.result()  # 負けた側は結果を捨てる（HTTP は途中で止められない）
+                errors.append(f.exception())
+        raise errors[-1]
+
+    @staticmethod
+    def cache_key(provider: str, model: str, messages: Messages, temperature: Optional[float]) -> str:
+        return request_key(model, messages, temperature, **({} if provider == "openai" else {"provider": provider}))
+
+    def complete(self, messages: Messages, card: Optional[dict] = None,
+                 provider: Optional[str] = None, model: Optional[str] = None,
+                 temperature: Optional[float] = None, use_cache: bool = True,
+                 cancel: Optional[threading.Event] = None) -> Completion:
+        """
+        同じリクエスト（プロバイダ・モデル・メッセージ・温度）が実行中なら、その結果を受け取る。
+        cancel が set されたら待つのをやめて singleflight.Superseded を投げる。
+        """
+        provider, model = self.resolve(card, provider, model)
+        cache = (self.cache or get_cache()) if use_cache else None
+        key = self.cache_key(provider, model, messages, temperature)
+        if cache is not None:
+            hit = cache.get(key)
+            if hit is not None:
+                metrics.inc("llm_cache_hits_total", model=model)
+                return Completion(hit, provider, model, cached=True)
+            metrics.inc("llm_cache_misses_total", model=model)
+
+        def call() -> Completion:
+            c = self._hedged((provider, model), messages, temperature)
+            if cache is not None:
+                # フォールバック先が答えたときは、そのモデルのキーで保存する（主モデルの結果として返さない）
+                cache.put(self.cache_key(c.provider, c.model, messages, temperature), c.model, c.text)
+            return c
+
+        if self.singleflight:
+            return self.flights.do(key, call, cancel)
+        c = call()
+        singleflight.check(cancel)
+        return c
+
+    def stream(self, messages: Messages, card: Optional[dict] = None,
+               provider: Optional[str] = None, model: Optional[str] = None,
+               temperature: Optional[float] = None, use_cache: bool = True,
+               usage: Optional[Dict[str, int]] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """
+        トークン差分を順に返す。最初のトークンを受け取る前の一時エラーだけリトライし、
+        主モデルが失敗した場合はフォールバック先から受け直す。
+        usage に dict を渡すと、流し終えた時点でプロバイダが返したトークン数が入る。
+        同じリクエストが流れている最中なら、それまでの差分から相乗りする。
+        cancel が set されたら次の差分の時点で singleflight.Superseded を投げる（相乗りが
+        いなければ上流のストリームも閉じる）。
+        """
+        provider, model = self.resolve(card, provider, model)
+        cache = (self.cache or get_cache()) if use_cache else None
+        key = self.cache_key(provider, model, messages, temperature)
+        if cache is not None:
+            hit = cache.get(key)
+            if hit is not None:
+                metrics.inc("llm_cache_hits_total", model=model)
+                yield hit
+                return
+            metrics.inc("llm_cache_misses_total", model=model)
+
+        def upstream(got: Dict[str, int]) -> Iterator[str]:
+            return self._stream_upstream(provider, model, messages, temperature, cache, key, got)
+
+        if self.singleflight:
+            yield from self.flights.stream(key, upstream, cancel=cancel, usage=usage)
+            return
+        got: Dict[str, int] = {}
+        for delta in upstream(got):
+            yield delta
+            singleflight.check(cancel)
+        if usage is not None:
+            usage.update(got)
+
+    def _stream_upstream(self, provider: str, model: str, messages: Messages,
+                         temperature: Optional[float], cache: Optional[ResponseCache],
+                         key: str, usage: Dict[str, int]) -> Iterator[str]:
+        targets = [(provider, model)]
+        if self.fallback and self.fallback != (provider, model):
+            targets.append(self.fallback)
+        last: Optional[BaseException] = None
+        for prov, mod in targets:
+            p = self.provider(prov)
+            for attempt in range(self.max_retries + 1):
+                metrics.observe("llm_queue_wait_seconds", self.bucket(mod).acquire(), model=mod)
+                parts: List[str] = []
+                got: Dict[str, int] = {}
+                started = time.perf_counter()
+                try:
+                    for delta in p.stream(mod, messages, temperature, usage=got):
+                        if not parts:
+                            metrics.observe("llm_ttft_seconds", time.perf_counter() - started,
+                                            provider=prov, model=mod)
+                        parts.append(delta)
+                        yield delta
+                except Exception as e:
+                    metrics.inc("llm_errors_total", provider=prov, model=mod)
+                    if parts:  # 途中まで流した後の失敗はやり直せない
+                        raise ProviderError(f"{prov}:{mod}: {e}") from e
+                    last = e
+                    if not is_retryable(e) or attempt >= self.max_retries:
+                        break
+                    time.sleep(random.uniform(0, min(20.0, 0.5 * 2 ** attempt)))
+                    continue
+                elapsed = time.perf_counter() - started
+                metrics.observe("llm_stream_seconds", elapsed, provider=prov, model=mod)
+                if got:
+                    metrics.record_usage(prov, mod, got)
+                    usage.update(got)
+                if metrics.tracing():
+                    metrics.trace_event("llm_stream", started, elapsed, provider=prov, model=mod)
+                if cache is not None:
+                    if (prov, mod) != (provider, model):  # フォールバック先の結果はそのモデルのキーで保存
+                        key = self.cache_key(prov, mod, messages, temperature)
+                    cache.put(key, mod, "".join(parts))
+                return
+        raise ProviderError(f"{provider}:{model}: {last}") from last
+
+
+_default: Optional[LLMRouter] = None
+_default_lock = threading.Lock()
+
+
+def get_router() -> LLMRouter:
+    """プロセス内で共有する既定ルーター（プロバイダごとのクライアントもここで共有）。"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _default = LLMRouter()
+        return _default
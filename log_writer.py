@@ -0,0 +1,210 @@
+"""
+ログ書き込みをバックグラウンドスレッドにまとめる共通ライター。
+
+呼び出し側は write()/write_text() でキューに積むだけで、ファイルの open・書き込み・fsync・
+ローテーションは専用スレッドがまとめて行う（並列パイプラインでも応答処理を待たせない）。
+
+  writer = get_writer("logs/orch_{date}.jsonl")   # {date} は YYYY-MM-DD（日付が変わると新しいファイル）
+  writer.write({"role": "...", ...})              # 1行の JSON として追記
+  get_writer("response_log.txt").write_text("...")  # 文字列をそのまま追記
+
+環境変数:
+  LOG_FSYNC_INTERVAL  fsync する間隔（秒, 既定 1.0, 0 でバッチごと）
+  LOG_MAX_BYTES       この大きさを超えたら name.1.jsonl のように退避（既定 50MB, 0 で無効）
+  LOG_COMPRESS        退避したファイルの圧縮: none（既定） / gzip / zstd（zstandard が無ければ gzip）
+"""
+import atexit
+import datetime
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # 任意依存
+    zstandard = None
+
+FSYNC_INTERVAL = float(os.getenv("LOG_FSYNC_INTERVAL", "1.0"))
+MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+COMPRESS = os.getenv("LOG_COMPRESS", "none").lower()
+QUEUE_MAX = 100000
+BATCH_MAX = 1000
+
+_STOP = object()
+
+
+def _compress(path: str, method: str) -> None:
+    """退避済みファイルを圧縮して元ファイルを消す。"""
+    if method == "zstd" and zstandard is not None:
+        dst = path + ".zst"
+        with open(path, "rb") as src, open(dst, "wb") as out:
+            zstandard.ZstdCompressor().copy_stream(src, out)
+    elif method in ("gzip", "zstd"):
+        dst = path + ".gz"
+        with open(path, "rb") as src, gzip.open(dst, "wb") as out:
+            shutil.copyfileobj(src, out)
+    else:
+        return
+    os.remove(path)
+
+
+class LogWriter:
+    """1つのログファイル（パターン）に対するバックグラウンドライター。"""
+
+    def __init__(self, pattern: str, fsync_interval: float = FSYNC_INTERVAL,
+                 max_bytes: int = MAX_BYTES, compress: str = COMPRESS):
+        self.pattern = pattern
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.written = 0
+        self._q: "queue.Queue" = queue.Queue(maxsize=QUEUE_MAX)
+        self._f = None
+        self._path: Optional[str] = None
+        self._last_sync = time.monotonic()
+        self._dirty = False
+        self._rotate_retry_at = 0.0
+        self._thread = threading.Thread(target=self._loop, name="log-writer", daemon=True)
+        self._thread.start()
+
+    # -- 呼び出し側 ----------------------------------------------------------
+    def write(self, record: dict) -> None:
+        """JSON 1行として追記する（シリアライズも書き込みスレッドで行う）。"""
+        self._put(record)
+
+    def write_text(self, text: str) -> None:
+        """文字列をそのまま追記する。"""
+        self._put(text)
+
+    def _put(self, item: Union[dict, str]) -> None:
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:  # 書き込みが追いつかないときだけ待つ
+            self._q.put(item)
+
+    def close(self) -> None:
+        """キューに残った分を書き切って閉じる。"""
+        if self._thread.is_alive():
+            self._q.put(_STOP)
+            self._thread.join()
+
+    # -- 書き込みスレッド --------------------------------------------------------
+    def _current_path(self) -> str:
+        return self.pattern.format(date=datetime.date.today().isoformat())
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                first = self._q.get(timeout=self.fsync_interval or None)
+            except queue.Empty:
+                self._sync(force=True)
+                continue
+            batch: List[Union[dict, str]] = [first]
+            while len(batch) < BATCH_MAX:
+                try:
+                    batch.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            items = [item for item in batch if item is not _STOP]
+            if items:
+                try:
+                    self._write_batch(items)
+                except Exception as e:  # ログの失敗で処理全体を止めない
+                    print(f"[log] write failed ({self.pattern}): {e}")
+            if stop:
+                self._close_file()
+                return
+
+    def _write_batch(self, items: List[Union[dict, str]]) -> None:
+        data = "".join(
+            item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) + "\n"
+            for item in items
+        ).encode("utf-8")
+        path = self._current_path()
+        if path != self._path:
+            old = self._path
+            self._close_file()
+            if old and self.compress != "none" and os.path.exists(old):
+                _compress(old, self.compress)  # 日付が変わった前日分
+            self._open(path)
+        if (self.max_bytes and self._size + len(data) > self.max_bytes and self._size > 0
+                and time.monotonic() >= self._rotate_retry_at):
+            self._rotate()
+        self._f.write(data)
+        self._f.flush()
+        self._size += len(data)
+        self.written += len(items)
+        self._dirty = True
+        self._sync()
+
+    def _open(self, path: str) -> None:
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._f = open(path, "ab")
+        self._path = path
+        self._size = self._f.tell()
+
+    def _rotate(self) -> None:
+        path = self._path
+        self._close_file()
+        root, ext = os.path.splitext(path)
+        n = 1
+        while any(os.path.exists(f"{root}.{n}{ext}{z}") for z in ("", ".gz", ".zst")):
+            n += 1
+        rotated = f"{root}.{n}{ext}"
+        try:
+            os.replace(path, rotated)
+        except OSError as e:  # Windows で他プロセスが開いている場合など（1分後に再試行）
+            print(f"[log] rotate skipped ({path}): {e}")
+            self._rotate_retry_at = time.monotonic() + 60
+        else:
+            if self.compress != "none":
+                _compress(rotated, self.compress)
+        self._open(path)
+
+    def _sync(self, force: bool = False) -> None:
+        if self._f is None or not self._dirty:
+            return
+        now = time.monotonic()
+        if force or now - self._last_sync >= self.fsync_interval:
+            os.fsync(self._f.fileno())
+            self._last_sync = now
+            self._dirty = False
+
+    def _close_file(self) -> None:
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+            self._dirty = False
+            self._f = None
+            self._path = None
+
+
+_writers: Dict[str, LogWriter] = {}
+_lock = threading.Lock()
+
+
+def get_writer(pattern: str) -> LogWriter:
+    """パターンごとに1つのライターを共有する（終了時に自動で書き切る）。"""
+    key = os.path.abspath(pattern)
+    with _lock:
+        w = _writers.get(key)
+        if w is None:
+            w = _writers[key] = LogWriter(pattern)
+        return w
+
+
+@atexit.register
+def close_all() -> None:
+    with _lock:
+        writers = list(_writers.values())
+    for w in writers:
+        w.close()
@@ -0,0 +1,195 @@
+"""
+処理時間・トークン数の計測（Prometheus 形式の出力とトレースファイル）。
+
+  with metrics.span("orch_role", role="writer_ai"):   # orch_role_seconds に記録（トレースにも出力）
+      ...
+  metrics.observe("llm_ttft_seconds", 0.42, model="gpt-4o-mini")
+  metrics.inc("llm_cache_hits_total", model="gpt-4o-mini")
+  print(metrics.render())                              # Prometheus のテキスト形式
+
+記録している主な値:
+  llm_request_seconds / llm_stream_seconds / llm_ttft_seconds   LLM 呼び出し（provider, model）
+  llm_queue_wait_seconds                                         レート制限で待った時間
+  llm_prompt_tokens_total / llm_completion_tokens_total / llm_cached_tokens_total
+  llm_cache_hits_total / llm_cache_misses_total / llm_errors_total
+  orch_role_seconds / orch_queue_wait_seconds / orch_pipeline_seconds
+  watch_handler_seconds / watch_file_io_seconds
+
+環境変数:
+  METRICS_PORT   指定すると watch_service がこのポートで GET /metrics を返す
+  METRICS_TRACE  トレース（Chrome Trace Event 形式）の出力先。chrome://tracing や
+                 https://ui.perfetto.dev で開ける
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[Labels, float]] = {}
+_gauges: Dict[str, Dict[Labels, float]] = {}
+_hists: Dict[str, Dict[Labels, list]] = {}   # name -> labels -> [bucket counts..., sum, count]
+_bounds: Dict[str, Tuple[float, ...]] = {}
+_trace = None
+_pid = os.getpid()
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def inc(name: str, value: float = 1.0, **labels) -> None:
+    key = _labels(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    with _lock:
+        _gauges.setdefault(name, {})[_labels(labels)] = value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """ヒストグラムに1件記録する（_seconds はレイテンシ、それ以外はトークン数向けの区切り）。"""
+    key = _labels(labels)
+    with _lock:
+        bounds = _bounds.get(name)
+        if bounds is None:
+            bounds = _bounds[name] = LATENCY_BUCKETS if name.endswith("_seconds") else TOKEN_BUCKETS
+        series = _hists.setdefault(name, {})
+        h = series.get(key)
+        if h is None:
+            h = series[key] = [0] * len(bounds) + [0.0, 0]
+        for i, b in enumerate(bounds):
+            if value <= b:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[None]:
+    """ブロックの所要時間を <name>_seconds に記録し、トレース有効時はイベントも書く。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(f"{name}_seconds", elapsed, **labels)
+        if _trace is not None:
+            trace_event(name, started, elapsed, **labels)
+
+
+def record_usage(provider: str, model: str, usage: Dict[str, int]) -> None:
+    """プロバイダが返したトークン数（res.usage）を集計する。"""
+    for key, metric in (("prompt_tokens", "llm_prompt_tokens_total"),
+                        ("completion_tokens", "llm_completion_tokens_total"),
+                        ("cached_tokens", "llm_cached_tokens_total")):
+        if usage.get(key):
+            inc(metric, usage[key], provider=provider, model=model)
+    if usage.get("completion_tokens"):
+        observe("llm_completion_tokens", usage["completion_tokens"], provider=provider, model=model)
+
+
+# ---------------------------------------------------------------- trace
+
+def enable_trace(path: str) -> None:
+    """Chrome Trace Event（JSON 配列）形式で span を追記する。閉じ括弧が無くてもビューアで開ける。"""
+    global _trace
+    from log_writer import get_writer
+    writer = get_writer(path)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        writer.write_text("[\n")
+    _trace = writer
+
+
+def tracing() -> bool:
+    return _trace is not None
+
+
+def trace_event(name: str, started: float, elapsed: float, **labels) -> None:
+    ev = {"name": name, "ph": "X", "ts": round(started * 1e6), "dur": round(elapsed * 1e6),
+          "pid": _pid, "tid": threading.get_ident(), "args": labels}
+    _trace.write_text(json.dumps(ev, ensure_ascii=False) + ",\n")
+
+
+if os.getenv("METRICS_TRACE"):
+    enable_trace(os.environ["METRICS_TRACE"])
+
+
+# ---------------------------------------------------------------- export
+
+def _fmt_labels(key: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+def render() -> str:
+    """Prometheus のテキスト形式で全系列を返す。"""
+    lines: List[str] = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{_fmt_labels(k)} {v:g}" for k, v in series.items()]
+        for name, series in sorted(_gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines += [f"{name}{_fmt_labels(k)} {v:g}" for k, v in series.items()]
+        for name, series in sorted(_hists.items()):
+            bounds = _bounds[name]
+            lines.append(f"# TYPE {name} histogram")
+            for k, h in series.items():
+                for b, n in zip(bounds, h):
+                    lines.append(f"{name}_bucket{_fmt_labels(k, ('le', f'{b:g}'))} {n}")
+                lines.append(f"{name}_bucket{_fmt_labels(k, ('le', '+Inf'))} {h[-1]}")
+                lines.append(f"{name}_sum{_fmt_labels(k)} {h[-2]:g}")
+                lines.append(f"{name}_count{_fmt_labels(k)} {h[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> List[Tuple[str, Dict[str, str], int, float]]:
+    """ヒストグラムごとの (名前, ラベル, 件数, 合計) 一覧（CLI の表示用）。"""
+    with _lock:
+        return [(name, dict(k), h[-1], h[-2])
+                for name, series in sorted(_hists.items()) for k, h in series.items()]
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _hists.clear()
+
+
+def serve(port: int, host: str = "127.0.0.1"):
+    """GET /metrics を返す HTTP サーバーをバックグラウンドで起動する。"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/api/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # アクセスログは出さない
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
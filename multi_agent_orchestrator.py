@@ -1,64 +1,419 @@
-import os, json, argparse, datetime
-from typing import List, Dict
-from dotenv import load_dotenv
-from openai import OpenAI
+import os, json, argparse, datetime, queue, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+
+import metrics
+from context_budget import ContextBudget
+from conversation_builder import CacheStats, SharedContext, record_usage, role_messages
+from llm_cache import get_cache
+from llm_providers import Completion, LLMRouter, get_router
+from log_writer import get_writer
 
 DEFAULT_MODEL = "gpt-4o-mini"
-CARDS_PATH = os.path.join("ai_roles", "cards", "cards.sample.json")
-LOGS_DIR = "logs"
+# 別の cwd から import されても同じ場所を使うようスクリプト位置基準にする
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CARDS_PATH = os.path.join(BASE_DIR, "ai_roles", "cards", "cards.sample.json")
+LOGS_DIR = os.path.join(BASE_DIR, "logs")
+LOG_PATTERN = os.path.join(LOGS_DIR, "orch_{date}.jsonl")
+DEFAULT_MAX_CONCURRENCY = 4
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+_cards_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, dict]]] = {}
 
 def load_cards(path: str) -> Dict[str, dict]:
+    # ファイルの (mtime, size) が変わったときだけ読み直す（同じ内容なら同じ dict を返す）
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    hit = _cards_cache.get(path)
+    if hit is not None and hit[0] == key:
+        return hit[1]
     # UTF-8 (BOM付き/なし) 両対応
     with open(path, "r", encoding="utf-8-sig") as f:
         arr = json.load(f)
-    return {c["id"]: c for c in arr}
+    cards = {c["id"]: c for c in arr}
+    _cards_cache[path] = (key, cards)
+    return cards
 
-def call_role(client: OpenAI, card: dict, text: str, model: str) -> str:
-    sys = card.get("system_prompt", "")
-    res = client.chat.completions.create(
+def complete_role(router: LLMRouter, card: dict, text: str,
+                  model: Optional[str] = None, shared: Optional[SharedContext] = None) -> Completion:
+    # プロバイダはカードの recommended_api で決まる（model 省略時はプロバイダの既定）
+    # 共有の前置き → 役割の system_prompt → 入力の順（先頭が揃うほどプロンプトキャッシュが効く）
+    return router.complete(
+        role_messages(card.get("system_prompt", ""), text, shared),
+        card=card,
         model=model,
-        messages=[
-            {"role": "system", "content": sys},
-            {"role": "user", "content": text},
-        ],
         temperature=0.4,
     )
-    return res.choices[0].message.content.strip()
-
-def log_jsonl(role: str, prompt: str, output: str):
-    os.makedirs(LOGS_DIR, exist_ok=True)
-    path = os.path.join(LOGS_DIR, f"orch_{datetime.date.today().isoformat()}.jsonl")
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps({
-            "ts": datetime.datetime.now().isoformat(),
-            "role": role,
-            "prompt": prompt,
-            "output": output,
-        }, ensure_ascii=False) + "\n")
-
-def run_pipeline(text: str, roles: List[str]):
-    load_dotenv()
-    client = OpenAI()
-    model = os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
-    cards = load_cards(CARDS_PATH)
-
-    current = text
-    for r in roles:
-        card = cards.get(r)
-        if not card:
-            raise SystemExit(f"role not found: {r}")
-        print(f"\n=== {card.get('title', r)} ({r}) ===")
-        out = call_role(client, card, current, model)
-        print(out)
-        log_jsonl(r, current, out)
-        current = out
-    print("\n=== Final ===\n" + current)
+
+def call_role(router: LLMRouter, card: dict, text: str, model: Optional[str] = None) -> str:
+    return complete_role(router, card, text, model).text.strip()
+
+def log_jsonl(role: str, prompt: str, output: str, **fields):
+    # 書き込みはバックグラウンドのライターに任せる（logs/orch_YYYY-MM-DD.jsonl, サイズ/日付でローテーション）
+    record = {"ts": datetime.datetime.now().isoformat(), "role": role}
+    record.update(fields)
+    record["prompt"] = prompt
+    record["output"] = output
+    get_writer(LOG_PATTERN).write(record)
+
+def log_step(run_id: str, step: "RoleResult") -> None:
+    log_jsonl(step.role, step.prompt, step.output, run_id=run_id, stage=step.stage,
+              reducer=step.reducer, model=step.model, latency=round(step.latency, 3),
+              ttft=None if step.ttft is None else round(step.ttft, 3),
+              tokens=step.usage or None, cached=step.cached)
+
+def parse_stages(spec: str, mode: str = "chain") -> List[List[str]]:
+    """
+    役割指定をステージ列に変換する。
+    "," で区切った順に直列、"|" で束ねた役割は同じ入力で並列実行。
+      "idea_ai,writer_ai|pm_ai,proof_ai" → [[idea_ai], [writer_ai, pm_ai], [proof_ai]]
+    mode="fanout" の場合は全役割を1ステージにまとめる。
+    """
+    stages = []
+    for part in spec.split(","):
+        group = [s.strip() for s in part.split("|") if s.strip()]
+        if group:
+            stages.append(group)
+    if mode == "fanout":
+        return [[r for g in stages for r in g]] if stages else []
+    return stages
+
+def merge_outputs(cards: Dict[str, dict], results: List[Tuple[str, str]]) -> str:
+    # 並列ステージの出力を役割ごとの見出し付きで連結
+    blocks = []
+    for r, out in results:
+        blocks.append(f"### {cards[r].get('title', r)} ({r})\n{out}")
+    return "\n\n".join(blocks)
+
+def stream_role(router: LLMRouter, card: dict, text: str,
+                model: Optional[str] = None, shared: Optional[SharedContext] = None,
+                usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+    # call_role のストリーミング版（トークン差分を順に返す）
+    yield from router.stream(
+        role_messages(card.get("system_prompt", ""), text, shared),
+        card=card,
+        model=model,
+        temperature=0.4,
+        usage=usage,
+    )
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+@dataclass
+class RoleResult:
+    role: str
+    title: str
+    prompt: str
+    output: str
+    stage: int
+    reducer: bool = False
+    model: str = ""
+    latency: float = 0.0  # 秒（応答開始から完了まで）
+    ttft: Optional[float] = None  # 秒（最初のトークンまで, ストリーミング時のみ）
+    usage: Dict[str, int] = field(default_factory=dict)  # プロバイダが返したトークン数
+    cached: bool = False
+
+@dataclass
+class PipelineResult:
+    input: str
+    final: str
+    steps: List[RoleResult] = field(default_factory=list)
+    run_id: str = ""
+
+@dataclass
+class StreamEvent:
+    """
+    OrchestratorEngine.stream() が返すイベント。
+      start: 役割の応答開始 / delta: 出力の差分 / end: 役割完了（step に結果）/ final: 最終結果
+    last は最終結果をそのまま作る役割（最終ステージの単独役割または reducer）の出力であることを示す。
+    """
+    kind: str
+    role: str = ""
+    title: str = ""
+    text: str = ""
+    step: Optional[RoleResult] = None
+    last: bool = False
+
+class OrchestratorEngine:
+    """
+    パイプラインを同一プロセスで繰り返し実行するためのエンジン。
+    LLM ルーター（プロバイダごとのクライアント）と役割カードは一度だけ用意し、run() 間で使い回す。
+    model は OpenAI 向けカードに使うモデル（他プロバイダは各既定モデル）。
+    """
+
+    def __init__(self, router: Optional[LLMRouter] = None, model: Optional[str] = None,
+                 cards_path: str = CARDS_PATH,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, log: bool = True,
+                 budget: Optional[ContextBudget] = None):
+        self.router = router or get_router()
+        self.model = model or os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+        # 前段の出力を次段へ渡すときのトークン予算（ORCH_STAGE_BUDGET, カードの max_input_tokens）
+        self.budget = budget or ContextBudget(model=self.model)
+        self.cards_path = cards_path
+        self.cards = load_cards(cards_path)
+        self.max_concurrency = max_concurrency
+        self.log = log
+        # 全役割の先頭に置く共有文脈（ORCH_SHARED_CONTEXT=bulletin-board.md,docs/project.md など）
+        self.shared = SharedContext.from_env("ORCH_SHARED_CONTEXT")
+        self.cache_stats = CacheStats()  # プロンプトキャッシュの命中（usage の cached_tokens）
+
+    def model_for(self, card: dict) -> Optional[str]:
+        return self.model if self.router.provider_for(card) == "openai" else None
+
+    def reload_cards(self) -> None:
+        # カードファイルが更新されていれば読み直す（変わっていなければ stat 1回だけ）
+        self.cards = load_cards(self.cards_path)
+
+    def stages_for(self, roles: List[str], mode: str = "chain",
+                   reducer: Optional[str] = None) -> List[List[str]]:
+        self.reload_cards()
+        stages = parse_stages(",".join(roles), mode)
+        # API を叩く前に役割の存在を確認しておく
+        for r in [r for g in stages for r in g] + ([reducer] if reducer else []):
+            if r not in self.cards:
+                raise ValueError(f"role not found: {r}")
+        return stages
+
+    def _role_events(self, role: str, prompt: str, stage: int, tokens: bool,
+                     reducer: bool = False, last: bool = False) -> Iterator[StreamEvent]:
+        card = self.cards[role]
+        title = card.get("title", role)
+        yield StreamEvent("start", role, title, last=last)
+        model = self.model_for(card)
+        started = time.perf_counter()
+        ttft = None
+        usage: Dict[str, int] = {}
+        if tokens:
+            parts = []
+            for delta in stream_role(self.router, card, prompt, model, self.shared, usage):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                parts.append(delta)
+                yield StreamEvent("delta", role, title, delta, last=last)
+            out = "".join(parts).strip()
+            res = None
+        else:
+            res = complete_role(self.router, card, prompt, model, self.shared)
+            out = res.text.strip()
+            yield StreamEvent("delta", role, title, out, last=last)
+        step = RoleResult(role, title, prompt, out, stage, reducer=reducer,
+                          latency=time.perf_counter() - started, ttft=ttft)
+        metrics.observe("orch_role_seconds", step.latency, role=role)
+        if metrics.tracing():
+            metrics.trace_event("orch_role", started, step.latency, role=role, stage=stage)
+        if res is not None:
+            step.model, step.usage, step.cached = res.model, dict(res.usage), res.cached
+        else:
+            step.model, step.usage = self.router.resolve(card=card, model=model)[1], usage
+        record_usage(step.usage, self.cache_stats)
+        yield StreamEvent("end", role, title, out, step=step, last=last)
+
+    def _stage_events(self, stage: List[str], prompt: str, index: int, tokens: bool,
+                      last: bool) -> Iterator[StreamEvent]:
+        if len(stage) == 1:
+            yield from self._role_events(stage[0], prompt, index, tokens, last=last)
+            return
+        # 並列ステージ: 各役割のイベントをワーカースレッドからキュー経由で到着順に流す
+        q: "queue.Queue" = queue.Queue()
+        done = object()
+
+        def work(role: str, submitted: float) -> None:
+            # ワーカー待ち（max_concurrency を超えた分）の時間
+            metrics.observe("orch_queue_wait_seconds", time.perf_counter() - submitted)
+            try:
+                for ev in self._role_events(role, prompt, index, tokens):
+                    q.put(ev)
+            except BaseException as e:
+                q.put(e)
+            finally:
+                q.put(done)
+
+        workers = max(1, min(self.max_concurrency, len(stage)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="orch") as ex:
+            for r in stage:
+                ex.submit(work, r, time.perf_counter())
+            remaining = len(stage)
+            while remaining:
+                item = q.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+
+    def stream(self, text: str, roles: List[str], mode: str = "chain",
+               reducer: Optional[str] = None, tokens: bool = True,
+               run_id: Optional[str] = None) -> Iterator[StreamEvent]:
+        """
+        パイプラインを実行しながらイベントを順次返す。
+        tokens=False の場合は各役割の出力を一括取得し、delta は1回だけ流れる。
+        run_id はログで1回の実行をまとめるための id（省略時は自動採番）。
+        """
+        run_id = run_id or new_run_id()
+        stages = self.stages_for(roles, mode, reducer)
+        started = time.perf_counter()
+        current = text
+        for i, stage in enumerate(stages):
+            is_last = i == len(stages) - 1
+            if i:
+                current = self.fit_input(text, current, stage)
+            outs: Dict[str, str] = {}
+            for ev in self._stage_events(stage, current, i, tokens,
+                                         last=is_last and len(stage) == 1):
+                if ev.kind == "end":
+                    outs[ev.role] = ev.step.output
+                    if self.log:
+                        log_step(run_id, ev.step)
+                yield ev
+            if len(stage) == 1:
+                current = outs[stage[0]]
+                continue
+            merged = merge_outputs(self.cards, [(r, outs[r]) for r in stage])
+            if reducer:
+                merged = self.fit_input(text, merged, [reducer])
+                for ev in self._role_events(reducer, merged, i, tokens, reducer=True,
+                                            last=is_last):
+                    if ev.kind == "end":
+                        merged = ev.step.output
+                        if self.log:
+                            log_step(run_id, ev.step)
+                    yield ev
+            current = merged
+        metrics.observe("orch_pipeline_seconds", time.perf_counter() - started)
+        yield StreamEvent("final", text=current)
+
+    def fit_input(self, request: str, previous: str, roles: List[str]) -> str:
+        """次段に渡す入力を予算内に縮める（予算内ならそのまま）。"""
+        limit = self.budget.limit_for([self.cards[r] for r in roles])
+        fitted = self.budget.fit(request, previous, limit)
+        if fitted is not previous:
+            metrics.inc("orch_context_trimmed_total", role=roles[0])
+        return fitted
+
+    def run(self, text: str, roles: List[str], mode: str = "chain",
+            reducer: Optional[str] = None,
+            on_step: Optional[Callable[[RoleResult], None]] = None) -> PipelineResult:
+        result = PipelineResult(input=text, final=text, run_id=new_run_id())
+        for ev in self.stream(text, roles, mode, reducer, tokens=False, run_id=result.run_id):
+            if ev.kind == "end":
+                result.steps.append(ev.step)
+                if on_step:
+                    on_step(ev.step)
+            elif ev.kind == "final":
+                result.final = ev.text
+        return result
+
+def print_step(step: RoleResult) -> None:
+    tag = " [reduce]" if step.reducer else ""
+    print(f"\n=== {step.title} ({step.role}){tag} ===")
+    print(step.output)
+
+def print_stream(events: Iterator[StreamEvent]) -> PipelineResult:
+    """
+    stream() のイベントを逐次表示する。
+    並列ステージでは1役割ずつ逐次表示し、他の役割の差分は表示中の役割が終わるまで溜めておく。
+    """
+    result = PipelineResult(input="", final="")
+    live: Optional[str] = None
+    pending: Dict[str, List[str]] = {}  # role -> 未表示の差分
+    titles: Dict[str, str] = {}
+    finished: List[str] = []
+
+    def show(role: str) -> None:
+        print(f"\n=== {titles[role]} ({role}) ===", flush=True)
+        print("".join(pending.pop(role, [])), end="", flush=True)
+
+    for ev in events:
+        if ev.kind == "start":
+            titles[ev.role] = ev.title
+            pending.setdefault(ev.role, [])
+            if live is None:
+                live = ev.role
+                show(live)
+        elif ev.kind == "delta":
+            if ev.role == live:
+                print(ev.text, end="", flush=True)
+            else:
+                pending.setdefault(ev.role, []).append(ev.text)
+        elif ev.kind == "end":
+            result.steps.append(ev.step)
+            if ev.role != live:
+                finished.append(ev.role)
+                continue
+            print(flush=True)
+            live = None
+            for role in finished:
+                show(role)
+                print(flush=True)
+            finished.clear()
+            if pending:
+                live = next(iter(pending))
+                show(live)
+        elif ev.kind == "final":
+            result.final = ev.text
+    return result
+
+def run_pipeline(text: str, roles: List[str], mode: str = "chain",
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 reducer: Optional[str] = None, stream: bool = False,
+                 budget: Optional[int] = None) -> PipelineResult:
+    engine = OrchestratorEngine(max_concurrency=max_concurrency,
+                                budget=ContextBudget(budget) if budget is not None else None)
+    try:
+        if stream:
+            run_id = new_run_id()
+            result = print_stream(engine.stream(text, roles, mode=mode, reducer=reducer,
+                                                run_id=run_id))
+            result.input, result.run_id = text, run_id
+        else:
+            result = engine.run(text, roles, mode=mode, reducer=reducer, on_step=print_step)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    stats = get_cache().stats()
+    trimmed = f"  [budget] trimmed={engine.budget.trimmed}" if engine.budget.trimmed else ""
+    prompt_cache = f"  [prompt-cache] {engine.cache_stats}" if engine.cache_stats.requests else ""
+    print(f"\n[cache] hits={stats['hits']} misses={stats['misses']}  [run] {result.run_id}{trimmed}{prompt_cache}")
+    print("\n=== Final ===\n" + result.final)
+    return result
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
     ap.add_argument("-i", "--input", required=True, help="input text")
     ap.add_argument("-r", "--roles", default="idea_ai,writer_ai,proof_ai",
-                    help="comma-separated role ids")
+                    help="comma-separated role ids ('|' で束ねた役割は並列実行)")
+    ap.add_argument("-m", "--mode", choices=["chain", "fanout"], default="chain",
+                    help="chain: 順に受け渡し / fanout: 全役割を同じ入力で並列実行")
+    ap.add_argument("--max-concurrency", type=int,
+                    default=_env_int("ORCH_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY),
+                    help="並列ステージで同時に投げるリクエスト数の上限")
+    ap.add_argument("--reducer", default=None,
+                    help="並列ステージの出力をまとめる役割 id（省略時は見出し付きで連結）")
+    ap.add_argument("--budget", type=int, default=None,
+                    help="次段に渡す入力の上限トークン数（既定 ORCH_STAGE_BUDGET または 6000, 0 で無効）")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="応答キャッシュを参照せずに取り直す（結果は上書き保存）")
+    ap.add_argument("-s", "--stream", action="store_true",
+                    help="各役割の出力をトークン単位で逐次表示する")
+    ap.add_argument("--metrics", action="store_true",
+                    help="終了時に計測値（役割・LLM 呼び出しの時間とトークン数）を Prometheus 形式で表示")
+    ap.add_argument("--trace", default=os.getenv("METRICS_TRACE"),
+                    help="トレースファイル（chrome://tracing / Perfetto で開ける JSON）の出力先")
     args = ap.parse_args()
+    if args.trace and not metrics.tracing():
+        metrics.enable_trace(args.trace)
+    if args.no_cache:
+        get_cache().bypass = True
     roles = [s.strip() for s in args.roles.split(",") if s.strip()]
-    run_pipeline(args.input, roles)
\ No newline at end of file
+    run_pipeline(args.input, roles, mode=args.mode,
+                 max_concurrency=args.max_concurrency, reducer=args.reducer,
+                 stream=args.stream, budget=args.budget)
+    if args.metrics:
+        print("\n=== Metrics ===\n" + metrics.render(), end="")
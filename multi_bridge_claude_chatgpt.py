@@ -1,37 +1,43 @@
 import os
-import time
 from datetime import datetime
-from openai import OpenAI
 from dotenv import load_dotenv
+import relay_queue
+from llm_providers import get_router
+from log_writer import get_writer
+from tail_reader import TailReader
 
 # 環境変数からOpenAIキーを取得
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+router = get_router()  # プロバイダ共通ルーター（クライアント共有・リトライ・レート制限）
 
 # ファイルパス定義
-CLAUDE_OUTPUT = "claude_output.txt"
-CLAUDE_INPUT = "claude_input.txt"
-LOG_FILE = "response_log.txt"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLAUDE_OUTPUT = os.path.join(BASE_DIR, "claude_output.txt")
+CLAUDE_INPUT = os.path.join(BASE_DIR, "claude_input.txt")
+LOG_FILE = os.path.join(BASE_DIR, "response_log.txt")
 
-# Claudeの出力を読む
+_output_reader = TailReader(CLAUDE_OUTPUT)
+
+# Claudeの出力を読む（変化が無ければファイルを開かず、追記なら追記分だけ読む）
 def read_claude_output():
-    try:
-        with open(CLAUDE_OUTPUT, "r", encoding="utf-8") as f:
-            return f.read()
-    except:
-        return ""
+    return _output_reader.read()
 
 # ChatGPTに送る
-def ask_chatgpt(prompt):
+def ask_chatgpt(prompt, on_token=None):
+    # on_token を渡すとストリーミングで受信し、差分ごとに呼び出す
+    model = "gpt-4"
+    messages = [
+        {"role": "system", "content": "あなたはClaudeの出力を受け取り、次にClaudeに送るべき応答案を考えるアシスタントです。"},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        chat = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "あなたはClaudeの出力を受け取り、次にClaudeに送るべき応答案を考えるアシスタントです。"},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return chat.choices[0].message.content
+        if on_token is None:
+            return router.complete(messages, model=model).text
+        parts = []
+        for delta in router.stream(messages, model=model):
+            parts.append(delta)
+            on_token(delta)
+        return "".join(parts)
     except Exception as e:
         return f"[エラー] {e}"
 
@@ -42,30 +48,51 @@ def write_to_claude_input(text):
 
 # 応答ログに保存
 def save_log(prompt, reply):
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"\n==== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ====\n")
-        f.write("[Claudeの出力]\n" + prompt + "\n")
-        f.write("[ChatGPTの返答 → Claudeへ]\n" + reply + "\n")
+    # 書き込みはバックグラウンドのライターに任せる（1件分をまとめて1回で追記）
+    get_writer(LOG_FILE).write_text(
+        f"\n==== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ====\n"
+        + "[Claudeの出力]\n" + prompt + "\n"
+        + "[ChatGPTの返答 → Claudeへ]\n" + reply + "\n"
+    )
+
+_last_output = read_claude_output()
+
+# claude_output.txt の変更ごとに watch_service から呼ばれる。
+# 内容をキューに積むだけで戻り、ChatGPT への問い合わせはワーカーが relay_reply で行う
+# （問い合わせ中に来た出力も取りこぼさず、1件ずつ順に送る）
+def relay_claude_output(path=None):
+    global _last_output
+    current_output = read_claude_output()
+    if not current_output or current_output == _last_output:
+        return
+    _last_output = current_output
+    relay_queue.get_queue().enqueue("relay", current_output,
+                                    relay_queue.file_key(CLAUDE_OUTPUT, current_output))
+
+def relay_reply(current_output):
+    print("🆕 Claudeの出力を検知 → ChatGPTへ転送中...\n")
+    print("✅ ChatGPTの返答（Claudeへ送信）：\n")
+    shown = []
+
+    def show(token):
+        shown.append(token)
+        print(token, end="", flush=True)
+
+    reply = ask_chatgpt(current_output, on_token=show)
+    if reply != "".join(shown):  # エラー時はメッセージを表示
+        print(reply, end="")
+    print()
+
+    write_to_claude_input(reply)
+    save_log(current_output, reply)
+
+    print("\n📤 Claude_input.txt に送信完了。ログ保存済み。\n")
 
-# メインループ
+# メイン処理（監視は watch_service に一本化）
 def main():
     print("🔁 Claude ⇄ ChatGPT 多段中継ブリッジ 起動中...（Ctrl+Cで停止）\n")
-    last_output = read_claude_output()
-
-    while True:
-        time.sleep(3)
-        current_output = read_claude_output()
-        if current_output and current_output != last_output:
-            print("🆕 Claudeの出力を検知 → ChatGPTへ転送中...\n")
-            reply = ask_chatgpt(current_output)
-            print("✅ ChatGPTの返答（Claudeへ送信）：\n")
-            print(reply)
-
-            write_to_claude_input(reply)
-            save_log(current_output, reply)
-
-            print("\n📤 Claude_input.txt に送信完了。ログ保存済み。\n")
-            last_output = current_output
+    import watch_service
+    watch_service.main(["--only", "relay"])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,392 @@
+"""
+logs/orch_*.jsonl の索引・集計・全文検索。
+
+ログを1行ずつストリームで読み（orjson があれば使う）、SQLite の索引
+（役割・日付・run_id・プロンプトのハッシュ）と FTS5 の全文索引を作る。
+索引はファイルごとに読んだ位置を覚えていて、2回目以降は追記分だけを取り込む。
+ローテーション済みの orch_….N.jsonl や .gz / .zst も読む。
+
+  python orch_logs.py index                              索引を更新
+  python orch_logs.py stats [--role writer_ai] [--since 2025-08-01] [--until ...]
+                                                         役割ごとの件数・レイテンシ/出力長のパーセンタイル
+  python orch_logs.py search "キーワード" [--limit 20]    プロンプト/出力の全文検索
+  python orch_logs.py run <run_id>                       1回の実行の各ステップ
+
+環境変数:
+  ORCH_LOG_INDEX  索引の保存先（既定: .cache/orch_logs.sqlite3）
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+
+    def _loads(line: bytes):
+        return orjson.loads(line)
+except ImportError:  # 任意依存
+    def _loads(line: bytes):
+        return json.loads(line)
+
+try:
+    import zstandard
+except ImportError:  # 任意依存
+    zstandard = None
+
+BASE_DIR = Path(__file__).resolve().parent
+LOGS_DIR = BASE_DIR / "logs"
+DEFAULT_INDEX = Path(os.getenv("ORCH_LOG_INDEX", BASE_DIR / ".cache" / "orch_logs.sqlite3"))
+PERCENTILES = (50, 90, 99)
+BATCH = 1000
+
+_DATE_RE = re.compile(r"orch_(\d{4}-\d{2}-\d{2})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    ino INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    offset INTEGER
+);
+CREATE TABLE IF NOT EXISTS steps (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    ts TEXT,
+    date TEXT,
+    role TEXT,
+    run_id TEXT,
+    stage INTEGER,
+    model TEXT,
+    latency REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    prompt_len INTEGER,
+    output_len INTEGER,
+    prompt_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_role_latency ON steps(role, latency);
+CREATE INDEX IF NOT EXISTS steps_role_output ON steps(role, output_len);
+CREATE INDEX IF NOT EXISTS steps_date ON steps(date);
+CREATE INDEX IF NOT EXISTS steps_run ON steps(run_id);
+CREATE INDEX IF NOT EXISTS steps_prompt_hash ON steps(prompt_hash);
+CREATE INDEX IF NOT EXISTS steps_file ON steps(file);
+"""
+
+
+def log_files(logs_dir: Path = LOGS_DIR) -> List[Path]:
+    pats = ("orch_*.jsonl", "orch_*.jsonl.gz", "orch_*.jsonl.zst")
+    return sorted({Path(p) for pat in pats for p in glob.glob(str(logs_dir / pat))})
+
+
+def _open(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"zstandard が必要です: {path.name}")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")))
+    return open(path, "rb")
+
+
+def iter_records(path: Path, offset: int = 0) -> Iterator[Tuple[int, dict]]:
+    """(次の行の開始位置, レコード) を返す。書きかけの最終行（改行なし）は読まない。"""
+    with _open(path) as f:
+        if offset:
+            f.seek(offset)
+        pos = offset
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            pos += len(line)
+            if not line.strip():
+                continue
+            try:
+                yield pos, _loads(line)
+            except ValueError:
+                continue  # 壊れた行は飛ばす
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class LogIndex:
+    """orch ログの索引（SQLite + FTS5）。"""
+
+    def __init__(self, path: Path = DEFAULT_INDEX, logs_dir: Path = LOGS_DIR):
+        self.path = Path(path)
+        self.logs_dir = Path(logs_dir)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.fts = False
+        # 日本語は空白で区切られないので部分一致できる trigram を優先（SQLite 3.34+）
+        for tokenize in ("trigram", "unicode61"):
+            try:
+                self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS steps_fts"
+                                f" USING fts5(prompt, output, tokenize='{tokenize}')")
+                self.fts = True
+                break
+            except sqlite3.OperationalError:
+                continue  # どちらも無ければファイルを順に走査して検索
+
+    def close(self) -> None:
+        self.db.close()
+
+    # -- 索引の更新 ----------------------------------------------------------
+    def update(self) -> int:
+        """新しいファイル・追記分を取り込み、消えたファイルの行を削除する。追加件数を返す。"""
+        files = log_files(self.logs_dir)
+        known = {row[0]: row[1:] for row in self.db.execute(
+            "SELECT path, ino, size, mtime_ns, offset FROM files")}
+        added = 0
+        for p in files:
+            added += self._update_file(p, known.pop(str(p), None))
+        for gone in known:
+            self._drop_file(gone)
+        self.db.commit()
+        return added
+
+    def _drop_file(self, path: str) -> None:
+        if self.fts:
+            self.db.execute(
+                "DELETE FROM steps_fts WHERE rowid IN (SELECT id FROM steps WHERE file = ?)", (path,))
+        self.db.execute("DELETE FROM steps WHERE file = ?", (path,))
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _update_file(self, p: Path, known: Optional[tuple]) -> int:
+        st = p.stat()
+        offset = 0
+        if known is not None:
+            ino, size, mtime_ns, known_offset = known
+            if (ino, size, mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+                return 0
+            # 追記だけなら続きから読む（圧縮ファイル・置き換え・切り詰めは読み直し）
+            if p.suffix == ".jsonl" and ino == st.st_ino and st.st_size >= size:
+                offset = known_offset
+            else:
+                self._drop_file(str(p))
+        m = _DATE_RE.search(p.name)
+        file_date = m.group(1) if m else None
+        rows, texts, added = [], [], 0
+        for pos, rec in iter_records(p, offset):
+            offset = pos
+            prompt = rec.get("prompt") or ""
+            output = rec.get("output") or ""
+            tokens = rec.get("tokens") or {}
+            ts = rec.get("ts")
+            rows.append((str(p), ts, (ts or "")[:10] or file_date, rec.get("role"),
+                         rec.get("run_id"), rec.get("stage"), rec.get("model"),
+                         rec.get("latency"), tokens.get("prompt_tokens"),
+                         tokens.get("completion_tokens"), len(prompt), len(output),
+                         prompt_hash(prompt)))
+            texts.append((prompt, output))
+            if len(rows) >= BATCH:
+                added += self._insert(rows, texts)
+                rows, texts = [], []
+        added += self._insert(rows, texts)
+        if p.suffix != ".jsonl":
+            offset = st.st_size
+        self.db.execute(
+            "INSERT OR REPLACE INTO files(path, ino, size, mtime_ns, offset) VALUES (?, ?, ?, ?, ?)",
+            (str(p), st.st_ino, st.st_size, st.st_mtime_ns, offset))
+        return added
+
+    def _insert(self, rows: List[tuple], texts: List[Tuple[str, str]]) -> int:
+        for row, (prompt, output) in zip(rows, texts):
+            cur = self.db.execute(
+                "INSERT INTO steps(file, ts, date, role, run_id, stage, model, latency,"
+                " prompt_tokens, completion_tokens, prompt_len, output_len, prompt_hash)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            if self.fts:
+                self.db.execute("INSERT INTO steps_fts(rowid, prompt, output) VALUES (?, ?, ?)",
+                                (cur.lastrowid, prompt, output))
+        return len(rows)
+
+    # -- 集計 ----------------------------------------------------------------
+    @staticmethod
+    def _where(role: Optional[str], since: Optional[str], until: Optional[str],
+               column: str) -> Tuple[str, list]:
+        cond, args = [f"{column} IS NOT NULL"], []
+        if role:
+            cond.append("role = ?")
+            args.append(role)
+        if since:
+            cond.append("date >= ?")
+            args.append(since)
+        if until:
+            cond.append("date <= ?")
+            args.append(until)
+        return " AND ".join(cond), args
+
+    def percentiles(self, column: str, role: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    pcts=PERCENTILES) -> Dict[str, Optional[float]]:
+        """索引順に OFFSET で取り出すので全件をメモリに載せない。"""
+        where, args = self._where(role, since, until, column)
+        n, avg, mx = self.db.execute(
+            f"SELECT COUNT(*), AVG({column}), MAX({column}) FROM steps WHERE {where}", args).fetchone()
+        out: Dict[str, Optional[float]] = {"n": n, "avg": avg, "max": mx}
+        for q in pcts:
+            if not n:
+                out[f"p{q}"] = None
+                continue
+            k = min(n - 1, max(0, int(round(q / 100 * n + 0.5)) - 1))  # nearest-rank
+            out[f"p{q}"] = self.db.execute(
+                f"SELECT {column} FROM steps WHERE {where} ORDER BY {column} LIMIT 1 OFFSET ?",
+                args + [k]).fetchone()[0]
+        return out
+
+    def roles(self, since: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+        where, args = self._where(None, since, until, "role")
+        return [r[0] for r in self.db.execute(
+            f"SELECT DISTINCT role FROM steps WHERE {where} ORDER BY role", args)]
+
+    def role_stats(self, role: Optional[str] = None, since: Optional[str] = None,
+                   until: Optional[str] = None) -> List[dict]:
+        roles = [role] if role else self.roles(since, until)
+        return [{
+            "role": r,
+            "latency": self.percentiles("latency", r, since, until),
+            "output_len": self.percentiles("output_len", r, since, until),
+            "completion_tokens": self.percentiles("completion_tokens", r, since, until),
+        } for r in roles]
+
+    # -- 検索 ----------------------------------------------------------------
+    def search(self, query: str, limit: int = 20, role: Optional[str] = None) -> List[dict]:
+        if not self.fts:
+            return self._scan_search(query, limit, role)
+        terms = query.split()
+        if all(len(t) >= 3 for t in terms):
+            sql = ("SELECT s.ts, s.role, s.run_id, snippet(steps_fts, -1, '[', ']', '…', 16)"
+                   " FROM steps_fts JOIN steps s ON s.id = steps_fts.rowid"
+                   " WHERE steps_fts MATCH ?")
+            args: list = [_fts_query(query)]
+        else:
+            # trigram は2文字以下の語を MATCH できないので LIKE（FTS 表を走査）で探す
+            sql = ("SELECT s.ts, s.role, s.run_id, steps_fts.prompt || '\n' || steps_fts.output"
+                   " FROM steps_fts JOIN steps s ON s.id = steps_fts.rowid WHERE 1")
+            args = []
+            for t in terms:
+                sql += " AND (steps_fts.prompt LIKE ? OR steps_fts.output LIKE ?)"
+                args += [f"%{t}%", f"%{t}%"]
+        if role:
+            sql += " AND s.role = ?"
+            args.append(role)
+        sql += " ORDER BY rank LIMIT ?" if "MATCH" in sql else " ORDER BY s.id DESC LIMIT ?"
+        args.append(limit)
+        hits = []
+        for ts, r, run, text in self.db.execute(sql, args):
+            if "MATCH" not in sql:
+                text = _snippet(text, terms[0])
+            hits.append({"ts": ts, "role": r, "run_id": run, "snippet": text})
+        return hits
+
+    def _scan_search(self, query: str, limit: int, role: Optional[str]) -> List[dict]:
+        hits = []
+        for p in log_files(self.logs_dir):
+            for _, rec in iter_records(p):
+                if role and rec.get("role") != role:
+                    continue
+                text = (rec.get("prompt") or "") + "\n" + (rec.get("output") or "")
+                if query in text:
+                    hits.append({"ts": rec.get("ts"), "role": rec.get("role"),
+                                 "run_id": rec.get("run_id"), "snippet": _snippet(text, query)})
+                    if len(hits) >= limit:
+                        return hits
+        return hits
+
+    def run_steps(self, run_id: str) -> List[dict]:
+        cols = "ts, role, stage, model, latency, prompt_tokens, completion_tokens, output_len"
+        rows = self.db.execute(
+            f"SELECT {cols} FROM steps WHERE run_id = ? ORDER BY id", (run_id,)).fetchall()
+        return [dict(zip([c.strip() for c in cols.split(",")], r)) for r in rows]
+
+
+def _fts_query(query: str) -> str:
+    # 記号で FTS5 の構文エラーにならないよう語ごとに引用する
+    terms = [t.replace('"', '""') for t in query.split() if t]
+    return " ".join(f'"{t}"' for t in terms) or '""'
+
+
+def _snippet(text: str, term: str, width: int = 40) -> str:
+    i = text.find(term)
+    if i < 0:
+        return text[:width * 2]
+    return text[max(0, i - width):i].replace("\n", " ") + f"[{term}]" + \
+        text[i + len(term):i + len(term) + width].replace("\n", " ")
+
+
+def _fmt(v) -> str:
+    if v is None:
+        return "-"
+    return f"{v:.2f}" if isinstance(v, float) else str(v)
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="logs/orch_*.jsonl の索引・集計・検索")
+    ap.add_argument("--index", default=str(DEFAULT_INDEX), help="索引ファイル")
+    ap.add_argument("--logs", default=str(LOGS_DIR), help="ログのフォルダ")
+    ap.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("index", help="索引を更新")
+    st = sub.add_parser("stats", help="役割ごとのレイテンシ/出力長のパーセンタイル")
+    st.add_argument("--role")
+    st.add_argument("--since", help="YYYY-MM-DD")
+    st.add_argument("--until", help="YYYY-MM-DD")
+    se = sub.add_parser("search", help="プロンプト/出力の全文検索")
+    se.add_argument("query")
+    se.add_argument("--role")
+    se.add_argument("--limit", type=int, default=20)
+    ru = sub.add_parser("run", help="1回の実行の各ステップ")
+    ru.add_argument("run_id")
+    args = ap.parse_args(argv)
+
+    idx = LogIndex(Path(args.index), Path(args.logs))
+    try:
+        added = idx.update()
+        if args.cmd == "index":
+            result = {"added": added}
+        elif args.cmd == "stats":
+            result = idx.role_stats(args.role, args.since, args.until)
+        elif args.cmd == "search":
+            result = idx.search(args.query, args.limit, args.role)
+        else:
+            result = idx.run_steps(args.run_id)
+    finally:
+        idx.close()
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif args.cmd == "index":
+        print(f"indexed {added} new steps")
+    elif args.cmd == "stats":
+        print(f"{'role':<16}{'n':>6}  {'lat p50':>8}{'p90':>8}{'p99':>8}  "
+              f"{'len p50':>8}{'p90':>8}{'p99':>8}{'max':>8}")
+        for s in result:
+            lat, ln = s["latency"], s["output_len"]
+            print(f"{s['role']:<16}{ln['n']:>6}  {_fmt(lat['p50']):>8}{_fmt(lat['p90']):>8}"
+                  f"{_fmt(lat['p99']):>8}  {_fmt(ln['p50']):>8}{_fmt(ln['p90']):>8}"
+                  f"{_fmt(ln['p99']):>8}{_fmt(ln['max']):>8}")
+    elif args.cmd == "search":
+        for h in result:
+            print(f"{h['ts']}  {h['role']}  {h['run_id'] or '-'}\n  {h['snippet']}")
+    else:
+        for s in result:
+            print(f"{s['ts']}  stage={s['stage']}  {s['role']:<14} {s['model'] or '-':<16}"
+                  f" {_fmt(s['latency'])}s  out={s['output_len']}"
+                  f"  tokens={_fmt(s['prompt_tokens'])}/{_fmt(s['completion_tokens'])}")
+
+
+if __name__ == "__main__":
+    main()
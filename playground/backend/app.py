@@ -3,7 +3,7 @@
 Responsibilities ONLY:
   * load .env from common locations (non-destructive)
   * create FastAPI app with CORS
-  * include modular routers (conversation / admin / agents)
+  * include modular routers (conversation / admin / agents / feed stream / metrics)
   * mount frontend static assets
 All orchestration/state logic is in separate modules.
 """
@@ -16,6 +16,7 @@ from fastapi.staticfiles import StaticFiles
 # internal side-effect imports early so Ruff sees them as module-level
 from . import core  # noqa: F401
 from .routers import conversation, admin, agents
+from . import feed_stream, metrics
 
 
 def _load_dotenv_multi() -> None:
@@ -45,6 +46,8 @@ app.add_middleware(
 app.include_router(conversation.router)
 app.include_router(admin.router)
 app.include_router(agents.router)
+app.include_router(feed_stream.router)
+app.include_router(metrics.router)
 
 
 @app.get("/api/healthz")
@@ -0,0 +1,252 @@
+"""Indexed, bounded store for conversation events and runtime custom roles.
+
+Events are kept per conversation in id order, so ``since(<id>, conv_id)`` is a
+bisect plus a slice (O(log n + k)) instead of a scan over one global list, and
+the all-conversation feed is a k-way merge over conversations that actually
+have newer events.  Each event is a ``__slots__`` object rather than a dict.
+
+Retention (env, all optional):
+  EVENT_MAX_CONVERSATIONS  keep at most N conversations, least recently active evicted (default 500)
+  EVENT_MAX_PER_CONV       keep the newest N events of each conversation (default 2000)
+  EVENT_IDLE_TTL           drop conversations idle for more than N seconds (default 0 = never)
+  PLAYGROUND_DB            SQLite file; when set, events and custom roles survive a restart
+                           (rows trimmed or evicted from memory are deleted from it as well)
+
+Producers call ``store.append(...)``; listeners registered with ``on_append``
+(e.g. the SSE broker) receive the event dict after it has been stored.  They are
+called under the store lock so they see ids in increasing order; a listener
+must only hand the event off (e.g. ``loop.call_soon_threadsafe``), never block.
+"""
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Event:
+    __slots__ = ("id", "conv_id", "role", "text", "ts", "lane")
+
+    def __init__(self, id: int, conv_id: str, role: str, text: str, ts: str,
+                 lane: Optional[str] = "main") -> None:
+        self.id = id
+        self.conv_id = conv_id
+        self.role = role
+        self.text = text
+        self.ts = ts
+        self.lane = lane
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "conv_id": self.conv_id, "role": self.role,
+                "text": self.text, "ts": self.ts, "lane": self.lane}
+
+
+class _Conversation:
+    __slots__ = ("ids", "events", "last_active")
+
+    def __init__(self) -> None:
+        self.ids: List[int] = []
+        self.events: List[Event] = []
+        self.last_active = time.monotonic()
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class EventStore:
+    def __init__(self, max_conversations: Optional[int] = None,
+                 max_events_per_conv: Optional[int] = None,
+                 idle_ttl: Optional[float] = None,
+                 db_path: Optional[str] = None) -> None:
+        self.max_conversations = max_conversations or _env_int("EVENT_MAX_CONVERSATIONS", 500)
+        self.max_events_per_conv = max_events_per_conv or _env_int("EVENT_MAX_PER_CONV", 2000)
+        self.idle_ttl = float(idle_ttl if idle_ttl is not None else _env_int("EVENT_IDLE_TTL", 0))
+        self._convs: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._seq = 0
+        self._lock = threading.RLock()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._appends = 0
+        db_path = db_path if db_path is not None else os.getenv("PLAYGROUND_DB", "")
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_db(db_path)
+
+    # -- persistence -----------------------------------------------------
+    def _open_db(self, path: str) -> None:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, conv_id TEXT NOT NULL,"
+                   " role TEXT, text TEXT, ts TEXT, lane TEXT)")
+        db.execute("CREATE INDEX IF NOT EXISTS events_conv ON events(conv_id, id)")
+        db.execute("CREATE TABLE IF NOT EXISTS custom_roles (id TEXT PRIMARY KEY, body TEXT NOT NULL,"
+                   " updated REAL NOT NULL)")
+        self._db = db
+        row = db.execute("SELECT MAX(id) FROM events").fetchone()
+        self._seq = row[0] or 0
+        # restore the most recently active conversations within the retention limits
+        # and delete what falls outside them
+        db.execute("DELETE FROM events WHERE conv_id NOT IN (SELECT conv_id FROM events"
+                   " GROUP BY conv_id ORDER BY MAX(id) DESC LIMIT ?)", (self.max_conversations,))
+        convs = db.execute(
+            "SELECT conv_id FROM events GROUP BY conv_id ORDER BY MAX(id) DESC LIMIT ?",
+            (self.max_conversations,)).fetchall()
+        for (conv_id,) in reversed(convs):
+            rows = db.execute(
+                "SELECT id, conv_id, role, text, ts, lane FROM events WHERE conv_id = ?"
+                " ORDER BY id DESC LIMIT ?", (conv_id, self.max_events_per_conv)).fetchall()
+            conv = self._convs.setdefault(conv_id, _Conversation())
+            for r in reversed(rows):
+                conv.ids.append(r[0])
+                conv.events.append(Event(*r))
+            self._delete_rows(conv_id, before=conv.ids[0])
+
+    def _delete_rows(self, conv_id: str, before: Optional[int] = None) -> None:
+        """Delete a conversation's persisted events (only those with ``id < before`` if given)."""
+        if self._db is None:
+            return
+        if before is None:
+            self._db.execute("DELETE FROM events WHERE conv_id = ?", (conv_id,))
+        else:
+            self._db.execute("DELETE FROM events WHERE conv_id = ? AND id < ?", (conv_id, before))
+
+    # -- conversations ---------------------------------------------------
+    def new_conversation(self) -> str:
+        conv_id = str(uuid.uuid4())
+        with self._lock:
+            self._convs[conv_id] = _Conversation()
+            self._evict()
+        return conv_id
+
+    def has_conversation(self, conv_id: str) -> bool:
+        with self._lock:
+            return conv_id in self._convs
+
+    def drop(self, conv_id: str) -> None:
+        with self._lock:
+            self._convs.pop(conv_id, None)
+            self._delete_rows(conv_id)
+
+    def on_append(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        self._listeners.append(listener)
+
+    # -- events ----------------------------------------------------------
+    def append(self, conv_id: str, role: str, text: str, lane: Optional[str] = "main",
+               ts: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            self._seq += 1
+            ev = Event(self._seq, conv_id, role, text, ts or _now_iso(), lane)
+            conv = self._convs.get(conv_id)
+            if conv is None:
+                conv = self._convs[conv_id] = _Conversation()
+            else:
+                self._convs.move_to_end(conv_id)
+            conv.ids.append(ev.id)
+            conv.events.append(ev)
+            conv.last_active = time.monotonic()
+            excess = len(conv.ids) - self.max_events_per_conv
+            if excess > 0:
+                del conv.ids[:excess]
+                del conv.events[:excess]
+            if self._db is not None:
+                self._db.execute("INSERT INTO events (id, conv_id, role, text, ts, lane)"
+                                 " VALUES (?, ?, ?, ?, ?, ?)",
+                                 (ev.id, ev.conv_id, ev.role, ev.text, ev.ts, ev.lane))
+                if excess > 0:
+                    self._delete_rows(conv_id, before=conv.ids[0])
+            self._appends += 1
+            if self._appends % 256 == 0 or len(self._convs) > self.max_conversations:
+                self._evict()
+            out = ev.to_dict()
+            # publish before releasing the lock: a concurrent append must not overtake
+            # this one, or subscribers would drop it as already seen (id <= last)
+            for listener in self._listeners:
+                try:
+                    listener(out)
+                except Exception:
+                    pass
+        return out
+
+    def since(self, since_id: int = 0, conv_id: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Events with ``id > since_id``, oldest first, optionally for one conversation."""
+        with self._lock:
+            if conv_id is not None:
+                conv = self._convs.get(conv_id)
+                if conv is None:
+                    return []
+                start = bisect_right(conv.ids, since_id)
+                picked = conv.events[start:start + limit] if limit else conv.events[start:]
+                return [e.to_dict() for e in picked]
+            tails = []
+            for conv in self._convs.values():
+                if conv.ids and conv.ids[-1] > since_id:
+                    tails.append(conv.events[bisect_right(conv.ids, since_id):])
+        merged = heapq.merge(*tails, key=lambda e: e.id)
+        out = []
+        for e in merged:
+            out.append(e.to_dict())
+            if limit and len(out) >= limit:
+                break
+        return out
+
+    def conversation(self, conv_id: str) -> List[Dict[str, Any]]:
+        return self.since(0, conv_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"conversations": len(self._convs),
+                    "events": sum(len(c.ids) for c in self._convs.values()),
+                    "last_id": self._seq}
+
+    def _evict(self) -> None:
+        # caller holds the lock; OrderedDict keeps least recently active first
+        if self.idle_ttl > 0:
+            cutoff = time.monotonic() - self.idle_ttl
+            for cid in [cid for cid, c in self._convs.items() if c.last_active < cutoff]:
+                del self._convs[cid]
+                self._delete_rows(cid)
+        while len(self._convs) > self.max_conversations:
+            cid, _ = self._convs.popitem(last=False)
+            self._delete_rows(cid)
+
+    # -- custom roles ----------------------------------------------------
+    def save_role(self, role: Dict[str, Any]) -> None:
+        """Persist a runtime custom role (no-op without PLAYGROUND_DB)."""
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO custom_roles (id, body, updated) VALUES (?, ?, ?)",
+                             (role["id"], json.dumps(role, ensure_ascii=False), time.time()))
+
+    def delete_role(self, role_id: str) -> None:
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute("DELETE FROM custom_roles WHERE id = ?", (role_id,))
+
+    def load_roles(self) -> List[Dict[str, Any]]:
+        if self._db is None:
+            return []
+        with self._lock:
+            rows = self._db.execute("SELECT body FROM custom_roles ORDER BY updated").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+
+store = EventStore()
@@ -0,0 +1,168 @@
+"""Server-Sent Events push channel for conversation events.
+
+Events appended to ``event_store.store`` are published automatically (the same
+dicts that ``/api/feed`` returns: ``id``, ``conv_id``, ``role``, ``text``,
+``ts``, ``lane``) and resume replays come from the store's per-conversation
+index.  Browsers subscribe with
+``GET /api/stream?conv_id=<id>&since=<id>`` and the native EventSource
+reconnect resumes from ``Last-Event-ID``.  ``/api/feed`` stays the polling
+fallback for clients that cannot hold a stream open.
+
+``publish`` is safe to call from worker threads as well as from the event
+loop; delivery to each subscriber is marshalled onto that subscriber's loop.
+A subscriber that falls ``SUBSCRIBER_QUEUE_MAX`` events behind is closed
+rather than silently skipped: its response ends and EventSource reconnects
+with ``Last-Event-ID``, replaying whatever it missed from the store.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from . import metrics
+from .event_store import store
+
+KEEPALIVE_SECONDS = 15.0
+RETRY_MS = 2000
+SUBSCRIBER_QUEUE_MAX = 1000
+
+_Sub = Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Tuple[str, Dict[str, Any]]]"]
+
+
+class FeedBroker:
+    """Fan events out to per-conversation subscribers.
+
+    Resume replays come from ``source(since, conv_id)`` when given, otherwise
+    from a short in-memory window of recently published events.
+    """
+
+    def __init__(self, source: Optional[Callable[[int, Optional[str]], List[Dict[str, Any]]]] = None,
+                 history: int = 5000) -> None:
+        self._source = source
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=0 if source else history)
+        self._subs: Dict[Optional[str], Set[_Sub]] = {}
+        self._lock = threading.Lock()
+
+    # -- producers -------------------------------------------------------
+    def publish(self, event: Dict[str, Any]) -> None:
+        """Deliver a stored event (must carry a numeric ``id``) and remember it for resume."""
+        with self._lock:
+            self._recent.append(event)
+            targets = self._targets(event.get("conv_id"))
+        metrics.inc("feed_published_total", kind="message")
+        self._deliver(targets, "message", event)
+
+    def publish_partial(self, conv_id: str, role: str, text: str,
+                        lane: Optional[str] = None) -> None:
+        """Deliver an in-progress token delta. Partials are not replayed on resume."""
+        payload = {"conv_id": conv_id, "role": role, "lane": lane, "text": text}
+        with self._lock:
+            targets = self._targets(conv_id)
+        metrics.inc("feed_published_total", kind="partial")
+        self._deliver(targets, "partial", payload)
+
+    def _targets(self, conv_id: Optional[str]) -> List[_Sub]:
+        return list(self._subs.get(conv_id, ())) + list(self._subs.get(None, ()))
+
+    @staticmethod
+    def _deliver(targets: Iterable[_Sub], kind: str, payload: Dict[str, Any]) -> None:
+        for loop, q in targets:
+            def put(q=q) -> None:
+                try:
+                    q.put_nowait((kind, payload))
+                except asyncio.QueueFull:
+                    # slow consumer: end its stream so it resyncs from Last-Event-ID
+                    while not q.empty():
+                        q.get_nowait()
+                    q.put_nowait(("close", {}))
+                    metrics.inc("feed_overflow_total")
+            try:
+                loop.call_soon_threadsafe(put)
+            except RuntimeError:
+                pass  # loop already closed
+
+    # -- consumers -------------------------------------------------------
+    def subscribe(self, conv_id: Optional[str]) -> _Sub:
+        sub: _Sub = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_MAX))
+        with self._lock:
+            self._subs.setdefault(conv_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, conv_id: Optional[str], sub: _Sub) -> None:
+        with self._lock:
+            subs = self._subs.get(conv_id)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[conv_id]
+
+    def replay(self, conv_id: Optional[str], since: int) -> List[Dict[str, Any]]:
+        if self._source is not None:
+            return self._source(since, conv_id)
+        with self._lock:
+            return [e for e in self._recent
+                    if e.get("id", 0) > since and (conv_id is None or e.get("conv_id") == conv_id)]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+
+broker = FeedBroker(source=store.since)
+store.on_append(broker.publish)
+publish = broker.publish
+publish_partial = broker.publish_partial
+
+router = APIRouter()
+
+
+def _sse(kind: str, payload: Dict[str, Any]) -> str:
+    data = json.dumps(payload, ensure_ascii=False)
+    if kind == "message":
+        return f"id: {payload.get('id')}\ndata: {data}\n\n"
+    return f"event: {kind}\ndata: {data}\n\n"
+
+
+@router.get("/api/stream")
+async def stream(request: Request, conv_id: Optional[str] = None, since: int = 0):
+    """Push events for one conversation (or all, when ``conv_id`` is omitted)."""
+    header = request.headers.get("last-event-id")
+    if header and header.isdigit():
+        since = max(since, int(header))
+
+    async def gen():
+        # subscribe before replaying so nothing published in between is lost
+        sub = broker.subscribe(conv_id)
+        last = since
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            for ev in broker.replay(conv_id, since):
+                last = ev["id"]
+                yield _sse("message", ev)
+            q = sub[1]
+            while True:
+                try:
+                    kind, payload = await asyncio.wait_for(q.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if kind == "close":
+                    break
+                if kind == "message":
+                    if payload.get("id", 0) <= last:
+                        continue
+                    last = payload["id"]
+                yield _sse(kind, payload)
+        finally:
+            broker.unsubscribe(conv_id, sub)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(gen(), media_type="text/event-stream", headers=headers)
@@ -0,0 +1,150 @@
+"""Run independent ``consult:<role>`` lanes concurrently.
+
+Each lane is a coroutine that talks to one specialist for 1..FOLLOWUP_TURNS
+turns and reports every message through ``emit(role, text)``.  Lanes run at
+the same time, capped per provider (``recommended_api``), and their messages
+are still published in lane order: the first unfinished lane streams live,
+later lanes are buffered until every lane before them has finished.  The
+manager summary should be produced after ``run_lanes`` returns.
+
+Timing is recorded in ``metrics`` as ``lane_seconds`` and
+``lane_queue_wait_seconds`` (time spent waiting for a provider slot).
+
+Caps (env) are shared by every ``run_lanes`` call in the process, so
+concurrent messages together stay within them:
+  LANE_CONCURRENCY             default cap for every provider (default 4)
+  LANE_CONCURRENCY_<PROVIDER>  per-provider override, e.g. LANE_CONCURRENCY_OPENAI=6
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+
+Emit = Callable[[str, str], None]                      # emit(role, text)
+Sink = Callable[[str, str, str], Dict[str, Any]]       # sink(lane, role, text) -> stored event
+LaneBody = Callable[[Emit], Awaitable[None]]
+
+
+@dataclass
+class Lane:
+    role_id: str
+    body: LaneBody
+    provider: str = "openai"
+
+    @property
+    def name(self) -> str:
+        return f"consult:{self.role_id}"
+
+
+@dataclass
+class LaneResult:
+    role_id: str
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[BaseException] = None
+    seconds: float = 0.0
+
+
+class ProviderLimiter:
+    """One semaphore per provider, created lazily inside the running loop."""
+
+    def __init__(self, default: Optional[int] = None,
+                 overrides: Optional[Dict[str, int]] = None) -> None:
+        self.default = default or int(os.getenv("LANE_CONCURRENCY", "4"))
+        self.overrides = {k.lower(): v for k, v in (overrides or {}).items()}
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def limit_for(self, provider: str) -> int:
+        key = (provider or "openai").lower()
+        if key in self.overrides:
+            return self.overrides[key]
+        env = os.getenv(f"LANE_CONCURRENCY_{key.upper()}")
+        return int(env) if env else self.default
+
+    def semaphore(self, provider: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:  # semaphores belong to one loop (e.g. a new asyncio.run)
+            self._loop, self._sems = loop, {}
+        key = (provider or "openai").lower()
+        sem = self._sems.get(key)
+        if sem is None:
+            sem = self._sems[key] = asyncio.Semaphore(max(1, self.limit_for(key)))
+        return sem
+
+
+default_limiter = ProviderLimiter()
+
+
+class _OrderedEmitter:
+    """Publish lane messages in lane order while lanes finish in any order."""
+
+    def __init__(self, lanes: List[Lane], sink: Sink, results: List[LaneResult]) -> None:
+        self.lanes = lanes
+        self.sink = sink
+        self.results = results
+        self.pending: List[List[Tuple[str, str]]] = [[] for _ in lanes]
+        self.done = [False] * len(lanes)
+        self.head = 0
+
+    def emit(self, i: int, role: str, text: str) -> None:
+        if i == self.head:
+            self._publish(i, role, text)
+        else:
+            self.pending[i].append((role, text))
+
+    def finish(self, i: int) -> None:
+        self.done[i] = True
+        while self.head < len(self.lanes) and self.done[self.head]:
+            self.head += 1
+            if self.head < len(self.lanes):
+                for role, text in self.pending[self.head]:
+                    self._publish(self.head, role, text)
+                self.pending[self.head].clear()
+
+    def _publish(self, i: int, role: str, text: str) -> None:
+        self.results[i].events.append(self.sink(self.lanes[i].name, role, text))
+
+
+async def run_lanes(lanes: List[Lane], sink: Sink,
+                    limiter: Optional[ProviderLimiter] = None) -> List[LaneResult]:
+    """Run all lanes concurrently; returns one LaneResult per lane in input order.
+
+    ``sink(lane, role, text)`` stores/publishes a message and is always called
+    on the event loop thread.  To store into the event store, adapt the
+    argument order and bind the conversation::
+
+        sink = lambda lane, role, text: store.append(conv_id, role, text, lane)
+
+    ``limiter`` defaults to ``default_limiter``, shared by every call.
+    A failing lane records its exception and does not cancel the others.
+    """
+    limiter = limiter or default_limiter
+    results = [LaneResult(lane.role_id) for lane in lanes]
+    emitter = _OrderedEmitter(lanes, sink, results)
+    loop = asyncio.get_running_loop()
+
+    async def one(i: int, lane: Lane) -> None:
+        def emit(role: str, text: str) -> None:
+            emitter.emit(i, role, text)
+
+        queued = loop.time()
+        async with limiter.semaphore(lane.provider):
+            started = loop.time()
+            metrics.observe("lane_queue_wait_seconds", started - queued, provider=lane.provider)
+            try:
+                with metrics.span("lane", role=lane.role_id, provider=lane.provider):
+                    await lane.body(emit)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                results[i].error = e
+            finally:
+                results[i].seconds = loop.time() - started
+                emitter.finish(i)
+
+    await asyncio.gather(*(one(i, lane) for i, lane in enumerate(lanes)))
+    return results
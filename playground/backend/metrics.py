@@ -0,0 +1,89 @@
+"""Hot-path timing and token counters exported as ``GET /api/metrics``.
+
+The counters, histograms, spans and Prometheus rendering are the repository's
+``metrics.py`` (shared with the watchers and the orchestrator); this module
+loads it and adds what only the playground needs: gauges sampled at scrape
+time (event store size, SSE subscribers) and the FastAPI route.
+
+Use ``span(name, **labels)`` around a block (sync or inside a coroutine) to
+record ``<name>_seconds``; ``observe``/``inc`` record histograms and counters
+directly.
+
+Set ``PLAYGROUND_TRACE=<path>`` to also append every span as a Chrome trace
+event (open the file in chrome://tracing or https://ui.perfetto.dev).
+
+Recorded by the playground modules:
+  lane_seconds{role,provider}         one consult lane, end to end
+  lane_queue_wait_seconds{provider}   time spent waiting for a provider slot
+  feed_published_total{kind}          events pushed over SSE
+  feed_overflow_total                 SSE subscribers closed for falling behind
+  speculative_turns_total{outcome} / speculative_wasted_tokens_total / speculative_saved_seconds
+"""
+from __future__ import annotations
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from typing import Callable, Dict
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+_ROOT = Path(__file__).resolve().parents[2]
+
+
+def _load_core():
+    # loaded by path: with PYTHONPATH=backend a plain ``import metrics`` would find this file
+    if str(_ROOT) not in sys.path:
+        sys.path.append(str(_ROOT))  # metrics.py writes traces through log_writer.py
+    spec = importlib.util.spec_from_file_location("chat_cli_metrics", _ROOT / "metrics.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+core = sys.modules.get("chat_cli_metrics") or _load_core()
+inc = core.inc
+observe = core.observe
+span = core.span
+if os.getenv("PLAYGROUND_TRACE") and not core.tracing():
+    core.enable_trace(os.environ["PLAYGROUND_TRACE"])
+
+_gauges: Dict[str, Callable[[], Dict[tuple, float]]] = {}
+
+
+def gauge(name: str, fn: Callable[[], Dict[tuple, float]]) -> None:
+    """Register a gauge whose series (labels tuple -> value) are computed at scrape time."""
+    _gauges[name] = fn
+
+
+def render() -> str:
+    for name, fn in list(_gauges.items()):
+        for labels, value in fn().items():
+            core.set_gauge(name, value, **dict(labels))
+    return core.render()
+
+
+def _store_gauges() -> Dict[tuple, float]:
+    from .event_store import store
+    stats = store.stats()
+    return {(("kind", "conversations"),): stats["conversations"],
+            (("kind", "events"),): stats["events"]}
+
+
+def _subscriber_gauge() -> Dict[tuple, float]:
+    from .feed_stream import broker
+    return {(): broker.subscriber_count()}
+
+
+gauge("event_store_size", _store_gauges)
+gauge("feed_subscribers", _subscriber_gauge)
+
+router = APIRouter()
+
+
+@router.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,345 @@
+"""Role card registry: every source parsed once, derived fields precomputed.
+
+Sources, merged in this order (a later card with the same id replaces an
+earlier one):
+  1. ``backend/roles.json``
+  2. ``backend/roles_custom.json``
+  3. ``AI_ROLES_DIR`` (``*.json`` / ``*.yaml`` / ``*.yml``, recursively, sorted by path)
+  4. runtime edits made through ``/api/roles`` (``create``/``update``; persisted
+     in the event store's ``custom_roles`` table when ``PLAYGROUND_DB`` is set)
+
+A file may hold a list of cards, ``{"roles": [...]}`` or a single card.  Each
+file is cached together with its ``(mtime_ns, size)``; ``refresh()`` stats the
+sources (at most once per ``ROLE_REGISTRY_CHECK_INTERVAL`` seconds, default 1)
+and re-reads only the files that changed, appeared or disappeared.  The merged
+view is rebuilt only when something changed, and ``version`` is bumped so
+callers can key their own caches (e.g. the specialist index) on it.
+
+Per card the registry fills in, once per change rather than per request:
+  * ``system_prompt`` generated from title/persona/tone/catchphrase/domain when absent
+  * ``icon`` (``hsl`` background from a stable hash of the id, emoji, initial) when absent
+  * normalised ``recommended_api`` and a keyword list used for role matching
+
+Invalid cards (no id, non-dict entries) are skipped with a warning; a file
+that fails to parse keeps its previous good contents.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import metrics
+
+try:
+    import yaml
+except ImportError:  # optional: YAML role files are skipped without PyYAML
+    yaml = None
+
+log = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent
+ROLE_EXTS = (".json", ".yaml", ".yml")
+PROVIDERS = {"openai": "openai", "chatgpt": "openai", "gpt": "openai",
+             "anthropic": "anthropic", "claude": "anthropic",
+             "gemini": "gemini", "google": "gemini"}
+PROMPT_FIELDS = ("title", "personality", "persona", "tone", "catchphrase", "domain")
+
+# first matching keyword decides the icon emoji
+EMOJI_RULES: Tuple[Tuple[str, str], ...] = (
+    ("財務", "🧮"), ("会計", "🧮"), ("CFO", "🧮"), ("法務", "⚖️"), ("コンプライアンス", "⚖️"),
+    ("デザイン", "🎨"), ("UI", "🎨"), ("営業", "📣"), ("マーケ", "📣"), ("競合", "🎯"),
+    ("調査", "🔎"), ("リサーチ", "🔎"), ("分析", "🧠"), ("アナリスト", "🧠"), ("技術", "🧭"),
+    ("アーキテクト", "🧭"), ("開発", "🛠️"), ("事業", "🤝"), ("進行", "📋"), ("プロジェクト", "📋"),
+    ("企画", "🌞"), ("アイデア", "💡"), ("ライター", "✍️"), ("校正", "🔍"), ("統括", "🧭"),
+)
+DEFAULT_EMOJI = "💠"
+
+_SPLIT = re.compile(r"[\s、,，。・/／:：;；()（）「」『』\[\]【】]+")
+
+FileKey = Tuple[int, int]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# -- derived fields ------------------------------------------------------
+def _clause(text: str) -> str:
+    return text.strip().rstrip("。")
+
+
+def build_system_prompt(role: Dict[str, Any]) -> str:
+    """System prompt in the playground's standard shape (same template as /api/roles)."""
+    title = role.get("title") or role.get("id") or ""
+    lines = [f"あなたは{title}です。",
+             "ユーザーの議題に対し、自然な会話文で端的に助言します。",
+             "挨拶や自己紹介は省き、要点から始めます。"]
+    if role.get("domain"):
+        lines.append(f"専門領域: {_clause(role['domain'])}。この範囲の判断・助言を優先します。")
+    persona = role.get("persona") or role.get("personality")
+    if persona:
+        lines.append(f"性格/キャラ: {_clause(persona)}。")
+    if role.get("tone"):
+        lines.append(f"口調/文体: {_clause(role['tone'])}。")
+    if role.get("catchphrase"):
+        lines.append(f"口癖: 必要なときだけ『{role['catchphrase'].strip()}』を短く使います。乱用しません。")
+    return "\n".join(lines)
+
+
+def build_icon(role: Dict[str, Any]) -> Dict[str, str]:
+    hue = int(hashlib.sha1(str(role["id"]).encode("utf-8")).hexdigest()[:8], 16) % 360
+    text = " ".join(str(role.get(k) or "") for k in ("title", "domain", "description"))
+    emoji = next((e for word, e in EMOJI_RULES if word.lower() in text.lower()), DEFAULT_EMOJI)
+    title = str(role.get("title") or role["id"])
+    return {"bg": f"hsl({hue}, 60%, 35%)", "emoji": emoji, "text": title[:1]}
+
+
+def role_keywords(role: Dict[str, Any]) -> Tuple[str, ...]:
+    """Lower-cased terms from title/domain/description/personality (2+ chars, de-duplicated)."""
+    seen: Dict[str, None] = {}
+    for k in ("title", "domain", "description", "personality", "persona"):
+        for term in _SPLIT.split(str(role.get(k) or "")):
+            term = term.strip().lower()
+            if len(term) >= 2:
+                seen.setdefault(term, None)
+    return tuple(seen)
+
+
+def normalize(raw: Any, source: str) -> Optional[Dict[str, Any]]:
+    """Validate one card and fill in derived fields; ``None`` (with a warning) when unusable."""
+    if not isinstance(raw, dict):
+        log.warning("role registry: %s: skipping non-object entry", source)
+        return None
+    role_id = str(raw.get("id") or "").strip()
+    if not role_id:
+        log.warning("role registry: %s: skipping card without id", source)
+        return None
+    role = dict(raw)
+    role["id"] = role_id
+    role["title"] = str(role.get("title") or role_id)
+    api = str(role.get("recommended_api") or "openai").strip().lower()
+    if api not in PROVIDERS:
+        log.warning("role registry: %s: %s: unknown recommended_api %r, using openai", source, role_id, api)
+    role["recommended_api"] = PROVIDERS.get(api, "openai")
+    if not role.get("system_prompt"):
+        role["system_prompt"] = build_system_prompt(role)
+    if not isinstance(role.get("icon"), dict):
+        role["icon"] = build_icon(role)
+    return role
+
+
+# -- sources -------------------------------------------------------------
+def _parse(path: Path) -> List[Any]:
+    raw = path.read_bytes()
+    if path.suffix.lower() == ".json":
+        data = json.loads(raw.decode("utf-8-sig"))
+    else:
+        data = yaml.safe_load(raw.decode("utf-8-sig"))
+    if isinstance(data, dict):
+        data = data["roles"] if isinstance(data.get("roles"), list) else [data]
+    return data or []
+
+
+class _FileEntry:
+    __slots__ = ("key", "roles")
+
+    def __init__(self, key: FileKey, roles: List[Dict[str, Any]]) -> None:
+        self.key = key
+        self.roles = roles
+
+
+class RoleRegistry:
+    def __init__(self, base_files: Optional[Iterable[Path]] = None,
+                 roles_dir: Optional[str] = None,
+                 check_interval: Optional[float] = None,
+                 store: Any = None) -> None:
+        self.base_files = list(base_files if base_files is not None
+                               else (BACKEND_DIR / "roles.json", BACKEND_DIR / "roles_custom.json"))
+        roles_dir = roles_dir if roles_dir is not None else os.getenv("AI_ROLES_DIR", "")
+        self.roles_dir = Path(roles_dir) if roles_dir else None
+        self.check_interval = (check_interval if check_interval is not None
+                               else _env_float("ROLE_REGISTRY_CHECK_INTERVAL", 1.0))
+        self._store = store
+        self._files: Dict[Path, _FileEntry] = {}
+        self._order: List[Path] = []
+        self._runtime: Dict[str, Dict[str, Any]] = {}
+        self._merged: Dict[str, Dict[str, Any]] = {}
+        self._keywords: Dict[str, Tuple[str, ...]] = {}
+        self._by_keyword: Dict[str, Tuple[str, ...]] = {}
+        self._checked = 0.0
+        self._lock = threading.RLock()
+        self.version = 0
+        self.parses = 0
+        self._yaml_warned = False
+        if store is not None:
+            for raw in store.load_roles():
+                role = normalize(raw, "custom_roles")
+                if role is not None:
+                    self._runtime[role["id"]] = role
+        self.refresh(force=True)
+
+    # -- loading ---------------------------------------------------------
+    def _paths(self) -> List[Path]:
+        paths = [p for p in self.base_files if p.is_file()]
+        if self.roles_dir is not None and self.roles_dir.is_dir():
+            found = []
+            for dirpath, _, names in os.walk(self.roles_dir):
+                for name in names:
+                    if name.lower().endswith(ROLE_EXTS):
+                        found.append(Path(dirpath) / name)
+            paths += sorted(found)
+        return paths
+
+    def _load_file(self, path: Path, key: FileKey) -> None:
+        if path.suffix.lower() != ".json" and yaml is None:
+            if not self._yaml_warned:
+                log.warning("role registry: PyYAML not installed, skipping YAML role files")
+                self._yaml_warned = True
+            self._files[path] = _FileEntry(key, [])
+            return
+        try:
+            raw = _parse(path)
+        except Exception as e:
+            log.warning("role registry: %s: %s (keeping previous contents)", path, e)
+            prev = self._files.get(path)
+            self._files[path] = _FileEntry(key, prev.roles if prev else [])
+            return
+        self.parses += 1
+        roles = [r for r in (normalize(item, str(path)) for item in raw) if r is not None]
+        self._files[path] = _FileEntry(key, roles)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-read changed sources; returns True when the merged view changed."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked < self.check_interval:
+                return False
+            self._checked = now
+            with metrics.span("role_registry_refresh"):
+                changed = False
+                paths = self._paths()
+                seen = set(paths)
+                for path in paths:
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    key = (st.st_mtime_ns, st.st_size)
+                    entry = self._files.get(path)
+                    if entry is None or entry.key != key:
+                        self._load_file(path, key)
+                        changed = True
+                for path in [p for p in self._files if p not in seen]:
+                    del self._files[path]
+                    changed = True
+                if changed or force or paths != self._order:
+                    self._order = paths
+                    self._rebuild()
+            return changed
+
+    def _rebuild(self) -> None:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for path in self._order:
+            entry = self._files.get(path)
+            if entry is not None:
+                for role in entry.roles:
+                    merged[role["id"]] = role
+        merged.update(self._runtime)
+        keywords = {rid: role_keywords(r) for rid, r in merged.items()}
+        by_keyword: Dict[str, List[str]] = {}
+        for rid, terms in keywords.items():
+            for t in terms:
+                by_keyword.setdefault(t, []).append(rid)
+        self._merged = merged
+        self._keywords = keywords
+        self._by_keyword = {t: tuple(ids) for t, ids in by_keyword.items()}
+        self.version += 1
+        metrics.inc("role_registry_rebuilds_total")
+
+    # -- queries ---------------------------------------------------------
+    def roles(self) -> List[Dict[str, Any]]:
+        """All merged cards (treat as read-only)."""
+        self.refresh()
+        return list(self._merged.values())
+
+    def get(self, role_id: str) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        return self._merged.get(role_id)
+
+    def keywords(self, role_id: str) -> Tuple[str, ...]:
+        self.refresh()
+        return self._keywords.get(role_id, ())
+
+    def roles_for_keyword(self, term: str) -> Tuple[str, ...]:
+        self.refresh()
+        return self._by_keyword.get(term.lower(), ())
+
+    def stats(self) -> Dict[str, int]:
+        return {"roles": len(self._merged), "files": len(self._files),
+                "runtime": len(self._runtime), "parses": self.parses, "version": self.version}
+
+    # -- runtime edits (/api/roles) -------------------------------------
+    def create(self, fields: Dict[str, Any], role_id: Optional[str] = None) -> Dict[str, Any]:
+        """Add a custom role from title/persona/tone/catchphrase/domain/recommended_api."""
+        title = str(fields.get("title") or "").strip()
+        if not title:
+            raise ValueError("title is required")
+        role_id = role_id or "cust_" + hashlib.sha1(f"{title}{time.time()}".encode("utf-8")).hexdigest()[:8]
+        return self._put(role_id, fields, base={})
+
+    def update(self, role_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        """Edit an existing role; system_prompt and icon are regenerated from the new fields."""
+        current = self.get(role_id)
+        if current is None:
+            raise KeyError(role_id)
+        return self._put(role_id, fields, base=current)
+
+    def _put(self, role_id: str, fields: Dict[str, Any], base: Dict[str, Any]) -> Dict[str, Any]:
+        raw = {k: v for k, v in base.items() if k not in ("system_prompt", "icon")}
+        for k in PROMPT_FIELDS + ("recommended_api", "description"):
+            if fields.get(k) is not None:
+                raw[k] = fields[k].strip() if isinstance(fields[k], str) else fields[k]
+        if "persona" in raw:  # the UI sends persona; cards store it as personality
+            raw["personality"] = raw.pop("persona")
+        raw["id"] = role_id
+        role = normalize(raw, "api")
+        with self._lock:
+            self._runtime[role_id] = role
+            self._rebuild()
+        if self._store is not None:
+            self._store.save_role(role)
+        return role
+
+    def delete(self, role_id: str) -> bool:
+        """Drop a runtime edit (file-defined cards come back if they exist)."""
+        with self._lock:
+            if self._runtime.pop(role_id, None) is None:
+                return False
+            self._rebuild()
+        if self._store is not None:
+            self._store.delete_role(role_id)
+        return True
+
+
+_registry: Optional[RoleRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> RoleRegistry:
+    """Process-wide registry (runtime edits persisted through the event store)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            from .event_store import store
+            _registry = RoleRegistry(store=store)
+        return _registry
@@ -0,0 +1,197 @@
+"""Share identical in-flight LLM calls and cancel superseded ones (asyncio).
+
+A double submit, two tabs on the same conversation or several lanes asking
+the same question can send an identical prompt at the same moment.
+``AsyncGroup`` lets those calls share one upstream request:
+
+  * ``await flights.do(key, fn)`` -- the first caller runs ``fn()`` as a task;
+    callers arriving while it runs await the same task and get the same result
+    (or exception).
+  * ``flights.stream(key, fn)`` -- the first caller starts a task that reads the
+    async iterator ``fn()`` into a buffer; every caller replays the buffer and
+    then follows it live.  When the last reader leaves, the upstream task is
+    cancelled.
+
+Finished calls are forgotten immediately; reusing finished results is the
+response cache's job, not this module's.
+
+``Latest`` cancels stale work per source: ``latest.run(source, coro)`` starts
+``coro`` as a task and cancels the task started earlier for the same source
+(e.g. the reply to a message the user has since edited and resent).  A
+cancelled reader of a shared stream only stops the upstream call when nobody
+else is reading it.
+
+``coalesce(ask)`` wraps an ``ask(messages)`` async iterator (the callable
+``SpeculativeConsult`` takes) so identical message lists share one stream::
+
+    ask = coalesce(stream_reply, model=model)
+    task = latest.run(conversation_id, reply_to(message, ask))
+
+The repository's ``singleflight.py`` does the same for the threaded watchers
+(producer threads, ``threading.Event`` cancellation).  This is the asyncio
+counterpart: its readers must await a condition instead of blocking a thread,
+and cancelling is ``Task.cancel`` rather than a flag polled between chunks, so
+the two share their design and metric names but not code.  Nothing calls this
+module yet; the conversation core is expected to wrap its ask with ``coalesce``.
+
+Counters: ``singleflight_calls_total{group}``, ``singleflight_shared_total{group}``,
+``singleflight_abandoned_total{group}``, ``singleflight_superseded_total{group}``.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from . import metrics
+
+Messages = List[Dict[str, str]]
+Ask = Callable[[Messages], AsyncIterator[str]]
+
+
+def request_key(messages: Messages, **params: Any) -> str:
+    """Stable key for a request: same messages and params give the same key."""
+    payload = json.dumps({"messages": messages, **params}, ensure_ascii=False,
+                         sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.task: Optional[asyncio.Future] = None
+        self.cond = asyncio.Condition()
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class AsyncGroup:
+    def __init__(self, name: str = "default") -> None:
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._flights: Dict[str, _Flight] = {}
+
+    def _join(self, key: str) -> tuple:
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = _Flight()
+            self.calls += 1
+        else:
+            self.shared += 1
+        metrics.inc("singleflight_calls_total" if leader else "singleflight_shared_total", group=self.name)
+        flight.waiters += 1
+        return flight, leader
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _leave(self, key: str, flight: _Flight) -> None:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not (flight.done or flight.task.done()):
+            flight.task.cancel()
+            self._forget(key, flight)
+            metrics.inc("singleflight_abandoned_total", group=self.name)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the in-flight call for ``key``, starting ``fn()`` if there is none."""
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(fn())
+
+            def finished(_: asyncio.Future, flight: _Flight = flight) -> None:
+                flight.done = True
+                self._forget(key, flight)
+
+            flight.task.add_done_callback(finished)
+        try:
+            # shield: one caller being cancelled must not cancel the others' call
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(key, flight)
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Yield the chunks of the in-flight stream for ``key`` from the start."""
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._produce(key, flight, fn))
+        i = 0
+        try:
+            while True:
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: flight.done or i < len(flight.chunks))
+                    new, done = flight.chunks[i:], flight.done
+                i += len(new)
+                for chunk in new:
+                    yield chunk
+                if done:
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            self._leave(key, flight)
+
+    async def _produce(self, key: str, flight: _Flight, fn: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for chunk in fn():
+                async with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except asyncio.CancelledError:
+            flight.done = True  # every reader has left
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._forget(key, flight)
+        async with flight.cond:
+            flight.done = True
+            flight.cond.notify_all()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
+
+
+class Latest:
+    """One task per source; starting a new one cancels the previous one."""
+
+    def __init__(self, name: str = "default") -> None:
+        self.name = name
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def run(self, source: str, coro: Awaitable[Any]) -> asyncio.Future:
+        old = self._tasks.get(source)
+        if old is not None and not old.done():
+            old.cancel()
+            metrics.inc("singleflight_superseded_total", group=self.name)
+        task = asyncio.ensure_future(coro)
+        self._tasks[source] = task
+
+        def finished(t: asyncio.Future) -> None:
+            if self._tasks.get(source) is t:
+                del self._tasks[source]
+
+        task.add_done_callback(finished)
+        return task
+
+    def cancel(self, source: str) -> None:
+        task = self._tasks.pop(source, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+
+flights = AsyncGroup("llm")
+
+
+def coalesce(ask: Ask, group: Optional[AsyncGroup] = None, **params: Any) -> Ask:
+    """Wrap ``ask`` so concurrent calls with identical messages (and params) share one stream."""
+    group = group or flights
+
+    def shared(messages: Messages) -> AsyncIterator[str]:
+        return group.stream(request_key(messages, **params), lambda: ask(messages))
+
+    return shared
@@ -0,0 +1,362 @@
+"""Specialist selection: one precompiled matcher instead of a scan per message.
+
+``select(message)`` picks the consult roles for a user message:
+  1. keywords of every candidate role (built-in topic words below plus the
+     title/domain/description terms the role registry extracts) are compiled
+     into a single Aho–Corasick automaton, so a message is matched in one pass
+     over its characters regardless of how many roles exist;
+  2. phrases such as 多人数 / 幅広く are part of the same automaton and raise
+     the limit from ``SELECT_LIMIT`` (default 3) to ``SELECT_LIMIT_MANY`` (8);
+  3. if keyword hits leave free slots, a character-bigram TF-IDF ranker over
+     the role texts fills them (``SPECIALIST_TFIDF=0`` disables it).  The
+     ranker is persisted to ``SPECIALIST_INDEX_PATH`` (default
+     ``backend/.cache/specialist_index.json``) and reused while the role texts are
+     unchanged;
+  4. when nothing matches (or a wide panel was asked for and slots are
+     left), the default specialists are used.
+
+Custom roles (``cust_*``) are candidates like any other; roles flagged
+``orchestrator`` or ``addable: false`` and the motivator roles are not.
+Results are memoised in an LRU keyed by the NFKC-normalised message, the limit
+and the registry version (``SPECIALIST_CACHE_SIZE``, default 1024), and the
+whole index is rebuilt only when the registry version changes.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from . import metrics
+from .role_registry import BACKEND_DIR, RoleRegistry, get_registry
+
+DEFAULT_LIMIT = 3
+MANY_LIMIT = 8
+MANY_PHRASES = ("多くの担当者", "多人数", "たくさんの意見", "幅広く", "多数のai", "多方面",
+                "大勢", "全員", "いろいろな意見", "様々な視点")
+DEFAULT_SPECIALISTS = ("idea_ai", "writer_ai", "proof_ai", "pm_ai")
+EXCLUDED = ("motivator_ai", "motivator_ai_dynamic")
+
+# topic words for the bundled roles (role keywords from the registry are added on top)
+BUILTIN_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "idea_ai": ("アイデア", "アイディア", "発想", "企画", "案を", "ブレスト", "新規", "仮説"),
+    "writer_ai": ("文章", "記事", "原稿", "構成", "ライティング", "執筆", "ブログ", "コピー"),
+    "proof_ai": ("校正", "誤字", "添削", "推敲", "表記", "レビュー", "チェック", "事実確認"),
+    "pm_ai": ("計画", "スケジュール", "優先順位", "段取り", "タスク", "進め方", "マイルストーン"),
+    "product_manager_ai": ("プロダクト", "要件", "kpi", "ロードマップ", "顧客価値", "市場"),
+    "project_manager_ai": ("進捗", "wbs", "リスク", "担当", "工程", "納期"),
+    "architect_ai": ("アーキテクチャ", "設計", "技術選定", "インフラ", "スケーラビリティ", "セキュリティ"),
+    "dev_ai": ("実装", "コード", "プログラム", "バグ", "api", "python", "javascript"),
+}
+BUILTIN_WEIGHT = 2.0
+KEYWORD_WEIGHT = 1.0
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def normalize(text: str) -> str:
+    """NFKC + lower-case + collapsed whitespace (cache key and matching form)."""
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+class AhoCorasick:
+    """Multi-pattern matcher; ``find`` reports every pattern occurrence in one pass."""
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        for p in patterns:
+            self._add(p)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] += (len(self.patterns),)
+        self.patterns.append(pattern)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Iterator[int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+
+def _bigrams(text: str) -> List[str]:
+    text = normalize(text).replace(" ", "")
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
+class TfidfRanker:
+    """Character-bigram TF-IDF over role texts with an inverted index (cosine scores)."""
+
+    def __init__(self, docs: Dict[str, str]) -> None:
+        self.signature = self.signature_of(docs)
+        df: Dict[str, int] = {}
+        tfs: Dict[str, Dict[str, int]] = {}
+        for rid, text in docs.items():
+            tf: Dict[str, int] = {}
+            for g in _bigrams(text):
+                tf[g] = tf.get(g, 0) + 1
+            tfs[rid] = tf
+            for g in tf:
+                df[g] = df.get(g, 0) + 1
+        n = max(len(docs), 1)
+        self.idf = {g: math.log((1 + n) / (1 + c)) + 1.0 for g, c in df.items()}
+        self.postings: Dict[str, List[Tuple[str, float]]] = {}
+        for rid, tf in tfs.items():
+            weights = {g: (1 + math.log(c)) * self.idf[g] for g, c in tf.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for g, w in weights.items():
+                self.postings.setdefault(g, []).append((rid, w / norm))
+
+    @staticmethod
+    def signature_of(docs: Dict[str, str]) -> str:
+        h = hashlib.sha1()
+        for rid in sorted(docs):
+            h.update(rid.encode("utf-8") + b"\0" + docs[rid].encode("utf-8") + b"\0")
+        return h.hexdigest()
+
+    def rank(self, text: str, top: int) -> List[Tuple[str, float]]:
+        tf: Dict[str, int] = {}
+        for g in _bigrams(text):
+            if g in self.idf:
+                tf[g] = tf.get(g, 0) + 1
+        if not tf:
+            return []
+        q = {g: (1 + math.log(c)) * self.idf[g] for g, c in tf.items()}
+        qn = math.sqrt(sum(w * w for w in q.values())) or 1.0
+        scores: Dict[str, float] = {}
+        for g, w in q.items():
+            for rid, dw in self.postings[g]:
+                scores[rid] = scores.get(rid, 0.0) + w * dw / qn
+        return sorted(scores.items(), key=lambda kv: -kv[1])[:top]
+
+    # -- persistence -----------------------------------------------------
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"signature": self.signature, "idf": self.idf, "postings": self.postings},
+                      f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, docs: Dict[str, str]) -> Optional["TfidfRanker"]:
+        """The saved ranker when it was built from exactly these texts, else ``None``."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("signature") != cls.signature_of(docs):
+            return None
+        self = cls.__new__(cls)
+        self.signature = data["signature"]
+        self.idf = data["idf"]
+        self.postings = {g: [(rid, w) for rid, w in p] for g, p in data["postings"].items()}
+        return self
+
+
+@dataclass
+class Selection:
+    roles: List[str]
+    limit: int
+    many: bool = False
+    scores: Dict[str, float] = field(default_factory=dict)
+    source: Dict[str, str] = field(default_factory=dict)  # role -> "keyword" | "tfidf" | "default"
+
+    def copy(self) -> "Selection":
+        return Selection(list(self.roles), self.limit, self.many, dict(self.scores), dict(self.source))
+
+
+class _State(NamedTuple):
+    """Everything ``_select`` reads, built together and swapped in one assignment."""
+    matcher: AhoCorasick
+    targets: List[Tuple[Tuple[str, float], ...]]  # pattern index -> (role, weight)...
+    many: List[bool]                               # pattern index -> is a "many" phrase
+    ranker: Optional[TfidfRanker]
+    candidates: List[str]
+
+
+class SpecialistIndex:
+    def __init__(self, registry: Optional[RoleRegistry] = None,
+                 builtin: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 use_tfidf: Optional[bool] = None,
+                 index_path: Optional[str] = None,
+                 cache_size: Optional[int] = None) -> None:
+        self.registry = registry or get_registry()
+        self.builtin = BUILTIN_KEYWORDS if builtin is None else builtin
+        self.use_tfidf = (use_tfidf if use_tfidf is not None
+                          else os.getenv("SPECIALIST_TFIDF", "1") not in ("0", "false", "no"))
+        path = index_path if index_path is not None else os.getenv("SPECIALIST_INDEX_PATH", "")
+        self.index_path = Path(path) if path else BACKEND_DIR / ".cache" / "specialist_index.json"
+        self.cache_size = cache_size or _env_int("SPECIALIST_CACHE_SIZE", 1024)
+        self._cache: "OrderedDict[Tuple[str, int, int], Selection]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = -1
+        self._state: Optional[_State] = None
+
+    # -- build -----------------------------------------------------------
+    @staticmethod
+    def candidate(role: Dict[str, Any]) -> bool:
+        return not (role["id"] in EXCLUDED or role.get("orchestrator") or role.get("addable") is False)
+
+    def _ensure(self) -> Tuple[int, _State]:
+        """The current registry version and the index state built for it."""
+        self.registry.refresh()
+        version = self.registry.version
+        with self._lock:
+            if version != self._version:
+                with metrics.span("specialist_index_build"):
+                    self._state = self._build()
+                self._version = version
+                self._cache.clear()
+            return self._version, self._state
+
+    def _build(self) -> _State:
+        roles = [r for r in self.registry.roles() if self.candidate(r)]
+        weights: Dict[str, Dict[str, float]] = {}
+        for r in roles:
+            for kw in self.registry.keywords(r["id"]):
+                kw = normalize(kw)
+                if len(kw) >= 2:
+                    slot = weights.setdefault(kw, {})
+                    slot[r["id"]] = max(slot.get(r["id"], 0.0), KEYWORD_WEIGHT)
+            for kw in self.builtin.get(r["id"], ()):
+                slot = weights.setdefault(normalize(kw), {})
+                slot[r["id"]] = max(slot.get(r["id"], 0.0), BUILTIN_WEIGHT)
+        patterns = list(weights) + [normalize(p) for p in MANY_PHRASES if normalize(p) not in weights]
+        # a keyword shared by many roles says less about any one of them
+        targets = [tuple((rid, w / (1.0 + math.log(len(weights[p]))))
+                         for rid, w in weights[p].items()) if p in weights else ()
+                   for p in patterns]
+        many = {normalize(p) for p in MANY_PHRASES}
+        ranker = None
+        if self.use_tfidf:
+            docs = {r["id"]: " ".join(str(r.get(k) or "") for k in
+                                      ("title", "description", "domain", "personality", "system_prompt"))
+                    for r in roles}
+            ranker = TfidfRanker.load(self.index_path, docs)
+            if ranker is None:
+                ranker = TfidfRanker(docs)
+                try:
+                    ranker.save(self.index_path)
+                except OSError:
+                    pass  # read-only checkout: keep the in-memory ranker
+        return _State(AhoCorasick(patterns), targets, [p in many for p in patterns], ranker,
+                      [r["id"] for r in roles])
+
+    # -- select ----------------------------------------------------------
+    def limit_for(self, many: bool) -> int:
+        base = max(1, min(MANY_LIMIT, _env_int("SELECT_LIMIT", DEFAULT_LIMIT)))
+        return max(base, min(MANY_LIMIT, _env_int("SELECT_LIMIT_MANY", MANY_LIMIT))) if many else base
+
+    def select(self, message: str, limit: Optional[int] = None) -> Selection:
+        """Pick the specialists for ``message``; the result is the caller's own copy."""
+        version, state = self._ensure()
+        text = normalize(message)
+        key = (text, limit or 0, version)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                metrics.inc("specialist_cache_hits_total")
+                return hit.copy()
+        metrics.inc("specialist_cache_misses_total")
+        sel = self._select(state, text, limit)
+        with self._lock:
+            self._cache[key] = sel
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return sel.copy()
+
+    def _select(self, state: _State, text: str, limit: Optional[int]) -> Selection:
+        scores: Dict[str, float] = {}
+        many = False
+        seen = set()
+        for i in state.matcher.find(text):
+            if i in seen:  # count each keyword once per message
+                continue
+            seen.add(i)
+            if state.many[i]:
+                many = True
+            for rid, w in state.targets[i]:
+                # longer keywords are more specific
+                scores[rid] = scores.get(rid, 0.0) + w * (1.0 + 0.1 * len(state.matcher.patterns[i]))
+        n = limit or self.limit_for(many)
+        ranked = sorted(scores.items(), key=lambda kv: -kv[1])[:n]
+        sel = Selection([rid for rid, _ in ranked], n, many, dict(ranked),
+                        {rid: "keyword" for rid, _ in ranked})
+        if len(sel.roles) < n and state.ranker is not None:
+            for rid, s in state.ranker.rank(text, n + len(sel.roles)):
+                if len(sel.roles) >= n:
+                    break
+                if rid not in sel.scores and s > 0.05:
+                    sel.roles.append(rid)
+                    sel.scores[rid] = round(s, 4)
+                    sel.source[rid] = "tfidf"
+        if not sel.roles or many:  # nothing matched, or a wide panel was asked for
+            for rid in DEFAULT_SPECIALISTS:
+                if rid in state.candidates and rid not in sel.source and len(sel.roles) < n:
+                    sel.roles.append(rid)
+                    sel.source[rid] = "default"
+        return sel
+
+
+_index: Optional[SpecialistIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SpecialistIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SpecialistIndex()
+        return _index
+
+
+def select_specialists(message: str, limit: Optional[int] = None) -> List[str]:
+    """Role ids to consult for ``message`` (see module docstring)."""
+    return get_index().select(message, limit).roles
@@ -0,0 +1,247 @@
+"""Multi-turn consult lane body with optional speculative follow-ups.
+
+A consult lane asks a specialist up to ``max_turns`` questions; every
+follow-up is built from the previous reply, so turns normally run strictly one
+after another.  ``SpeculativeConsult`` runs the same loop, but once the
+current reply has streamed far enough it already asks for the next follow-up
+question (from the partial reply) and starts streaming the specialist's answer
+to it in the background:
+
+  * when the early-stop check says the discussion is over, the speculative
+    turn is cancelled (its tokens are counted as wasted);
+  * when another turn is needed and the finished reply is exactly the text the
+    speculative prompt was built from (the reply ended before any more of it
+    streamed in), the speculative turn becomes the next turn and the time it
+    already ran is counted as saved; otherwise its prompt differs from the one
+    the full history would give, so it is discarded and the follow-up is asked
+    normally.
+
+The speculation starts when the partial reply reaches ``accept_ratio`` of the
+expected reply length (a moving average of this lane's replies,
+``SPECULATE_AFTER_CHARS`` before the first reply).
+
+Usage (the callables come from the conversation core)::
+
+    body = SpeculativeConsult(role_id, first_question, ask=stream_reply,
+                              next_question=make_followup, should_continue=needs_more)
+    Lane(role_id, body, provider)
+
+``ask(messages)`` is an async iterator of reply text chunks, ``next_question``
+returns the follow-up text for a history, ``should_continue(history, turn)``
+is the early-stop check (both may be sync or async).
+
+Env: ``SPECULATIVE_TURNS=1`` turns speculation on (off by default),
+``SPECULATE_ACCEPT_RATIO`` (0.7), ``SPECULATE_AFTER_CHARS`` (300).
+Outcomes are recorded in ``metrics`` (``speculative_turns_total{outcome}``,
+``speculative_wasted_tokens_total``, ``speculative_saved_seconds``) and in
+``stats`` for a quick wasted-tokens versus saved-latency comparison.
+"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from . import metrics
+
+Messages = List[Dict[str, str]]
+Ask = Callable[[Messages], AsyncIterator[str]]
+NextQuestion = Callable[[Messages], Union[str, Awaitable[str]]]
+ShouldContinue = Callable[[Messages, int], Union[bool, Awaitable[bool]]]
+Emit = Callable[[str, str], None]
+
+_WIDE = re.compile(r"[　-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per wide (CJK) character, one per four others."""
+    wide = len(_WIDE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+async def _maybe_await(value: Any) -> Any:
+    return await value if inspect.isawaitable(value) else value
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class SpeculationStats:
+    speculated: int = 0
+    accepted: int = 0
+    cancelled: int = 0          # early stop: no further turn was needed
+    discarded: int = 0          # final reply diverged too far from the partial one
+    spent_tokens: int = 0       # speculative tokens generated before the outcome was known
+    wasted_tokens: int = 0      # ... of which thrown away
+    saved_seconds: float = 0.0  # turn latency hidden behind the previous reply
+
+    def snapshot(self) -> Dict[str, Any]:
+        d = dict(self.__dict__)
+        d["saved_seconds"] = round(self.saved_seconds, 3)
+        d["wasted_tokens_per_saved_second"] = (round(self.wasted_tokens / self.saved_seconds, 1)
+                                               if self.saved_seconds else None)
+        return d
+
+
+stats = SpeculationStats()
+_stats_lock = threading.Lock()
+
+
+def _record(outcome: str, wasted: int = 0, saved: float = 0.0) -> None:
+    with _stats_lock:
+        setattr(stats, outcome, getattr(stats, outcome) + 1)
+        stats.wasted_tokens += wasted
+        stats.saved_seconds += saved
+    metrics.inc("speculative_turns_total", outcome=outcome)
+    if wasted:
+        metrics.inc("speculative_wasted_tokens_total", wasted)
+    if saved:
+        metrics.observe("speculative_saved_seconds", saved)
+
+
+class _Turn:
+    """One question/answer round whose reply streams into a buffer in the background."""
+
+    def __init__(self, owner: "SpeculativeConsult", index: int, question: str,
+                 history: Messages, speculative: bool = False, base: str = "") -> None:
+        self.owner = owner
+        self.index = index
+        self.question = question
+        self.history = history
+        self.speculative = speculative
+        self.base = base               # partial previous reply a speculative turn was built on
+        self.chunks: List[str] = []
+        self.tokens = estimate_tokens(question) if speculative else 0
+        self.current = not speculative
+        loop = asyncio.get_running_loop()
+        self.started = loop.time()
+        self.finished: Optional[float] = None
+        self.task = asyncio.create_task(self._run(history + [{"role": "user", "content": question}]))
+
+    async def _run(self, messages: Messages) -> str:
+        async for chunk in self.owner.ask(messages):
+            self.chunks.append(chunk)
+            if self.speculative:
+                self.tokens += estimate_tokens(chunk)
+            self.owner._progress(self)
+        self.finished = asyncio.get_running_loop().time()
+        return "".join(self.chunks).strip()
+
+    def partial(self) -> str:
+        return "".join(self.chunks)
+
+
+class SpeculativeConsult:
+    def __init__(self, role_id: str, first_question: str, ask: Ask,
+                 next_question: NextQuestion, should_continue: ShouldContinue,
+                 max_turns: int = 3, manager_role: str = "motivator_ai",
+                 speculate: Optional[bool] = None, accept_ratio: Optional[float] = None,
+                 after_chars: Optional[int] = None) -> None:
+        self.role_id = role_id
+        self.first_question = first_question
+        self.ask = ask
+        self.next_question = next_question
+        self.should_continue = should_continue
+        self.max_turns = max(1, max_turns)
+        self.manager_role = manager_role
+        self.speculate = _env_flag("SPECULATIVE_TURNS") if speculate is None else speculate
+        self.accept_ratio = (accept_ratio if accept_ratio is not None
+                             else float(os.getenv("SPECULATE_ACCEPT_RATIO", "0.7")))
+        self.expected_chars = float(after_chars if after_chars is not None
+                                    else int(os.getenv("SPECULATE_AFTER_CHARS", "300")))
+        self._spec: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # -- speculation -------------------------------------------------------
+    def _progress(self, turn: _Turn) -> None:
+        if (not self.speculate or not turn.current or self._spec is not None
+                or turn.index + 1 >= self.max_turns):
+            return
+        partial = turn.partial()
+        if len(partial) >= self.accept_ratio * self.expected_chars:
+            history = turn.history + [{"role": "user", "content": turn.question},
+                                      {"role": "assistant", "content": partial}]
+            self._spec = asyncio.create_task(self._speculate(turn.index + 1, history, partial))
+            self._tasks.append(self._spec)
+
+    async def _speculate(self, index: int, history: Messages, base: str) -> _Turn:
+        started = asyncio.get_running_loop().time()
+        question = await _maybe_await(self.next_question(history))
+        turn = _Turn(self, index, question, history, speculative=True, base=base)
+        turn.started = started  # the follow-up question is part of the hidden latency
+        self._tasks.append(turn.task)
+        return turn
+
+    async def _drop(self, spec: asyncio.Task, outcome: str) -> None:
+        """Cancel a speculative turn and count what it generated as wasted."""
+        wasted = 0
+        if spec.done() and not spec.cancelled() and spec.exception() is None:
+            turn = spec.result()
+            turn.task.cancel()
+            wasted = turn.tokens
+        else:
+            spec.cancel()
+        with _stats_lock:
+            stats.spent_tokens += wasted
+        _record(outcome, wasted=wasted)
+
+    async def _adopt(self, spec: asyncio.Task, reply: str, history: Messages) -> Optional[_Turn]:
+        try:
+            turn = await spec
+        except Exception:
+            return None
+        if turn.base.strip() != reply:  # built from a prefix of the reply: a different prompt
+            turn.task.cancel()
+            with _stats_lock:
+                stats.spent_tokens += turn.tokens
+            _record("discarded", wasted=turn.tokens)
+            return None
+        now = asyncio.get_running_loop().time()
+        saved = min(now, turn.finished or now) - turn.started
+        with _stats_lock:
+            stats.spent_tokens += turn.tokens
+        _record("accepted", saved=saved)
+        turn.history = history  # later turns build on the full reply
+        turn.current = True
+        self._progress(turn)    # it may already be past the trigger point
+        return turn
+
+    # -- lane body ---------------------------------------------------------
+    async def __call__(self, emit: Emit) -> None:
+        history: Messages = []
+        turn = _Turn(self, 0, self.first_question, history)
+        self._tasks.append(turn.task)
+        try:
+            for t in range(self.max_turns):
+                emit(self.manager_role, turn.question)
+                reply = await turn.task
+                emit(self.role_id, reply)
+                history = turn.history + [{"role": "user", "content": turn.question},
+                                          {"role": "assistant", "content": reply}]
+                if reply:
+                    self.expected_chars = (len(reply) if t == 0
+                                           else 0.5 * self.expected_chars + 0.5 * len(reply))
+                spec, self._spec = self._spec, None
+                if spec is not None:
+                    with _stats_lock:
+                        stats.speculated += 1
+                if t + 1 >= self.max_turns or not await _maybe_await(self.should_continue(history, t)):
+                    if spec is not None:
+                        await self._drop(spec, "cancelled")
+                    break
+                nxt = await self._adopt(spec, reply, history) if spec is not None else None
+                if nxt is None:
+                    question = await _maybe_await(self.next_question(history))
+                    nxt = _Turn(self, t + 1, question, history)
+                    self._tasks.append(nxt.task)
+                turn = nxt
+        finally:
+            for task in self._tasks:
+                if not task.done():
+                    task.cancel()
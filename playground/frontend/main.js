@@ -145,6 +145,7 @@ function closeTab(convId){
   const tabbar = document.getElementById('tabbar');
   const tab = tabbar && tabbar.querySelector(`[data-conv="${convId}"]`);
   if(tab) tab.remove();
+  unsubscribe(convId);
   // アクティブ切替
   if(activeConvId === convId){
     const next = convPanels.keys().next();
@@ -182,6 +183,7 @@ function ensurePanel(convId){
   rightRoot.prepend(consultsRoot);
   const state = { panel, streamMain, consultsRoot, inp, btn, convId, consults: new Map(), lastOptimisticUser: null, typingQueues: new Map(), titleEl, sending:false, customTitle:true, tab:null };
   convPanels.set(convId, state);
+  subscribe(convId);
   btn.addEventListener('click', (e)=>{ e.preventDefault(); send(state); });
   inp.addEventListener('keydown', (e)=>{ if(e.key==='Enter'){ e.preventDefault(); send(state); } });
   // タブも用意
@@ -252,6 +254,7 @@ function handleEvent(state, ev){
 
   let lane = ev.lane || 'main';
   if(ev.lane == null && specialistRoles.has(ev.role)){ lane = `consult:${ev.role}`; }
+  dropPartial(state, lane, ev.role);
   if(lane === 'main'){
     // 楽観的描画で表示済みのユーザー送信は重複させない
     const norm = (s)=> String(s||'').trim();
@@ -342,7 +345,79 @@ async function sendText(state, text){
   catch(e){ addMainMsg(state,'motivator_ai',`送信エラー: ${e.message}`);} finally { state.sending = false; }
 }
 
+// プッシュ配信（SSE）。会話ごとに購読し、切断時はブラウザが Last-Event-ID で自動再開する。
+// ポーリングは最初のイベントがプッシュで届くまで続ける（接続できても何も配信されない環境がある）。
+// /api/stream が使えない環境では従来の /api/feed ポーリングに切り替える。
+const streams = new Map(); // convId -> EventSource
+let pushEnabled = (typeof EventSource !== 'undefined');
+let pushDelivering = false; // プッシュでイベントを1件でも受け取ったか
+function setStatus(text){ const stTxt = document.getElementById('status'); if(stTxt) stTxt.textContent = text; }
+function subscribe(convId){
+  if(!pushEnabled || streams.has(convId) || closedConvs.has(convId)) return;
+  const es = new EventSource(`/api/stream?conv_id=${encodeURIComponent(convId)}&since=${lastEventId}`);
+  es.onopen = ()=> setStatus(`live (push) · last=${lastEventId}`);
+  es.onmessage = (m)=>{
+    let ev; try{ ev = JSON.parse(m.data); }catch(_e){ return; }
+    if(!pushDelivering){ pushDelivering = true; stopPolling(); }
+    if(closedConvs.has(ev.conv_id)) return;
+    handleEvent(ensurePanel(ev.conv_id || convId), ev);
+    setStatus(`live (push) · last=${lastEventId}`);
+  };
+  es.addEventListener('partial', (m)=>{
+    let p; try{ p = JSON.parse(m.data); }catch(_e){ return; }
+    if(closedConvs.has(p.conv_id) || !convPanels.has(p.conv_id)) return;
+    handlePartial(convPanels.get(p.conv_id), p);
+  });
+  es.onerror = ()=>{
+    // CLOSED は再接続されない（404等）。以降はポーリングで取得する
+    if(es.readyState === EventSource.CLOSED){
+      streams.delete(convId);
+      pushEnabled = false;
+      for(const s of streams.values()) s.close();
+      streams.clear();
+      pushDelivering = false;
+      startPolling();
+    } else {
+      setStatus('reconnecting...');
+    }
+  };
+  streams.set(convId, es);
+}
+function unsubscribe(convId){
+  const es = streams.get(convId);
+  if(es){ es.close(); streams.delete(convId); }
+}
+
+// 生成途中のトークン差分を仮の吹き出しに追記する（確定イベント到着で置き換え）
+function handlePartial(state, p){
+  const lane = p.lane || 'main';
+  const key = `${lane}|${p.role}`;
+  state.partials = state.partials || new Map();
+  let slot = state.partials.get(key);
+  if(!slot){
+    const div = el('div', `msg ${p.role} partial`);
+    const roleId = lane.startsWith('consult:') ? (lane.split(':')[1] || 'unknown') : null;
+    div.append(el('span','name', displayName(p.role, roleId && p.role !== 'motivator_ai' ? roleId : p.role)));
+    const body = el('div','text','');
+    div.append(body);
+    const target = roleId ? ensureConsult(state, roleId).stream : state.streamMain;
+    target.append(div);
+    slot = { div, body, target };
+    state.partials.set(key, slot);
+  }
+  slot.body.textContent += p.text || '';
+  slot.target.scrollTop = slot.target.scrollHeight;
+}
+function dropPartial(state, lane, role){
+  if(!state.partials) return;
+  const key = `${lane}|${role}`;
+  const slot = state.partials.get(key);
+  if(slot){ slot.div.remove(); state.partials.delete(key); }
+}
+
 let pollTimer = null;
+function startPolling(){ if(!pollTimer){ pollTimer = setInterval(poll, 1200); poll(); } }
+function stopPolling(){ if(pollTimer){ clearInterval(pollTimer); pollTimer = null; } }
 async function poll(){
   try{
     const data = await api(`/api/feed?since=${lastEventId}`);
@@ -725,5 +800,5 @@ window.addEventListener('DOMContentLoaded', async ()=>{
     };
   }
   await newConversation();
-  pollTimer = setInterval(poll, 1200);
+  if(!pushDelivering) startPolling();
 });
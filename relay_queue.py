@@ -0,0 +1,426 @@
+"""
+ファイル中継（Claude ⇄ ChatGPT）用の永続キューとワーカープール。
+
+監視ハンドラーは変更を検知したら内容をそのままキューに積むだけ（enqueue）で戻り、
+実際の処理（LLM 応答・input_chatgpt.txt への書き込み・Claude CLI の実行）はワーカースレッドが
+キューから1件ずつ取り出して行う（claim → 処理 → ack）。遅い Claude の実行中も監視は止まらず、
+近い時刻に来た変更も1件ずつ順に処理される。
+
+  - キューは SQLite（.cache/relay_queue.sqlite3）。プロセスが落ちても積んだジョブは残り、
+    次の起動時に続きから処理する
+  - 冪等キー: 同じキーのジョブは1回しか積まれない（同じ書き込みに対する重複イベントを吸収）。
+    ファイル由来のジョブは file_key() =（ファイル名, mtime, サイズ, 内容のハッシュ）
+  - 処理中のジョブにはリース（RELAY_LEASE 秒）を付け、処理中は定期的に延長する。
+    プロセスが落ちてリースが切れたジョブだけが再配信される
+  - 失敗したジョブは指数バックオフで再実行し、RELAY_MAX_ATTEMPTS 回で failed にする
+  - enqueue(..., supersede=True) は同じトピックの古いジョブを superseded にする（古い内容の結果が
+    不要になる LLM 応答のトピック用。転送のように全件届けるトピックでは使わない）。
+    待っているジョブは実行されず、このプロセスで処理中のジョブは Job.cancel が set される
+    （ハンドラーは current_job() から受け取り、LLM 呼び出しに渡す）
+
+環境変数:
+  RELAY_QUEUE_PATH       キューの SQLite ファイル（既定 .cache/relay_queue.sqlite3）
+  RELAY_WORKERS          トピックごとのワーカー数（既定 1 = 到着順に1件ずつ）
+  RELAY_WORKERS_<TOPIC>  トピック個別のワーカー数（例: RELAY_WORKERS_WRITER=2）
+  RELAY_LEASE            処理中ジョブのリース秒数（既定 600）
+  RELAY_MAX_ATTEMPTS     失敗時の最大試行回数（既定 3）
+  RELAY_RETENTION_DAYS   完了ジョブを残す日数（既定 7, 冪等キーの判定に使う）
+
+確認: python relay_queue.py stats | list [--status failed] | retry <id> | purge
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from singleflight import Superseded
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, ".cache", "relay_queue.sqlite3")
+POLL_INTERVAL = 1.0  # 他プロセスが積んだジョブに気付くまでの最大待ち
+
+JobHandler = Callable[[str], None]
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def file_key(path: str, content: str) -> str:
+    """ファイルの1回の書き込みを表す冪等キー。"""
+    try:
+        st = os.stat(path)
+        stamp = f"{st.st_mtime_ns}:{st.st_size}"
+    except OSError:
+        stamp = "0:0"
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+    return f"{os.path.basename(path)}:{stamp}:{digest}"
+
+
+@dataclass
+class Job:
+    id: int
+    topic: str
+    key: str
+    payload: str
+    attempts: int
+    cancel: threading.Event = field(default_factory=threading.Event)  # superseded になったら set
+
+
+class RelayQueue:
+    def __init__(self, path: Optional[str] = None, lease: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        self.path = path or os.getenv("RELAY_QUEUE_PATH") or DEFAULT_PATH
+        self.lease = float(lease if lease is not None else _env_int("RELAY_LEASE", 600))
+        self.max_attempts = max_attempts or _env_int("RELAY_MAX_ATTEMPTS", 3)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY, topic TEXT NOT NULL, key TEXT NOT NULL, payload TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, available_at REAL NOT NULL, lease_until REAL, worker TEXT,"
+            " error TEXT, finished REAL, UNIQUE(topic, key))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(topic, status, available_at, id)")
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._claimed: Dict[int, Job] = {}  # このプロセスで処理中のジョブ（取り消し用）
+
+    # -- 積む
+    def enqueue(self, topic: str, payload: str, key: Optional[str] = None,
+                supersede: bool = False) -> Optional[int]:
+        """
+        ジョブを積んで id を返す。同じ (topic, key) が既にあれば積まずに None。
+        supersede=True なら同じトピックの待ち・処理中のジョブを superseded にする。
+        """
+        key = key or hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        now = time.time()
+        stale: List[int] = []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._db.execute(
+                    "INSERT OR IGNORE INTO jobs (topic, key, payload, created, available_at)"
+                    " VALUES (?, ?, ?, ?, ?)", (topic, key, payload, now, now))
+                job_id = cur.lastrowid if cur.rowcount else None
+                if job_id is not None and supersede:
+                    stale = [r[0] for r in self._db.execute(
+                        "SELECT id FROM jobs WHERE topic = ? AND id < ? AND status IN ('queued', 'running')",
+                        (topic, job_id))]
+                    self._db.executemany(
+                        "UPDATE jobs SET status = 'superseded', finished = ?, lease_until = NULL WHERE id = ?",
+                        [(now, i) for i in stale])
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            running = [self._claimed[i] for i in stale if i in self._claimed]
+        if job_id is None:
+            metrics.inc("relay_duplicates_total", topic=topic)
+            return None
+        for job in running:
+            job.cancel.set()
+        if stale:
+            metrics.inc("relay_superseded_total", len(stale), topic=topic)
+        metrics.inc("relay_enqueued_total", topic=topic)
+        with self._cond:
+            self._cond.notify_all()
+        return job_id
+
+    # -- 取り出す
+    def claim(self, topic: str, worker: str) -> Optional[Job]:
+        """処理可能な最古のジョブ（リース切れの処理中ジョブを含む）にリースを付けて返す。"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, topic, key, payload, attempts FROM jobs WHERE topic = ? AND"
+                    " ((status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until < ?))"
+                    " ORDER BY id LIMIT 1", (topic, now, now)).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?,"
+                    " worker = ? WHERE id = ?", (now + self.lease, worker, row[0]))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            job = self._claimed[row[0]] = Job(row[0], row[1], row[2], row[3], row[4] + 1)
+        return job
+
+    def extend(self, job_id: int, worker: str) -> None:
+        with self._lock:
+            self._db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                             (time.time() + self.lease, job_id, worker))
+
+    def ack(self, job: Job) -> None:
+        # superseded になったジョブはそのまま（完了扱いにしない）
+        with self._lock:
+            self._claimed.pop(job.id, None)
+            self._db.execute("UPDATE jobs SET status = 'done', finished = ?, lease_until = NULL,"
+                             " error = NULL WHERE id = ? AND status = 'running'", (time.time(), job.id))
+
+    def nack(self, job: Job, error: str) -> None:
+        """失敗を記録し、試行回数が残っていればバックオフ後に再実行する。"""
+        failed = job.attempts >= self.max_attempts
+        delay = min(300.0, 2.0 ** job.attempts)
+        with self._lock:
+            self._claimed.pop(job.id, None)
+            self._db.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, error = ?,"
+                " finished = ? WHERE id = ? AND status = 'running'",
+                ("failed" if failed else "queued", time.time() + delay, error[:2000],
+                 time.time() if failed else None, job.id))
+
+    def release(self, job: Job) -> None:
+        """superseded で打ち切ったジョブを手放す（状態は enqueue 側で更新済み）。"""
+        with self._lock:
+            self._claimed.pop(job.id, None)
+
+    def recover(self, topics: List[str]) -> int:
+        """このマシンで終了済みのプロセスが処理中のまま残したジョブを、リース切れを待たずに戻す。"""
+        host = socket.gethostname()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, worker FROM jobs WHERE status = 'running' AND topic IN (%s)"
+                % ",".join("?" * len(topics)), tuple(topics)).fetchall()
+        orphaned = []
+        for job_id, worker in rows:
+            parts = (worker or "").split(":")
+            if len(parts) >= 2 and parts[0] == host and parts[1].isdigit() \
+                    and int(parts[1]) != os.getpid() and not _pid_alive(int(parts[1])):
+                orphaned.append(job_id)
+        with self._lock:
+            for job_id in orphaned:
+                self._db.execute("UPDATE jobs SET status = 'queued', available_at = ?, lease_until = NULL"
+                                 " WHERE id = ? AND status = 'running'", (time.time(), job_id))
+        return len(orphaned)
+
+    def wait(self, timeout: float) -> None:
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # -- 管理
+    def retry(self, job_id: int) -> bool:
+        with self._lock:
+            cur = self._db.execute("UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?,"
+                                   " error = NULL WHERE id = ? AND status = 'failed'", (time.time(), job_id))
+        with self._cond:
+            self._cond.notify_all()
+        return cur.rowcount > 0
+
+    def purge(self, days: Optional[float] = None) -> int:
+        days = days if days is not None else _env_int("RELAY_RETENTION_DAYS", 7)
+        with self._lock:
+            cur = self._db.execute("DELETE FROM jobs WHERE status IN ('done', 'superseded') AND finished < ?",
+                                   (time.time() - days * 86400,))
+        return cur.rowcount
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            rows = self._db.execute("SELECT topic, status, COUNT(*) FROM jobs GROUP BY topic, status").fetchall()
+        out: Dict[str, Dict[str, int]] = {}
+        for topic, status, n in rows:
+            out.setdefault(topic, {})[status] = n
+        return out
+
+    def jobs(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        sql = "SELECT id, topic, status, attempts, created, error, substr(payload, 1, 80) FROM jobs"
+        args: tuple = ()
+        if status:
+            sql += " WHERE status = ?"
+            args = (status,)
+        with self._lock:
+            rows = self._db.execute(sql + " ORDER BY id DESC LIMIT ?", args + (limit,)).fetchall()
+        keys = ("id", "topic", "status", "attempts", "created", "error", "payload")
+        return [dict(zip(keys, r)) for r in rows]
+
+
+# ---------------------------------------------------------------- ワーカー
+
+_handlers: Dict[str, JobHandler] = {}
+_local = threading.local()
+
+
+def register(topic: str, handler: JobHandler) -> None:
+    """トピックの処理関数を登録する（handler(payload)、例外を投げたら再実行）。"""
+    _handlers[topic] = handler
+
+
+def handlers() -> Dict[str, JobHandler]:
+    return dict(_handlers)
+
+
+def current_job() -> Optional[Job]:
+    """ハンドラーの中から、処理中のジョブ（cancel を含む）を返す。ワーカー外では None。"""
+    return getattr(_local, "job", None)
+
+
+def current_cancel() -> Optional[threading.Event]:
+    job = current_job()
+    return job.cancel if job is not None else None
+
+
+class WorkerPool:
+    """
+    トピックごとに RELAY_WORKERS 本のスレッドでジョブを処理する。
+    ワーカー1本なら到着順に1件ずつ。トピックが違えば互いを待たない。
+    """
+
+    def __init__(self, queue: RelayQueue, topic_handlers: Dict[str, JobHandler],
+                 workers: Optional[Dict[str, int]] = None):
+        self.queue = queue
+        self.handlers = topic_handlers
+        default = max(1, _env_int("RELAY_WORKERS", 1))
+        self.workers = {t: max(1, (workers or {}).get(t) or _env_int(f"RELAY_WORKERS_{t.upper()}", default))
+                        for t in topic_handlers}
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._running: Dict[int, str] = {}  # job id -> worker（リース延長用）
+        self._running_lock = threading.Lock()
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self) -> "WorkerPool":
+        recovered = self.queue.recover(list(self.workers))
+        if recovered:
+            print(f"[relay] requeued {recovered} job(s) left running by a stopped process")
+        for topic, n in self.workers.items():
+            for i in range(n):
+                t = threading.Thread(target=self._loop, args=(topic, f"{self._prefix}:{topic}#{i}"),
+                                     name=f"relay-{topic}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        hb = threading.Thread(target=self._heartbeat, name="relay-lease", daemon=True)
+        hb.start()
+        self._threads.append(hb)
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        with self.queue._cond:
+            self.queue._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def _loop(self, topic: str, worker: str) -> None:
+        handler = self.handlers[topic]
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(topic, worker)
+            except sqlite3.Error as e:
+                print(f"[relay] claim error ({topic}): {e}")
+                job = None
+            if job is None:
+                self.queue.wait(POLL_INTERVAL)
+                continue
+            with self._running_lock:
+                self._running[job.id] = worker
+            started = time.perf_counter()
+            _local.job = job
+            try:
+                if job.cancel.is_set():
+                    raise Superseded()
+                with metrics.span("relay_job", topic=topic):
+                    handler(job.payload)
+            except Superseded:
+                print(f"[relay] {topic} job {job.id} superseded by newer content")
+                self.queue.release(job)
+            except Exception as e:  # 1件の失敗でワーカーを止めない
+                print(f"[relay] {topic} job {job.id} failed (attempt {job.attempts}): {e}")
+                metrics.inc("relay_failures_total", topic=topic)
+                self.queue.nack(job, f"{type(e).__name__}: {e}")
+            else:
+                self.queue.ack(job)
+                metrics.inc("relay_done_total", topic=topic)
+            finally:
+                _local.job = None
+                with self._running_lock:
+                    self._running.pop(job.id, None)
+                metrics.observe("relay_job_total_seconds", time.perf_counter() - started, topic=topic)
+
+    def _heartbeat(self) -> None:
+        # 長い処理（Claude CLI など）のリースが切れて二重に配信されないよう延長する
+        interval = max(1.0, self.queue.lease / 3)
+        while not self._stop.wait(interval):
+            with self._running_lock:
+                running = list(self._running.items())
+            for job_id, worker in running:
+                try:
+                    self.queue.extend(job_id, worker)
+                except sqlite3.Error:
+                    pass
+
+
+_queue: Optional[RelayQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> RelayQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = RelayQueue()
+        return _queue
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="中継キューの確認・操作")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("stats", help="トピック・状態ごとの件数")
+    ls = sub.add_parser("list", help="最近のジョブ")
+    ls.add_argument("--status", choices=["queued", "running", "done", "failed", "superseded"])
+    ls.add_argument("-n", type=int, default=20)
+    rt = sub.add_parser("retry", help="failed のジョブを積み直す")
+    rt.add_argument("id", type=int)
+    sub.add_parser("purge", help="保持期間を過ぎた完了ジョブを削除")
+    args = ap.parse_args(argv)
+    q = get_queue()
+    if args.cmd == "list":
+        for j in q.jobs(args.status, args.n):
+            print(json.dumps(j, ensure_ascii=False))
+    elif args.cmd == "retry":
+        print("queued" if q.retry(args.id) else "not found (or not failed)")
+    elif args.cmd == "purge":
+        print(f"deleted {q.purge()}")
+    else:
+        print(json.dumps(q.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
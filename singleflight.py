@@ -0,0 +1,168 @@
+"""
+同じ LLM リクエストの相乗り（singleflight）と、古くなった処理の取り消し。
+
+エディタの保存が続くと同じ内容の変更イベントが何度も届き、ブリッジやオーケストレーターも
+同じプロンプトを同時に送ることがある。応答キャッシュ（llm_cache）は終わった呼び出しを再利用するが、
+まだ返っていない呼び出しには効かない。ここでは実行中の呼び出しに後から来た同じ呼び出しを相乗りさせる。
+
+  - Group.do(key, fn): 同じキーが実行中なら fn を呼ばず、その結果（例外も）を受け取る
+  - Group.stream(key, factory): ストリーミング版。上流の1本をバックグラウンドで読み、途中から
+    加わった呼び出しにもそれまでの差分を渡してから続きを流す。全員が抜けたら上流を閉じる
+
+取り消しは threading.Event で渡す（監視ルートでは relay_queue が、同じファイルの新しい内容が
+積まれた時点で処理中のジョブの Event を set する）。set されたら待つのをやめて Superseded を投げる。
+ストリームは次の差分の時点で止まるが、ストリームでない HTTP 呼び出しは途中で止められないので
+結果を捨てるだけになる。
+
+  flights = Group("llm")
+  text = flights.do(key, lambda: call_api(messages))
+  for delta in flights.stream(key, lambda usage: stream_api(messages, usage), cancel=job.cancel):
+      ...
+"""
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import metrics
+
+StreamFactory = Callable[[Dict[str, int]], Iterator[str]]
+
+
+class Superseded(Exception):
+    """同じ情報源に新しい内容が来たので、この処理の結果はもう使わない。"""
+
+
+def check(cancel: Optional[threading.Event]) -> None:
+    """cancel が set されていれば Superseded を投げる。"""
+    if cancel is not None and cancel.is_set():
+        raise Superseded("superseded by newer content")
+
+
+class _Flight:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.chunks: List[str] = []
+        self.usage: Dict[str, int] = {}
+        self.waiters = 0  # stream を読んでいる呼び出しの数
+        self.abandoned = False  # 全員が抜けた（上流を閉じる）
+
+
+class Group:
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self.calls = 0  # 上流に送った回数
+        self.shared = 0  # 相乗りした回数
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str, reader: bool = False):
+        with self._lock:
+            f = self._flights.get(key)
+            leader = f is None
+            if leader:
+                f = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.shared += 1
+            if reader:
+                f.waiters += 1
+        metrics.inc("singleflight_calls_total" if leader else "singleflight_shared_total", group=self.name)
+        return f, leader
+
+    def _forget(self, key: str, f: _Flight) -> None:
+        # 終わった呼び出しは外し、次に来た同じキーは新しく送る（結果の再利用は応答キャッシュの役目）
+        with self._lock:
+            if self._flights.get(key) is f:
+                del self._flights[key]
+
+    def _wait(self, f: _Flight, cancel: Optional[threading.Event], ready: Callable[[], bool]) -> None:
+        with f.cond:
+            while not ready():
+                if cancel is not None and cancel.is_set():
+                    return
+                f.cond.wait(0.1 if cancel is not None else None)
+
+    def do(self, key: str, fn: Callable[[], Any], cancel: Optional[threading.Event] = None) -> Any:
+        """同じキーの実行中の呼び出しがあればその結果を、無ければ fn() を呼んで返す。"""
+        f, leader = self._join(key)
+        if leader:
+            try:
+                f.result = fn()
+            except BaseException as e:
+                f.error = e
+            finally:
+                self._forget(key, f)
+                with f.cond:
+                    f.done = True
+                    f.cond.notify_all()
+        else:
+            self._wait(f, cancel, lambda: f.done)
+        check(cancel)
+        if f.error is not None:
+            raise f.error
+        return f.result
+
+    def stream(self, key: str, factory: StreamFactory, cancel: Optional[threading.Event] = None,
+               usage: Optional[Dict[str, int]] = None) -> Iterator[str]:
+        """
+        factory(usage) が返す差分を共有して流す。usage に dict を渡すと、流し終えた時点で
+        上流の usage が入る。cancel が set されるか途中で抜けると、この呼び出しだけが抜ける。
+        """
+        f, leader = self._join(key, reader=True)
+        if leader:
+            threading.Thread(target=self._produce, args=(key, f, factory),
+                             name=f"singleflight-{self.name}", daemon=True).start()
+        i = 0
+        try:
+            while True:
+                self._wait(f, cancel, lambda: f.done or i < len(f.chunks))
+                with f.cond:
+                    new, done = f.chunks[i:], f.done
+                i += len(new)
+                yield from new
+                check(cancel)
+                if done:
+                    break
+            if f.error is not None:
+                raise f.error
+            if usage is not None:
+                usage.update(f.usage)
+        finally:
+            self._leave(key, f)
+
+    def _leave(self, key: str, f: _Flight) -> None:
+        with self._lock:
+            f.waiters -= 1
+            if f.waiters > 0 or f.done:
+                return
+            f.abandoned = True
+            if self._flights.get(key) is f:
+                del self._flights[key]
+        metrics.inc("singleflight_abandoned_total", group=self.name)
+
+    def _produce(self, key: str, f: _Flight, factory: StreamFactory) -> None:
+        it = None
+        try:
+            it = factory(f.usage)
+            for chunk in it:
+                with f.cond:
+                    f.chunks.append(chunk)
+                    f.cond.notify_all()
+                if f.abandoned:
+                    break
+        except BaseException as e:
+            f.error = e
+        finally:
+            if it is not None and hasattr(it, "close"):
+                it.close()  # 上流の HTTP ストリームを閉じる（読み終えていれば何もしない）
+            self._forget(key, f)
+            with f.cond:
+                f.done = True
+                f.cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
+
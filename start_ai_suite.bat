@@ -1,8 +1,8 @@
 @echo off
 cd /d %~dp0
 
-REM Claude 出力監視を起動
-start "" python watch_claude_output.py
+REM Claude 出力監視を起動（watch_service: 1プロセスで監視）
+start "" python watch_service.py --only writer
 
 REM ChatGPT Claude Viewer を起動
 start "" python chatgpt_claude_viewer.py
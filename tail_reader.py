@@ -0,0 +1,208 @@
+"""
+追記・上書きされるテキストファイルを差分だけ読むためのユーティリティ。
+
+- TailReader:    前回の読み取り位置（バイトオフセット）を覚え、追記分だけを seek して読む。
+                 inode / サイズ / mtime が変わっていなければファイルを開かずにキャッシュを返す。
+                 読み済みの範囲のハッシュを控えておき、一致しなければ
+                 上書き・切り詰め・ローテーションとみなして先頭から読み直す
+                 （VERIFY_FULL_BYTES までは範囲全体、それより大きければ先頭から等間隔の
+                 SAMPLE_BLOCKS 個のブロックと末尾を比べる）。
+- LastBlockReader: response_log.txt のような追記ログから最後の区切り（"===="）以降を返す。
+                 区切りは mmap で末尾から逆方向に探し、追記時は新しく増えた範囲だけを探す。
+                 ログが数百 MB になっても1回のコストは最後のブロックの大きさで決まる。
+"""
+import codecs
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+VERIFY_FULL_BYTES = 1 << 20  # 読み済みの範囲がこれ以下なら全体のハッシュで上書きを検出する
+SAMPLE_BLOCKS = 64           # それより大きいときに比べるブロック数（先頭から等間隔）
+SAMPLE_BYTES = 4096          # 1ブロックの大きさ
+
+
+class _Tracked:
+    """ファイルの同一性（inode・読み済み範囲のハッシュ）を追跡する共通部分。"""
+
+    def __init__(self, path, encoding: str = "utf-8"):
+        self.path = Path(path)
+        self.encoding = encoding
+        self._forget()
+
+    def _forget(self) -> None:
+        self.offset = 0
+        self._stat_key: Optional[Tuple[int, int, int]] = None
+        self._ino: Optional[int] = None
+        self._prefix = b""  # 先頭から offset までのハッシュ
+
+    def _stat(self) -> Optional[os.stat_result]:
+        try:
+            return os.stat(self.path)
+        except OSError:
+            return None
+
+    @staticmethod
+    def _key(st: os.stat_result) -> Tuple[int, int, int]:
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    @staticmethod
+    def _digest(f, end: int) -> bytes:
+        """先頭から end バイトまでのハッシュ（大きい範囲は等間隔のブロックと末尾だけを読む）。"""
+        h = hashlib.blake2b(digest_size=16)
+        if end <= VERIFY_FULL_BYTES:
+            f.seek(0)
+            h.update(f.read(end))
+        else:
+            step = end // SAMPLE_BLOCKS
+            for i in range(SAMPLE_BLOCKS):
+                f.seek(i * step)
+                h.update(f.read(SAMPLE_BYTES))
+            f.seek(end - SAMPLE_BYTES)
+            h.update(f.read(SAMPLE_BYTES))
+        return h.digest()
+
+    def _appended_only(self, f, st: os.stat_result) -> bool:
+        """前回読んだ範囲がそのまま残っていて、後ろに追記されただけなら True。"""
+        if self.offset == 0:
+            return True
+        if self._ino is not None and st.st_ino != self._ino:
+            return False  # 置き換え（rename / ローテーション）
+        if st.st_size < self.offset:
+            return False  # 切り詰め
+        return self._digest(f, self.offset) == self._prefix  # 読み済みの範囲の書き換え
+
+    def _advance(self, f, data: bytes, st: os.stat_result) -> None:
+        self.offset += len(data)
+        self._prefix = self._digest(f, self.offset)
+        self._ino = st.st_ino
+
+
+class TailReader(_Tracked):
+    """
+    追記分だけを読むリーダー。
+
+        reader = TailReader("output_claude_writer.txt")
+        new_text, reset = reader.poll()   # 追記分（reset=True なら先頭から読み直した全文）
+        reader.text                       # 現在の全文（keep_text=True のとき）
+        reader.changed()                  # 前回から変化があったか（ファイルを開かない）
+        reader.seek_tail(2_000_000)       # 大きいファイルは末尾 2MB（行頭から）だけを最初の poll で返す
+    """
+
+    def __init__(self, path, encoding: str = "utf-8", keep_text: bool = True):
+        self.keep_text = keep_text
+        super().__init__(path, encoding)
+
+    def _forget(self) -> None:
+        super()._forget()
+        self._decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+        self.text = ""
+
+    def changed(self) -> bool:
+        st = self._stat()
+        return (self._key(st) if st else None) != self._stat_key
+
+    def poll(self) -> Tuple[str, bool]:
+        """追記された文字列と、先頭から読み直したかどうかを返す。"""
+        st = self._stat()
+        if st is None:
+            reset = self.offset > 0
+            self._forget()
+            return "", reset
+        if self._key(st) == self._stat_key:
+            return "", False
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            reset = not self._appended_only(f, st)
+            if reset:
+                self._forget()
+            f.seek(self.offset)
+            data = f.read()
+            self._advance(f, data, st)
+        # 読み終えた時点のサイズと一致しなければ、次回もう一度確認させる
+        self._stat_key = self._key(st) if self.offset == st.st_size else None
+        text = self._decoder.decode(data)
+        if self.keep_text:
+            self.text += text
+        return text, reset
+
+    def seek_tail(self, max_bytes: int) -> bool:
+        """次の poll() が末尾 max_bytes 以内を行頭から返すよう読み取り位置を進める（それ以前は読まない）。"""
+        st = self._stat()
+        if st is None or st.st_size <= max_bytes:
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(st.st_size - max_bytes)
+            f.readline()  # 行の途中から始めない
+            start = f.tell()
+            if start >= st.st_size and max_bytes > 0:
+                # 改行の無い長い行: 文字の途中（UTF-8 の継続バイト）だけは避ける
+                start = st.st_size - max_bytes
+                f.seek(start)
+                start += next((i for i, b in enumerate(f.read(4)) if b & 0xC0 != 0x80), 0)
+            self._prefix = self._digest(f, start)
+        self._decoder.reset()
+        self.text = ""
+        self.offset = start
+        self._ino = st.st_ino
+        self._stat_key = None
+        return True
+
+    def read(self) -> str:
+        """現在の全文を返す（変化が無ければファイルを開かない）。"""
+        self.poll()
+        return self.text
+
+
+class LastBlockReader(_Tracked):
+    """区切り文字列で区切られた追記ログの最後のブロックを返す。"""
+
+    def __init__(self, path, sep: str = "====", encoding: str = "utf-8"):
+        self.sep = sep.encode(encoding)
+        super().__init__(path, encoding)
+
+    def _forget(self) -> None:
+        super()._forget()
+        self._start: Optional[int] = None  # 最後のブロックの開始バイト位置
+        self._block: Optional[str] = None
+
+    def read(self) -> Optional[str]:
+        """最後の区切り以降の文字列。ファイルが無い・区切りが無ければ None。"""
+        st = self._stat()
+        if st is None:
+            self._forget()
+            return None
+        if self._key(st) == self._stat_key:
+            return self._block
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if not self._appended_only(f, st):
+                self._forget()
+            size = st.st_size
+            if size == 0:
+                self._forget()
+                self._stat_key = self._key(st)
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                size = len(m)
+                # 新しく増えた範囲（区切りをまたぐ分を含む）だけを末尾から探す
+                lo = max(0, self.offset - len(self.sep) + 1)
+                i = m.rfind(self.sep, lo, size)
+                if i >= 0:
+                    self._start = i + len(self.sep)
+                if self._start is None:
+                    self._block = None
+                else:
+                    self._block = m[self._start:size].decode(self.encoding, errors="replace")
+            # 本文はコピーせず、上書き検出用のハッシュだけ控える
+            self._prefix = self._digest(f, size)
+        self.offset = size
+        self._ino = st.st_ino
+        self._stat_key = self._key(st) if size == st.st_size else None
+        return self._block
+
+
+def last_block(path, sep: str = "====", encoding: str = "utf-8") -> Optional[str]:
+    """1回だけ使う場合の簡易版（末尾から逆方向に区切りを探す）。"""
+    return LastBlockReader(path, sep, encoding).read()
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# ルートのスクリプト（relay_queue, tail_reader …）と playground の backend パッケージを import できるようにする
+for p in (ROOT, ROOT / "playground"):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
@@ -0,0 +1,83 @@
+import threading
+
+from backend.event_store import EventStore
+
+
+def make(tmp_path=None, **kw):
+    db = str(tmp_path / "events.sqlite3") if tmp_path is not None else ""
+    return EventStore(db_path=db, **kw)
+
+
+def ids(events):
+    return [e["id"] for e in events]
+
+
+def test_since_per_conversation_and_merged():
+    s = make()
+    a1 = s.append("a", "user", "a1")["id"]
+    b1 = s.append("b", "user", "b1")["id"]
+    a2 = s.append("a", "assistant", "a2")["id"]
+    assert ids(s.since(0, "a")) == [a1, a2]
+    assert ids(s.since(a1, "a")) == [a2]
+    assert ids(s.since(0)) == [a1, b1, a2]
+    assert ids(s.since(a1)) == [b1, a2]
+    assert ids(s.since(0, limit=2)) == [a1, b1]
+    assert s.since(0, "missing") == []
+
+
+def test_per_conversation_trim_keeps_newest():
+    s = make(max_events_per_conv=3)
+    for i in range(5):
+        s.append("a", "user", str(i))
+    assert [e["text"] for e in s.conversation("a")] == ["2", "3", "4"]
+
+
+def test_least_recently_active_conversation_is_evicted():
+    s = make(max_conversations=2)
+    s.append("a", "user", "x")
+    s.append("b", "user", "x")
+    s.append("a", "user", "y")  # a is now the most recent
+    s.append("c", "user", "x")
+    assert not s.has_conversation("b")
+    assert s.has_conversation("a") and s.has_conversation("c")
+
+
+def test_listeners_see_ids_in_order():
+    s = make()
+    seen = []
+    s.on_append(lambda ev: seen.append(ev["id"]))
+    threads = [threading.Thread(target=lambda: [s.append("c", "user", "x") for _ in range(500)])
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen == sorted(seen) and len(seen) == 2000
+
+
+def test_reload_from_db_restores_and_prunes(tmp_path):
+    s = make(tmp_path, max_conversations=3, max_events_per_conv=3)
+    for conv in ("a", "b", "c"):
+        for i in range(5):
+            s.append(conv, "user", f"{conv}{i}")
+    s.drop("b")
+    rows = dict(s._db.execute("SELECT conv_id, COUNT(*) FROM events GROUP BY conv_id").fetchall())
+    assert rows == {"a": 3, "c": 3}  # trimmed rows and dropped conversations are gone from the DB too
+    s._db.close()
+
+    again = make(tmp_path, max_conversations=1, max_events_per_conv=2)
+    assert not again.has_conversation("a")
+    assert [e["text"] for e in again.conversation("c")] == ["c3", "c4"]
+    rows = dict(again._db.execute("SELECT conv_id, COUNT(*) FROM events GROUP BY conv_id").fetchall())
+    assert rows == {"c": 2}
+    # ids continue after the reloaded ones
+    assert again.append("c", "user", "next")["id"] == 16
+
+
+def test_custom_roles_persist(tmp_path):
+    s = make(tmp_path)
+    s.save_role({"id": "cust_x", "title": "X"})
+    s.save_role({"id": "cust_y", "title": "Y"})
+    s.delete_role("cust_x")
+    s._db.close()
+    assert make(tmp_path).load_roles() == [{"id": "cust_y", "title": "Y"}]
@@ -0,0 +1,163 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import relay_queue
+from relay_queue import RelayQueue, WorkerPool
+from singleflight import Superseded
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = RelayQueue(str(tmp_path / "queue.sqlite3"), lease=60, max_attempts=2)
+    yield q
+    q.close()
+
+
+def status(q, job_id):
+    return q._db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def test_enqueue_is_idempotent_per_topic_and_key(queue):
+    first = queue.enqueue("writer", "a", key="k1")
+    assert first is not None
+    assert queue.enqueue("writer", "a again", key="k1") is None
+    assert queue.enqueue("relay", "a", key="k1") is not None  # キーはトピックごと
+    assert queue.stats() == {"writer": {"queued": 1}, "relay": {"queued": 1}}
+
+
+def test_claim_is_fifo_and_leased(queue):
+    a = queue.enqueue("writer", "a")
+    b = queue.enqueue("writer", "b")
+    job = queue.claim("writer", "w1")
+    assert (job.id, job.payload, job.attempts) == (a, "a", 1)
+    assert queue.claim("writer", "w2").id == b
+    assert queue.claim("writer", "w3") is None  # 両方リース中
+    queue.ack(job)
+    assert status(queue, a) == "done"
+
+
+def test_expired_lease_is_redelivered(tmp_path):
+    q = RelayQueue(str(tmp_path / "q.sqlite3"), lease=0.05)
+    try:
+        job_id = q.enqueue("writer", "a")
+        assert q.claim("writer", "w1").id == job_id
+        assert q.claim("writer", "w2") is None
+        time.sleep(0.1)
+        again = q.claim("writer", "w2")
+        assert (again.id, again.attempts) == (job_id, 2)
+    finally:
+        q.close()
+
+
+def test_nack_backs_off_then_fails(queue):
+    job_id = queue.enqueue("writer", "a")
+    queue.nack(queue.claim("writer", "w"), "boom")
+    assert status(queue, job_id) == "queued"
+    assert queue.claim("writer", "w") is None  # バックオフ中
+    queue._db.execute("UPDATE jobs SET available_at = 0 WHERE id = ?", (job_id,))
+    job = queue.claim("writer", "w")
+    assert job.attempts == 2
+    queue.nack(job, "boom again")
+    assert status(queue, job_id) == "failed"
+    assert queue.retry(job_id)
+    assert queue.claim("writer", "w").attempts == 1
+
+
+def test_supersede_cancels_older_jobs_of_the_topic(queue):
+    running = queue.enqueue("writer", "v1", supersede=True)
+    waiting = queue.enqueue("writer", "v2")
+    other = queue.enqueue("relay", "x")
+    job = queue.claim("writer", "w")
+    assert job.id == running
+    newest = queue.enqueue("writer", "v3", supersede=True)
+    assert job.cancel.is_set()
+    assert status(queue, running) == "superseded"
+    assert status(queue, waiting) == "superseded"
+    assert status(queue, other) == "queued"
+    queue.ack(job)  # 打ち切られたジョブを done にしない
+    assert status(queue, running) == "superseded"
+    assert queue.claim("writer", "w").id == newest
+
+
+def test_supersede_duplicate_does_not_cancel(queue):
+    queue.enqueue("writer", "v1", key="same")
+    job = queue.claim("writer", "w")
+    assert queue.enqueue("writer", "v1", key="same", supersede=True) is None
+    assert not job.cancel.is_set()
+
+
+def test_recover_requeues_jobs_of_dead_local_processes(queue):
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    host = socket.gethostname()
+    dead = queue.enqueue("writer", "dead")
+    mine = queue.enqueue("writer", "mine")
+    remote = queue.enqueue("writer", "remote")
+    for job_id, worker in ((dead, f"{host}:{proc.pid}:writer#0"),
+                           (mine, f"{host}:{os.getpid()}:writer#0"),
+                           (remote, f"other-host:{proc.pid}:writer#0")):
+        queue._db.execute("UPDATE jobs SET status = 'running', lease_until = ?, worker = ? WHERE id = ?",
+                          (time.time() + 60, worker, job_id))
+    assert queue.recover(["writer"]) == 1
+    assert [status(queue, i) for i in (dead, mine, remote)] == ["queued", "running", "running"]
+
+
+def test_worker_pool_processes_in_order_and_retries(queue):
+    seen = []
+    done = threading.Event()
+    failed_once = []
+
+    def handler(payload):
+        if payload == "flaky" and not failed_once:
+            failed_once.append(payload)
+            raise RuntimeError("first attempt fails")
+        seen.append(payload)
+        if len(seen) == 3:
+            done.set()
+
+    for p in ("a", "flaky", "b"):
+        queue.enqueue("writer", p)
+    pool = WorkerPool(queue, {"writer": handler}, workers={"writer": 1}).start()
+    try:
+        deadline = time.time() + 5
+        while not failed_once and time.time() < deadline:
+            time.sleep(0.01)
+        queue._db.execute("UPDATE jobs SET available_at = 0 WHERE status = 'queued'")  # バックオフを飛ばす
+        with queue._cond:
+            queue._cond.notify_all()
+        assert done.wait(5)
+    finally:
+        pool.stop()
+    assert seen == ["a", "b", "flaky"]
+    assert queue.stats() == {"writer": {"done": 3}}
+
+
+def test_worker_pool_releases_superseded_job(queue):
+    started = threading.Event()
+
+    def handler(payload):
+        if payload == "old":
+            started.set()
+            job = relay_queue.current_job()
+            assert job.cancel.wait(5)
+            raise Superseded()
+
+    old = queue.enqueue("writer", "old")
+    pool = WorkerPool(queue, {"writer": handler}, workers={"writer": 1}).start()
+    try:
+        assert started.wait(5)
+        new = queue.enqueue("writer", "new", supersede=True)
+        deadline = time.time() + 5
+        while status(queue, new) != "done" and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+    assert status(queue, old) == "superseded"
+    assert status(queue, new) == "done"
+    assert queue._claimed == {}
@@ -0,0 +1,121 @@
+import os
+
+import pytest
+
+import tail_reader
+from tail_reader import LastBlockReader, TailReader
+
+
+def write(path, text, mode="w"):
+    with open(path, mode, encoding="utf-8", newline="") as f:
+        f.write(text)
+
+
+def test_append_returns_only_new_text(tmp_path):
+    p = tmp_path / "out.txt"
+    write(p, "hello\n")
+    r = TailReader(p)
+    assert r.poll() == ("hello\n", False)
+    assert r.poll() == ("", False)
+    write(p, "world\n", "a")
+    assert r.poll() == ("world\n", False)
+    assert r.text == "hello\nworld\n"
+
+
+def test_truncate_rereads_from_start(tmp_path):
+    p = tmp_path / "out.txt"
+    write(p, "a long first version\n")
+    r = TailReader(p)
+    r.poll()
+    write(p, "short\n")
+    assert r.poll() == ("short\n", True)
+    assert r.text == "short\n"
+
+
+def test_same_length_rewrite_then_append_is_detected(tmp_path):
+    p = tmp_path / "out.txt"
+    write(p, "x" * 400 + "middle" + "y" * 400)
+    r = TailReader(p)
+    r.poll()
+    write(p, "x" * 400 + "MIDDLE" + "y" * 400)  # 先頭・末尾は同じで長さも同じ
+    write(p, "tail", "a")
+    text, reset = r.poll()
+    assert reset
+    assert r.text == "x" * 400 + "MIDDLE" + "y" * 400 + "tail"
+
+
+def test_rewrite_in_large_file_is_detected_by_sampled_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(tail_reader, "VERIFY_FULL_BYTES", 1024)
+    monkeypatch.setattr(tail_reader, "SAMPLE_BLOCKS", 4)
+    monkeypatch.setattr(tail_reader, "SAMPLE_BYTES", 16)
+    p = tmp_path / "big.txt"
+    body = "".join(f"{i:07d}\n" for i in range(1000))  # 8000 バイト
+    write(p, body)
+    r = TailReader(p)
+    r.poll()
+    write(p, "tail", "a")
+    assert r.poll() == ("tail", False)
+    write(p, "X" * 16 + body[16:] + "tail")  # 先頭ブロック（サンプル対象）の書き換え
+    assert r.poll()[1]
+
+
+def test_replaced_file_is_reread(tmp_path):
+    p = tmp_path / "out.txt"
+    write(p, "old content\n")
+    r = TailReader(p)
+    r.poll()
+    tmp = tmp_path / "new.txt"
+    write(tmp, "old content\nplus\n")
+    os.replace(tmp, p)  # inode が変わる（ローテーション・エディタの保存）
+    assert r.poll() == ("old content\nplus\n", True)
+
+
+def test_missing_file_resets(tmp_path):
+    p = tmp_path / "out.txt"
+    write(p, "abc")
+    r = TailReader(p)
+    r.poll()
+    os.remove(p)
+    assert r.poll() == ("", True)
+    assert r.text == ""
+
+
+def test_multibyte_split_across_appends(tmp_path):
+    p = tmp_path / "out.txt"
+    data = "日本語".encode("utf-8")
+    with open(p, "wb") as f:
+        f.write(data[:4])
+    r = TailReader(p)
+    r.poll()
+    with open(p, "ab") as f:
+        f.write(data[4:])
+    r.poll()
+    assert r.text == "日本語"
+
+
+@pytest.mark.parametrize("max_bytes", [10, 25])
+def test_seek_tail_starts_at_a_line(tmp_path, max_bytes):
+    p = tmp_path / "out.txt"
+    write(p, "line-1\nline-2\nline-3\nline-4\n")
+    r = TailReader(p)
+    assert r.seek_tail(max_bytes)
+    text, reset = r.poll()
+    assert not reset and text.startswith("line-") and "line-4\n" in text
+    write(p, "line-5\n", "a")
+    assert r.poll() == ("line-5\n", False)
+
+
+def test_last_block_follows_appends_and_rewrites(tmp_path):
+    p = tmp_path / "response_log.txt"
+    write(p, "intro====first")
+    r = LastBlockReader(p)
+    assert r.read() == "first"
+    write(p, " more", "a")
+    assert r.read() == "first more"
+    write(p, "====second", "a")
+    assert r.read() == "second"
+    write(p, "intro====FIRST more====second")  # 同じ長さで書き換え
+    write(p, "====third", "a")
+    assert r.read() == "third"
+    write(p, "no separator")
+    assert r.read() is None
@@ -1,39 +1,42 @@
 # Claude ➝ ChatGPT に送信するスクリプトの例
 import os
 import time
+import relay_queue
+from tail_reader import TailReader
 
-CLAUDE_OUTPUT = "output_claude_writer.txt"
-INPUT_TO_GPT = "input_chatgpt.txt"
-LAST_FLAG = ".last_claude_writer_check"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLAUDE_OUTPUT = os.path.join(BASE_DIR, "output_claude_writer.txt")
+INPUT_TO_GPT = os.path.join(BASE_DIR, "input_chatgpt.txt")
+LAST_FLAG = os.path.join(BASE_DIR, ".last_claude_writer_check")
+
+_reader = TailReader(CLAUDE_OUTPUT)
 
 def read_latest_claude_response():
-    try:
-        with open(CLAUDE_OUTPUT, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except:
-        return ""
+    # 変化が無ければファイルを開かず、追記なら追記分だけ読む
+    return _reader.read().strip()
+
+def forward_to_chatgpt(path=None):
+    # watch_service から output_claude_writer.txt の変更ごとに呼ばれる。
+    # その時点の内容をキューに積むだけで戻り、書き込みはワーカーが deliver_to_chatgpt で行う
+    if not _reader.changed():
+        return
+    msg = read_latest_claude_response()
+    if not msg:
+        return
+    relay_queue.get_queue().enqueue("chatgpt", msg, relay_queue.file_key(CLAUDE_OUTPUT, msg))
+
+def deliver_to_chatgpt(msg):
+    print("📩 Claudeの返答をChatGPTに送信します。")
+    with open(INPUT_TO_GPT, "w", encoding="utf-8") as f:
+        f.write(msg)
+
+    with open(LAST_FLAG, "w") as f:
+        f.write(str(time.time()))
 
 def main():
-    print("🔁 Claudeの出力を監視中...")
-
-    last_time = os.path.getmtime(LAST_FLAG) if os.path.exists(LAST_FLAG) else 0
-
-    while True:
-        time.sleep(2)
-        if not os.path.exists(CLAUDE_OUTPUT):
-            continue
-
-        current_time = os.path.getmtime(CLAUDE_OUTPUT)
-        if current_time > last_time:
-            msg = read_latest_claude_response()
-            if msg:
-                print("📩 Claudeの返答をChatGPTに送信します。")
-                with open(INPUT_TO_GPT, "w", encoding="utf-8") as f:
-                    f.write(msg)
-
-                with open(LAST_FLAG, "w") as f:
-                    f.write(str(time.time()))
-                last_time = current_time
+    # 監視は watch_service に一本化（ポーリングせず変更通知で動く）
+    import watch_service
+    watch_service.main(["--only", "chatgpt"])
 
 if __name__ == "__main__":
     main()
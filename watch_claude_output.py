@@ -1,105 +1,161 @@
-import time
+import os
 import re
-import sys
-import subprocess
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
-from dotenv import load_dotenv
-from openai import OpenAI
-from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+import metrics
+import relay_queue
+from llm_providers import LLMRouter, get_router
+from multi_agent_orchestrator import OrchestratorEngine
+from singleflight import Superseded, check
+from tail_reader import TailReader
+
 # パス定義
 BASE_DIR = Path(__file__).resolve().parent
 OUTPUT_PATH = BASE_DIR / "output_claude_writer.txt"
 INPUT_PATH = BASE_DIR / "input_claude_writer.txt"
 DEFAULT_MODEL = "gpt-4o-mini"
+SYSTEM_PROMPT = "あなたは有能なアシスタントです。簡潔かつ具体的に回答してください。"
+# 1 で応答をトークン単位で input_claude_writer.txt に追記していく
+STREAM_OUTPUT = os.getenv("WATCH_STREAM", "").strip().lower() in ("1", "true", "yes", "on")
 
 
 def load_model() -> str:
-    import os
     return os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
 
 
-def build_client() -> OpenAI:
-    load_dotenv()
-    return OpenAI()
+def build_router() -> LLMRouter:
+    # .env の読み込みとクライアント生成は共有ルーター側で一度だけ行う
+    return get_router()
 
 
-def call_llm(client: OpenAI, content: str) -> str:
-    res = client.chat.completions.create(
+def call_llm(router: LLMRouter, content: str, cancel=None) -> str:
+    # 同じ内容の呼び出しが実行中なら相乗りし、cancel が set されたら Superseded
+    res = router.complete(
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ],
         model=load_model(),
-        messages=[
-            {
-                "role": "system",
-                "content": "あなたは有能なアシスタントです。簡潔かつ具体的に回答してください。"
-            },
+        temperature=0.2,
+        cancel=cancel,
+    )
+    return res.text.strip()
+
+
+def stream_llm(router: LLMRouter, content: str, cancel=None) -> Iterator[str]:
+    # call_llm のストリーミング版
+    yield from router.stream(
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": content},
         ],
+        model=load_model(),
         temperature=0.2,
+        cancel=cancel,
     )
-    return (res.choices[0].message.content or "").strip()
 
 
-def run_orchestrator(text: str, roles_csv: str = "idea_ai,writer_ai,proof_ai") -> str:
+def run_orchestrator(engine: OrchestratorEngine, text: str,
+                     roles_csv: str = "idea_ai,writer_ai,proof_ai") -> str:
     """
-    multi_agent_orchestrator.py を起動し、“=== Final ===” 以降の最終結果を返す。
-    logs は chat_cli\\logs に出るように cwd を固定。
+    常駐エンジンで同一プロセス内にパイプラインを実行し、最終結果を返す。
+    logs は engine 側で chat_cli\\logs に出る。
     """
-    script = BASE_DIR / "multi_agent_orchestrator.py"
-    if not script.exists():
-        return "[orchestrator not found: multi_agent_orchestrator.py]"
-    cmd = [sys.executable, str(script), "-i", text, "-r", roles_csv]
-    proc = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        errors="ignore",
-        cwd=str(BASE_DIR),
-    )
-    out = proc.stdout or ""
-    if "=== Final ===" in out:
-        return out.split("=== Final ===", 1)[1].strip()
-    return (out.strip() or (proc.stderr or "").strip() or "[empty output]")
+    roles = [s.strip() for s in roles_csv.split(",") if s.strip()]
+    try:
+        result = engine.run(text, roles)
+    except Exception as e:  # 役割不明・API エラーでも監視は継続
+        return f"[orchestrator error: {e}]"
+    for step in result.steps:
+        print(f"[orch] {step.role}: {len(step.output)} chars")
+    return result.final or "[empty output]"
 
 
 class Handler(FileSystemEventHandler):
-    def __init__(self, client: OpenAI):
+    def __init__(self, router: LLMRouter, engine: Optional[OrchestratorEngine] = None,
+                 stream: bool = STREAM_OUTPUT, queue: Optional[relay_queue.RelayQueue] = None):
         super().__init__()
-        self.client = client
-        self._last_content: Optional[str] = None
+        self.router = router
+        self.stream = stream
+        # [ORCH] 用エンジンは同じルーター（クライアント）を共有し、カードも一度だけ読む
+        self.engine = engine or OrchestratorEngine(router=router, model=load_model())
+        self.queue = queue or relay_queue.get_queue()
+        self._reader = TailReader(OUTPUT_PATH)
 
     def on_modified(self, event):
-        # 監視対象のみ
+        # 監視対象のみ（watch_service 経由ではデバウンス後に process() が直接呼ばれる）
         if Path(event.src_path).resolve() != OUTPUT_PATH:
             return
+        self.process()
 
-        # 書き込み直後の揺れ対策
-        time.sleep(0.15)
-
-        try:
-            content = OUTPUT_PATH.read_text(encoding="utf-8", errors="ignore").strip()
-        except Exception:
+    def process(self, path: Optional[Path] = None) -> None:
+        # 変化が無ければファイルを開かない（追記なら追記分だけ読む）
+        if not self._reader.changed():
             return
-        if not content or content == self._last_content:
+        with metrics.span("watch_file_io", op="read"):
+            content = self._reader.read().strip()
+        if not content:
             return
-        self._last_content = content
+        # 応答はワーカーが reply() で作る。同じ書き込みへの重複イベントは冪等キーで1件にまとまり、
+        # 保存が続いたときは古い内容のジョブを取り消す（待ちは実行せず、処理中の応答は打ち切る）
+        self.queue.enqueue("writer", content, relay_queue.file_key(str(OUTPUT_PATH), content), supersede=True)
 
+    def reply(self, content: str) -> None:
+        cancel = relay_queue.current_cancel()
         # [ORCH roles=...] 判定
         m = re.match(r"^\[ORCH(?:\s+roles=([^\]]+))?\]\s*(.*)$", content, re.S | re.I)
+        if self.stream:
+            self._reply_streaming(content, m, cancel)
+            return
         if m:
             roles_csv = (m.group(1) or "idea_ai,writer_ai,proof_ai").strip()
             user_text = (m.group(2) or "").strip()
-            reply = run_orchestrator(user_text, roles_csv)
+            reply = run_orchestrator(self.engine, user_text, roles_csv)
         else:
-            reply = call_llm(self.client, content)
+            reply = call_llm(self.router, content, cancel)
 
+        check(cancel)  # 新しい内容が来ていれば古い応答は書かない
         reply_text = (reply or "").strip()
-        INPUT_PATH.write_text(reply_text + "\n[STATUS:CONTINUE]", encoding="utf-8")
+        with metrics.span("watch_file_io", op="write"):
+            INPUT_PATH.write_text(reply_text + "\n[STATUS:CONTINUE]", encoding="utf-8")
         print("[wrote] input_claude_writer.txt")
 
+    def _reply_streaming(self, content: str, m: Optional[re.Match], cancel=None) -> None:
+        """応答を受信しながら input_claude_writer.txt に追記し、最後にステータス行を付ける。"""
+        with INPUT_PATH.open("w", encoding="utf-8") as f:
+            def emit(text: str) -> None:
+                print(text, end="", flush=True)
+                f.write(text)
+                f.flush()
+
+            try:
+                if m:
+                    roles_csv = (m.group(1) or "idea_ai,writer_ai,proof_ai").strip()
+                    roles = [s.strip() for s in roles_csv.split(",") if s.strip()]
+                    wrote = False
+                    for ev in self.engine.stream((m.group(2) or "").strip(), roles):
+                        check(cancel)
+                        if ev.kind == "start":
+                            print(f"\n[orch] {ev.role}", flush=True)
+                        elif ev.kind == "delta" and ev.last:
+                            # 最終結果を作る役割の出力だけをファイルに流す
+                            emit(ev.text)
+                            wrote = True
+                        elif ev.kind == "final" and not wrote:
+                            emit(ev.text)
+                else:
+                    for delta in stream_llm(self.router, content, cancel):
+                        emit(delta)
+            except Superseded:  # 途中で打ち切り（次のジョブが新しい内容で書き直す）
+                raise
+            except Exception as e:  # 途中まで書いた内容は残してエラーを追記
+                emit(f"\n[orchestrator error: {e}]" if m else f"\n[error: {e}]")
+            f.write("\n[STATUS:CONTINUE]")
+        print("\n[wrote] input_claude_writer.txt")
+
 
 def ensure_files():
     OUTPUT_PATH.touch(exist_ok=True)
@@ -110,21 +166,9 @@ def ensure_files():
 
 
 def main():
-    ensure_files()
-    client = build_client()
-
-    handler = Handler(client)
-    observer = Observer()
-    observer.schedule(handler, str(BASE_DIR), recursive=False)
-    observer.start()
-    print(f"watching {OUTPUT_PATH.name} (Ctrl+C to stop)")
-
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
+    # 監視は watch_service に一本化（writer ルートのみで起動）
+    import watch_service
+    watch_service.main(["--only", "writer"])
 
 
 if __name__ == "__main__":
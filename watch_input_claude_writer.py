@@ -1,45 +1,59 @@
 import os
 import time
 import subprocess
-
-INPUT_FILE = "input_claude_writer.txt"
-TEMP_FLAG = ".last_input_check"
-
-def get_last_modified_time(path):
+import claude_pool
+import relay_queue
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_FILE = os.path.join(BASE_DIR, "input_claude_writer.txt")
+TEMP_FLAG = os.path.join(BASE_DIR, ".last_input_check")
+# Claudeコード起動（writer-aiを想定）。入力はキューに積んだ時点の内容を標準入力で渡す
+CLAUDE_CMD = "cd ~/my-ai-team/writer-ai && claude"
+# 既定では常駐セッション（claude_pool）に送る。0 で入力ごとに CLAUDE_CMD を起動する
+USE_POOL = os.getenv("CLAUDE_POOL", "1").strip().lower() not in ("0", "false", "no", "off")
+
+def send_to_claude(path=None):
+    # watch_service から input_claude_writer.txt の変更ごとに呼ばれる。
+    # 内容をキューに積むだけで戻る（Claude の実行中も次の変更を取りこぼさない）。
+    # 送信済みかどうかは冪等キー（mtime・サイズ・内容）で判定する
     try:
-        return os.path.getmtime(path)
+        with open(INPUT_FILE, encoding="utf-8") as f:
+            text = f.read()
     except FileNotFoundError:
-        return 0
+        return
+    if not text.strip():
+        return
+    relay_queue.get_queue().enqueue("claude", text, relay_queue.file_key(INPUT_FILE, text))
+
+def run_claude(text):
+    # ワーカーから1件ずつ呼ばれる。失敗（終了コード != 0）はキュー側で再実行
+    print("🆕 新しい入力を検出しました。Claudeに送信中...")
+
+    if USE_POOL:
+        reply = claude_pool.get_pool("writer").ask(text)
+        print(reply.text)
+        if reply.is_error:
+            raise RuntimeError(f"claude returned an error: {reply.text[:200]}")
+    else:
+        subprocess.run(["wsl", "-e", "bash", "-c", CLAUDE_CMD], input=text.encode("utf-8"), check=True)
+
+    # チェックタイム更新
+    with open(TEMP_FLAG, "w") as f:
+        f.write(str(time.time()))
+
+def warm_up():
+    # 監視開始時にセッションを起動しておき、最初の入力で起動を待たない
+    # 起動できなくても監視は止めない（最初の入力で起動し直し、失敗はキューのリトライに任せる）
+    if USE_POOL:
+        try:
+            claude_pool.get_pool("writer").start()
+        except claude_pool.ClaudeSessionError as e:
+            print(f"⚠️ Claude セッションを起動できませんでした: {e}")
 
 def main():
-    print(f"👀 Monitoring {INPUT_FILE} for updates...")
-
-    last_checked = get_last_modified_time(TEMP_FLAG)
-
-    while True:
-        time.sleep(2)  # 2秒間隔でチェック
-
-        if not os.path.exists(INPUT_FILE):
-            continue
-
-        current_mtime = get_last_modified_time(INPUT_FILE)
-
-        if current_mtime > last_checked:
-            print("🆕 新しい入力を検出しました。Claudeに送信中...")
-
-            # Claudeコード起動（writer-aiを想定）
-            subprocess.run([
-                "wsl",
-                "-e",
-                "bash",
-                "-c",
-                "cd ~/my-ai-team/writer-ai && cat ~/chat_cli/input_claude_writer.txt | claude"
-            ])
-
-            # チェックタイム更新
-            with open(TEMP_FLAG, "w") as f:
-                f.write(str(time.time()))
-            last_checked = current_mtime
+    # 監視は watch_service に一本化（ポーリングせず変更通知で動く）
+    import watch_service
+    watch_service.main(["--only", "claude"])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,201 @@
+"""
+監視サービス（1プロセス・1 Observer）。
+
+これまで個別に動いていた監視スクリプトをまとめ、chat_cli フォルダを watchdog で1回だけ監視して
+変更されたファイルごとにハンドラーへ振り分ける。固定の sleep ではなく、書き込みが落ち着くまで
+（WATCH_DEBOUNCE 秒, 既定 0.15）待ってからハンドラーを1回だけ呼ぶ。
+
+writer / chatgpt / claude / relay はその時点の内容を永続キュー（relay_queue）に積むだけで戻り、
+LLM 応答・転送・Claude CLI の実行はトピックごとのワーカーが行う（RELAY_WORKERS）。
+writer（LLM 応答）だけは、処理中に新しい内容が積まれたら古い内容のジョブを取り消す（superseded）。
+転送・Claude CLI の実行（chatgpt / claude / relay）は取り消さず、積んだ内容を1件ずつすべて処理する。
+
+  ルート名   監視ファイル               処理
+  writer     output_claude_writer.txt   LLM / [ORCH] で応答 → input_claude_writer.txt
+  chatgpt    output_claude_writer.txt   input_chatgpt.txt へ転送
+  idea       output_claude_idea.txt     内容を表示
+  proof      output_claude_proof.txt    内容を表示
+  claude     input_claude_writer.txt    Claude CLI へ送信
+  relay      claude_output.txt          ChatGPT の返答を claude_input.txt へ
+
+使い方: python watch_service.py [--only writer,chatgpt,...]
+"""
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+import metrics
+import relay_queue
+
+BASE_DIR = Path(__file__).resolve().parent
+DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE", "0.15"))
+
+FileHandler = Callable[[Path], None]
+
+
+def _key(path) -> str:
+    # Windows の大文字小文字・区切り文字の違いを吸収
+    return os.path.normcase(os.path.abspath(str(path)))
+
+
+class Debouncer:
+    """
+    パスごとに最後のイベントから delay 秒静かになったらコールバックを1回呼ぶ。
+    同じパスのコールバックは直列に実行し、実行中に来た変更は完了後に処理する。
+    """
+
+    def __init__(self, delay: float = DEBOUNCE_SECONDS):
+        self.delay = delay
+        self._timers: Dict[str, threading.Timer] = {}
+        self._running: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def trigger(self, key: str, callback: Callable[[], None]) -> None:
+        with self._lock:
+            old = self._timers.get(key)
+            if old is not None:
+                old.cancel()
+            t = threading.Timer(self.delay, self._fire, args=(key, callback))
+            t.daemon = True
+            self._timers[key] = t
+            self._running.setdefault(key, threading.Lock())
+        t.start()
+
+    def _fire(self, key: str, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self._timers.pop(key, None)
+            run_lock = self._running[key]
+        name = Path(key.split("#")[0]).name
+        with run_lock:
+            try:
+                with metrics.span("watch_handler", file=name):
+                    callback()
+            except Exception as e:  # 1ハンドラーの失敗で監視全体を止めない
+                print(f"[watch] handler error ({name}): {e}")
+
+    def cancel_all(self) -> None:
+        with self._lock:
+            for t in self._timers.values():
+                t.cancel()
+            self._timers.clear()
+
+
+class RoutingHandler(FileSystemEventHandler):
+    """ファイル → ハンドラーの対応表でイベントを振り分ける。"""
+
+    def __init__(self, debouncer: Optional[Debouncer] = None):
+        super().__init__()
+        self.routes: Dict[str, List[FileHandler]] = {}
+        self.debouncer = debouncer or Debouncer()
+
+    def add(self, path: Path, handler: FileHandler) -> None:
+        self.routes.setdefault(_key(path), []).append(handler)
+
+    def dispatch(self, event):
+        if getattr(event, "is_directory", False):
+            return
+        # エディタの保存（一時ファイル→rename）にも反応するよう移動先も見る
+        for p in (getattr(event, "src_path", None), getattr(event, "dest_path", None)):
+            if p:
+                self._route(p)
+
+    def _route(self, path: str) -> None:
+        key = _key(path)
+        handlers = self.routes.get(key)
+        if not handlers:
+            return
+        target = Path(path)
+        # 同じファイルの複数ハンドラーは互いに待たせない（ハンドラー単位で直列化）
+        for i, h in enumerate(handlers):
+            self.debouncer.trigger(f"{key}#{i}", lambda h=h: h(target))
+
+
+def build_routes(only: Optional[List[str]] = None) -> Dict[str, tuple]:
+    """ルート名 → (監視ファイル, ハンドラー)。ハンドラーのモジュールは必要な分だけ読み込む。"""
+    routes: Dict[str, tuple] = {}
+    want = set(only) if only else None
+
+    def use(name: str) -> bool:
+        return want is None or name in want
+
+    if use("writer"):
+        import watch_claude_output as w
+        w.ensure_files()
+        handler = w.Handler(w.build_router())
+        routes["writer"] = (w.OUTPUT_PATH, handler.process)
+        relay_queue.register("writer", handler.reply)
+    if use("chatgpt"):
+        import watch_chatgpt_to_claude as c
+        routes["chatgpt"] = (Path(c.CLAUDE_OUTPUT), c.forward_to_chatgpt)
+        relay_queue.register("chatgpt", c.deliver_to_chatgpt)
+    if use("idea"):
+        import watch_claude_output_idea as i
+        routes["idea"] = (Path(i.FOLDER) / i.FILE_NAME, i.print_output)
+    if use("proof"):
+        import watch_claude_output_proof as p
+        routes["proof"] = (Path(p.FOLDER) / p.FILE_NAME, p.print_output)
+    if use("claude"):
+        import watch_input_claude_writer as ci
+        routes["claude"] = (Path(ci.INPUT_FILE), ci.send_to_claude)
+        relay_queue.register("claude", ci.run_claude)
+        ci.warm_up()
+    if use("relay"):
+        import multi_bridge_claude_chatgpt as mb
+        routes["relay"] = (Path(mb.CLAUDE_OUTPUT), mb.relay_claude_output)
+        relay_queue.register("relay", mb.relay_reply)
+    unknown = (want or set()) - set(routes)
+    if unknown:
+        raise SystemExit(f"unknown route: {', '.join(sorted(unknown))}")
+    return routes
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="chat_cli の監視をまとめて1プロセスで実行")
+    ap.add_argument("--only", default="",
+                    help="起動するルート（カンマ区切り: writer,chatgpt,idea,proof,claude,relay）")
+    args = ap.parse_args(argv)
+    only = [s.strip() for s in args.only.split(",") if s.strip()] or None
+
+    routing = RoutingHandler()
+    for name, (path, handler) in build_routes(only).items():
+        routing.add(path, handler)
+        print(f"[watch] {name}: {Path(path).name}")
+
+    port = int(os.getenv("METRICS_PORT", "0") or 0)
+    if port:
+        metrics.serve(port)
+        print(f"[watch] metrics: http://127.0.0.1:{port}/metrics")
+
+    # 前回の終了時に残ったジョブもここから処理を再開する
+    pool = None
+    topics = relay_queue.handlers()
+    if topics:
+        queue = relay_queue.get_queue()
+        queue.purge()
+        pool = relay_queue.WorkerPool(queue, topics).start()
+        print(f"[watch] relay queue: {queue.path} ({', '.join(f'{t}x{n}' for t, n in pool.workers.items())})")
+
+    observer = Observer()
+    observer.schedule(routing, str(BASE_DIR), recursive=False)
+    observer.start()
+    print("watching (Ctrl+C to stop)")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        observer.stop()
+        routing.debouncer.cancel_all()
+        if pool is not None:
+            pool.stop()
+    observer.join()
+
+
+if __name__ == "__main__":
+    main()